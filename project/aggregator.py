@@ -1,14 +1,33 @@
-import helpers.yaml_helpers.yaml_writer as generator
-import helpers.yaml_helpers.yaml_processor as aggregator
-import helpers.cache_helpers.cacher as cacher
-import helpers.scheduler_helpers.scheduler as scheduler
+from helpers.import_helpers.lazy_import import lazy_import
 import argparse
 import logging
 import time
 import os
 
-
-def config_logging():
+# Imported on first use, so --help, -np and cron style runs only pay for
+# the stages they actually run
+generator = lazy_import("helpers.yaml_helpers.yaml_writer")
+aggregator = lazy_import("helpers.yaml_helpers.yaml_processor")
+executors = lazy_import("helpers.yaml_helpers.executor_helper")
+store = lazy_import("helpers.cache_helpers.entry_store")
+search_index = lazy_import("helpers.cache_helpers.search_index")
+cacher = lazy_import("helpers.cache_helpers.cacher")
+scheduler = lazy_import("helpers.scheduler_helpers.scheduler")
+daemon = lazy_import("helpers.scheduler_helpers.daemon")
+run_state = lazy_import("helpers.yaml_helpers.run_state")
+config_watcher = lazy_import("helpers.yaml_helpers.config_watcher")
+metrics_server = lazy_import("helpers.metrics_helpers.metrics_server")
+feed_server = lazy_import("helpers.feed_helpers.feed_server")
+websub = lazy_import("helpers.feed_helpers.websub")
+feed_health = lazy_import("helpers.cache_helpers.feed_health")
+profiler = lazy_import("helpers.metrics_helpers.profiler")
+shard_helper = lazy_import("helpers.yaml_helpers.shard_helper")
+log_pipeline = lazy_import("helpers.log_helpers.log_pipeline")
+asyncio = lazy_import("asyncio")
+
+
+def config_logging(log_options=None):
+    log_options = log_options or {}
     current_time = time.strftime("%Y-%m-%d_%H-%M-%S")
     log_filename = f"log_{current_time}.log"
     log_folder = "logs"
@@ -17,11 +36,12 @@ def config_logging():
     if not os.path.exists(log_folder):
         os.makedirs(log_folder)
 
-    logging.basicConfig(
-        filename=log_path,
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        filemode="w",
+    # Every process logs through a queue to one background writer
+    log_pipeline.setup_logging(
+        log_path,
+        log_options.get("level", logging.INFO),
+        log_options.get("stage_levels"),
+        log_options.get("format", "json"),
     )
 
 
@@ -32,11 +52,16 @@ def scheduler_run(
     entries_only=True,
     parsing=True,
     filepath=None,
+    writer_options=None,
+    executor_options=None,
+    config_check=None,
 ):
     """
     Run the RSS Feed Aggregator at a set interval.
+    The HTTP session and executor pools stay warm between runs, and a
+    changed config (YAML file or Airtable table) is picked up before the
+    next run, resetting only the cached state of the changed slugs.
     """
-    config_logging()
 
     # Scheduler always using caching
     caching = True
@@ -57,26 +82,222 @@ def scheduler_run(
 
     wait_schedule = scheduler.scheduler(total_time, interval_time)
 
-    if not filepath:
-        logging.info("")
-        generator.generate_yaml()
-        filepath = "yaml_config/rss_config.yaml"
+    cacher.setup_database()
+    feed_health.setup_health()
+
+    writer_options = writer_options or {}
+    if writer_options.get("store"):
+        store.setup_store()
+    if writer_options.get("index"):
+        search_index.setup_index()
+
+    # Without a yaml file the config is synced from Airtable every
+    # config_check seconds
+    watcher = config_watcher.ConfigWatcher(
+        filepath or generator.YAML_FILEPATH,
+        not filepath,
+        config_check or config_watcher.AIRTABLE_CHECK_SECONDS,
+    )
 
-    running = True
-    while running:
-        try:
-            run_(caching, entries_only, parsing, filepath, output_folder)
-            logging.info("")
-            logging.info("")
-            logging.info(f"Sleeping for {interval_time} seconds")
+    state = run_state.RunState(executor_options)
+    # One loop for every run, the warm session and pools are bound to it
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    try:
+        running = True
+        while running:
+            try:
+                start_time = time.time()
+                logging.info("")
+                logging.info(
+                    f"Starting RSS Feed Aggregator at {time.strftime('%H-%M-%S')}"
+                )
+                logging.info("")
+
+                watcher.check()
+                state.config = watcher.config
+
+                if parsing:
+                    loop.run_until_complete(
+                        aggregator.process_yaml_async(
+                            caching,
+                            entries_only,
+                            watcher.filepath,
+                            watcher.generation_time,
+                            output_folder,
+                            writer_options,
+                            state,
+                        )
+                    )
+
+                logging.info(
+                    f"Duration of run:      {time.time() - start_time: .2f} seconds"
+                )
+                logging.info("")
+                logging.info("")
+                logging.info(f"Sleeping for {interval_time} seconds")
+                logging.info("")
+                logging.info("")
+                running = next(wait_schedule)
+
+            except StopIteration:
+                running = False
+
+        loop.run_until_complete(state.close())
+
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    logging.info(f"Ending Scheduler at {time.strftime('%Y-%m-%d_%H-%M-%S')}")
+
+
+def daemon_run(
+    interval_time,
+    total_time=None,
+    jitter=0,
+    entries_only=True,
+    filepath=None,
+    writer_options=None,
+    executor_options=None,
+    metrics_port=None,
+    config_check=None,
+    serve_options=None,
+    websub_options=None,
+):
+    """
+    Run the RSS Feed Aggregator as a long running daemon at a fixed rate.
+    The HTTP session, executor pools and cache stay warm between runs,
+    SIGTERM stops after the current run and SIGHUP reloads the config.
+    With metrics_port, Prometheus metrics are served over HTTP, with
+    serve_options the latest outputs are. With websub_options, feeds with
+    a WebSub hub are pushed instead of polled.
+    """
+
+    # Daemon always using caching
+    caching = True
+    start_time_formatted = time.strftime("%Y-%m-%d_%H-%M-%S")
+
+    logging.info(f"Starting Daemon at {start_time_formatted}")
+
+    output_folder = f"schedule_{start_time_formatted}"
+    output_folder_path = os.path.join("rss_feeds", output_folder)
+
+    if not os.path.exists(output_folder_path):
+        os.makedirs(output_folder_path)
+
+    cacher.setup_database()
+    feed_health.setup_health()
+
+    writer_options = writer_options or {}
+    if writer_options.get("store"):
+        store.setup_store()
+    if writer_options.get("index"):
+        search_index.setup_index()
+
+    # A changed yaml file is picked up before the next run, without one the
+    # config is synced from Airtable every config_check seconds and SIGHUP
+    # syncs it before the next run
+    watcher = config_watcher.ConfigWatcher(
+        filepath or generator.YAML_FILEPATH,
+        not filepath,
+        config_check or config_watcher.AIRTABLE_CHECK_SECONDS,
+    )
+
+    async def run_daemon():
+        state = run_state.RunState(executor_options, jitter)
+        runners = []
+        if metrics_port:
+            runners.append(
+                await metrics_server.start_metrics_server(state, metrics_port)
+            )
+        if serve_options:
+            state.feed_cache = feed_server.FeedCache(
+                serve_options["cache_mb"] or feed_server.CACHE_MB
+            )
+            await asyncio.to_thread(state.feed_cache.seed)
+            runners.append(
+                await feed_server.start_feed_server(
+                    state.feed_cache,
+                    serve_options["port"],
+                    serve_options["host"],
+                )
+            )
+        if websub_options:
+
+            async def on_push(url, body, content_type):
+                await aggregator.process_push(
+                    url,
+                    body,
+                    content_type,
+                    caching,
+                    entries_only,
+                    output_folder,
+                    writer_options,
+                    state,
+                )
+
+            state.websub = websub.WebSub(
+                websub_options["callback_url"]
+                or f"http://{websub_options['host']}:{websub_options['port']}",
+                interval_time,
+                on_push,
+            )
+            runners.append(
+                await websub.start_websub_server(
+                    state.websub,
+                    websub_options["port"],
+                    websub_options["host"],
+                )
+            )
+
+        async def run_tick(tick):
+            start_time = time.time()
             logging.info("")
+            logging.info(f"Starting run {tick} at {time.strftime('%H-%M-%S')}")
             logging.info("")
-            running = next(wait_schedule)
 
-        except StopIteration:
-            running = False
+            await asyncio.to_thread(watcher.check)
+            state.config = watcher.config
+
+            run = aggregator.process_yaml_async(
+                caching,
+                entries_only,
+                watcher.filepath,
+                watcher.generation_time,
+                output_folder,
+                writer_options,
+                state,
+            )
+
+            if state.websub is None:
+                await run
+            else:
+                # Pushes wait for the tick, both write the same outputs
+                async with state.websub.lock:
+                    await run
+                await state.websub.maintain(state.get_session(), state.config)
+
+            logging.info(
+                f"Duration of run {tick}: {time.time() - start_time: .2f} seconds"
+            )
 
-    logging.info(f"Ending Scheduler at {time.strftime('%Y-%m-%d_%H-%M-%S')}")
+        try:
+            await daemon.Daemon(
+                run_tick, interval_time, total_time, watcher.request_reload
+            ).run()
+        finally:
+            for runner in runners:
+                await runner.cleanup()
+            if state.websub is not None:
+                await state.websub.close()
+            await state.close()
+
+    asyncio.run(run_daemon())
+
+    logging.info(f"Ending Daemon at {time.strftime('%Y-%m-%d_%H-%M-%S')}")
 
 
 def run_(
@@ -85,6 +306,8 @@ def run_(
     parsing=True,
     filepath=None,
     output_folder=None,
+    writer_options=None,
+    executor_options=None,
 ):
     """
     Run the RSS Feed Aggregator.
@@ -105,6 +328,13 @@ def run_(
     logging.info("")
 
     cacher.setup_database()
+    feed_health.setup_health()
+
+    writer_options = writer_options or {}
+    if writer_options.get("store"):
+        store.setup_store()
+    if writer_options.get("index"):
+        search_index.setup_index()
 
     yaml_generation_time = None
     if not filepath:
@@ -124,6 +354,8 @@ def run_(
             filepath,
             yaml_generation_time,
             output_folder,
+            writer_options,
+            executor_options,
         )
 
     endtime = time.time()
@@ -135,6 +367,80 @@ def run_(
     logging.info("")
 
 
+def rerender_run(
+    entries_only=True,
+    writer_options=None,
+    executor_options=None,
+    filepath=None,
+):
+    """
+    Render all outputs from the entry store without fetching.
+    """
+    start_time_formatted = time.strftime("%Y-%m-%d_%H-%M-%S")
+
+    output_folder = f"render_{start_time_formatted}"
+    output_folder_path = os.path.join("rss_feeds", output_folder)
+
+    if not os.path.exists(output_folder_path):
+        os.makedirs(output_folder_path)
+
+    logging.info(f"Starting entry store render at {start_time_formatted}")
+
+    cacher.setup_database()
+    store.setup_store()
+    aggregator.render_store(
+        entries_only, output_folder, writer_options, executor_options, filepath
+    )
+
+
+def merge_run(
+    shard_dir,
+    caching=False,
+    entries_only=True,
+    writer_options=None,
+    executor_options=None,
+):
+    """
+    Write the final outputs from the partial results of every shard.
+    """
+    start_time_formatted = time.strftime("%Y-%m-%d_%H-%M-%S")
+
+    output_folder = f"merge_{start_time_formatted}"
+    output_folder_path = os.path.join("rss_feeds", output_folder)
+
+    if not os.path.exists(output_folder_path):
+        os.makedirs(output_folder_path)
+
+    logging.info(f"Starting shard merge at {start_time_formatted}")
+
+    cacher.setup_database()
+
+    writer_options = writer_options or {}
+    if writer_options.get("store"):
+        store.setup_store()
+    if writer_options.get("index"):
+        search_index.setup_index()
+
+    aggregator.merge_shards(
+        shard_dir,
+        caching,
+        entries_only,
+        output_folder,
+        writer_options,
+        executor_options,
+    )
+
+
+def call_run(profile_dir, func, *args, **kwargs):
+    """
+    Call a run mode, under cProfile when profiling is enabled.
+    """
+
+    if profile_dir:
+        return profiler.run_profiled(profile_dir, func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+
 def cli_main():
     """
     Run the RSS Feed Aggregator from the command line.
@@ -183,6 +489,280 @@ def cli_main():
         default=False,
         help="Schedule aggregator to run at a set interval. -s <total_time> <interval_time>",
     )
+    parser.add_argument(
+        "-d",
+        "--daemon",
+        type=float,
+        default=None,
+        dest="daemon",
+        help="Run as a daemon every INTERVAL seconds until SIGTERM",
+    )
+    parser.add_argument(
+        "--daemon_total",
+        type=float,
+        default=None,
+        dest="daemon_total",
+        help="Stop the daemon after this many seconds",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0,
+        dest="jitter",
+        help="Spread feed fetches over up to this many seconds per run",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=None,
+        dest="metrics_port",
+        help="Serve Prometheus metrics on this port in daemon mode",
+    )
+    parser.add_argument(
+        "--serve_port",
+        type=int,
+        default=None,
+        dest="serve_port",
+        help="Serve the latest output of every slug on this port in daemon "
+        "mode",
+    )
+    parser.add_argument(
+        "--serve_host",
+        type=str,
+        default="127.0.0.1",
+        dest="serve_host",
+        help="Address the feed server listens on (default: 127.0.0.1)",
+    )
+    parser.add_argument(
+        "--serve_cache_mb",
+        type=float,
+        default=None,
+        dest="serve_cache_mb",
+        help="Memory for cached feed bodies of the feed server (default: 64)",
+    )
+    parser.add_argument(
+        "--websub_port",
+        type=int,
+        default=None,
+        dest="websub_port",
+        help="Subscribe to the WebSub hubs feeds advertise and receive their "
+        "pushes on this port in daemon mode",
+    )
+    parser.add_argument(
+        "--websub_host",
+        type=str,
+        default="127.0.0.1",
+        dest="websub_host",
+        help="Address the WebSub callback server listens on "
+        "(default: 127.0.0.1)",
+    )
+    parser.add_argument(
+        "--websub_callback",
+        type=str,
+        default=None,
+        dest="websub_callback",
+        help="Public base URL hubs reach the callback server at "
+        "(default: http://<websub_host>:<websub_port>)",
+    )
+    parser.add_argument(
+        "--config_check",
+        type=float,
+        default=None,
+        dest="config_check",
+        help="Seconds between Airtable config syncs in scheduler and daemon "
+        "mode (default: 300)",
+    )
+
+    parser.add_argument(
+        "--demote_feeds",
+        default=False,
+        action="store_true",
+        dest="demote_feeds",
+        help="Poll failing or slow URLs less often and skip disabled ones "
+        "(see health.py)",
+    )
+    parser.add_argument(
+        "--stream",
+        default=False,
+        action="store_true",
+        dest="stream",
+        help="Stream feeds through bounded queues, writing each slug as "
+        "soon as all of its URLs are parsed",
+    )
+    parser.add_argument(
+        "--memory_limit_mb",
+        type=float,
+        default=None,
+        dest="memory_limit_mb",
+        help="Feed data held in memory before fetching is throttled in "
+        "streaming mode (default 256)",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=None,
+        dest="queue_size",
+        help="Size of the stage queues and number of concurrent fetches "
+        "in streaming mode (default 32)",
+    )
+    parser.add_argument(
+        "--profile",
+        default=False,
+        action="store_true",
+        dest="profile",
+        help="Profile the run and its pool workers into profiles/",
+    )
+    parser.add_argument(
+        "-w",
+        "--writer",
+        type=str,
+        choices=["stream", "et"],
+        default="stream",
+        dest="writer",
+        help="Atom writer used with --valid_rss, stream (default) or et",
+    )
+    parser.add_argument(
+        "--max_entries",
+        type=int,
+        default=None,
+        dest="max_entries",
+        help="Keep at most this many entries per output when caching",
+    )
+    parser.add_argument(
+        "--max_age_days",
+        type=float,
+        default=None,
+        dest="max_age_days",
+        help="Drop entries older than this many days when caching",
+    )
+    parser.add_argument(
+        "-f",
+        "--formats",
+        type=lambda value: [name.strip() for name in value.split(",")],
+        default=None,
+        dest="formats",
+        help="Comma separated output formats: entries, atom, rss, jsonfeed, ndjson",
+    )
+    parser.add_argument(
+        "--ndjson_stdout",
+        default=False,
+        action="store_true",
+        dest="ndjson_stdout",
+        help="Stream new entries to stdout as NDJSON while writing",
+    )
+    parser.add_argument(
+        "--always_write",
+        default=True,
+        action="store_false",
+        dest="skip_unchanged",
+        help="Rewrite outputs even when their content did not change",
+    )
+    parser.add_argument(
+        "--compress",
+        default=False,
+        action="store_true",
+        dest="compress",
+        help="Also write .gz (and .br) outputs with ETag sidecars",
+    )
+    parser.add_argument(
+        "--store",
+        default=False,
+        action="store_true",
+        dest="store",
+        help="Keep matches in the SQLite entry store and render outputs from it",
+    )
+    parser.add_argument(
+        "--rerender",
+        default=False,
+        action="store_true",
+        dest="rerender",
+        help="Only re-render every output from the entry store",
+    )
+    parser.add_argument(
+        "--index",
+        default=False,
+        action="store_true",
+        dest="index",
+        help="Add matched entries to the full-text search index (search.py)",
+    )
+    parser.add_argument(
+        "--deltas",
+        default=False,
+        action="store_true",
+        dest="deltas",
+        help="Also write the entries new since the last run and a change "
+        "manifest to rss_feeds/deltas/, with latest.json pointing at the "
+        "newest",
+    )
+    parser.add_argument(
+        "--shard",
+        type=lambda value: shard_helper.parse_shard(value),
+        default=None,
+        dest="shard",
+        help="Only fetch and parse the URLs of shard i of N (i/N), writing "
+        "partial results for --merge_shards",
+    )
+    parser.add_argument(
+        "--shard_dir",
+        type=str,
+        default=None,
+        dest="shard_dir",
+        help="Folder of the shard partial results (default: rss_feeds/shards)",
+    )
+    parser.add_argument(
+        "--merge_shards",
+        default=False,
+        action="store_true",
+        dest="merge_shards",
+        help="Only merge the shard partial results into the final outputs",
+    )
+
+    for stage in ["parse", "write"]:
+        parser.add_argument(
+            f"--{stage}_executor",
+            type=str,
+            choices=executors.BACKENDS,
+            default="auto",
+            dest=f"{stage}_executor",
+            help=f"Execution backend of the {stage} stage (default: auto)",
+        )
+        parser.add_argument(
+            f"--{stage}_workers",
+            type=int,
+            default=None,
+            dest=f"{stage}_workers",
+            help=f"Number of workers of the {stage} stage",
+        )
+        parser.add_argument(
+            f"--{stage}_chunksize",
+            type=int,
+            default=None,
+            dest=f"{stage}_chunksize",
+            help=f"Items per task of the {stage} stage with a process pool",
+        )
+
+    parser.add_argument(
+        "--log_format",
+        type=str,
+        choices=["json", "text"],
+        default="json",
+        help="Log records as JSON lines tagged with the stage, slug and URL, "
+        "or as text lines (default: json)",
+    )
+    parser.add_argument(
+        "--log_level",
+        type=str.upper,
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default="INFO",
+        help="Lowest level logged (default: INFO)",
+    )
+    parser.add_argument(
+        "--stage_log_levels",
+        type=str,
+        default=None,
+        help="Levels of single stages over --log_level, e.g. "
+        "fetch=WARNING,parse=ERROR (stages: main, fetch, parse, write)",
+    )
 
     args = parser.parse_args()
 
@@ -190,6 +770,11 @@ def cli_main():
         print(f"Error: The provided yaml file '{args.yaml}' does not exist.")
         return
 
+    try:
+        stage_levels = log_pipeline.parse_stage_levels(args.stage_log_levels)
+    except ValueError as e:
+        parser.error(f"--stage_log_levels: {e}")
+
     # Default is not to cache
     caching = args.cache
 
@@ -205,22 +790,139 @@ def cli_main():
     # Default is to not schedule
     scheduling = args.scheduler
 
+    # Default is the streaming Atom writer and unbounded retention,
+    # slugs can override retention in the YAML config
+    writer_options = {
+        "writer_mode": args.writer,
+        "max_entries": args.max_entries,
+        "max_age_days": args.max_age_days,
+        "store": args.store or args.rerender,
+        "formats": args.formats,
+        "ndjson_stdout": args.ndjson_stdout,
+        "skip_unchanged": args.skip_unchanged,
+        "compress": args.compress,
+        "index": args.index,
+        "deltas": args.deltas,
+    }
+
+    # Default is to pick the executors from the workload size
+    executor_options = {
+        f"{stage}_{setting}": getattr(args, f"{stage}_{setting}")
+        for stage in ["parse", "write"]
+        for setting in ["executor", "workers", "chunksize"]
+    }
+
+    # Default is to run each stage over every configuration in turn
+    executor_options["stream"] = args.stream
+    executor_options["memory_limit_mb"] = args.memory_limit_mb
+    executor_options["queue_size"] = args.queue_size
+
+    # Default is not to profile, profiled stage workers write their stats
+    # next to the main process stats
+    profile_dir = profiler.make_profile_dir() if args.profile else None
+    executor_options["profile_dir"] = profile_dir
+
+    # Default is to fetch every URL on this node
+    executor_options["shard"] = args.shard
+    executor_options["shard_dir"] = args.shard_dir
+
+    # Default is to poll every URL, feed health is recorded either way
+    executor_options["demote_feeds"] = args.demote_feeds
+
+    # Default is JSON records at INFO for every stage
+    config_logging(
+        {
+            "level": logging.getLevelName(args.log_level),
+            "stage_levels": stage_levels,
+            "format": args.log_format,
+        }
+    )
+
+    if args.rerender:
+        call_run(
+            profile_dir,
+            rerender_run,
+            entries_only,
+            writer_options,
+            executor_options,
+            filepath,
+        )
+        return
+
+    if args.merge_shards:
+        call_run(
+            profile_dir,
+            merge_run,
+            args.shard_dir or shard_helper.SHARD_DIR,
+            caching,
+            entries_only,
+            writer_options,
+            executor_options,
+        )
+        return
+
+    serve_options = None
+    if args.serve_port:
+        serve_options = {
+            "port": args.serve_port,
+            "host": args.serve_host,
+            "cache_mb": args.serve_cache_mb,
+        }
+
+    websub_options = None
+    if args.websub_port:
+        websub_options = {
+            "port": args.websub_port,
+            "host": args.websub_host,
+            "callback_url": args.websub_callback,
+        }
+
+    if args.daemon:
+        call_run(
+            profile_dir,
+            daemon_run,
+            args.daemon,
+            args.daemon_total,
+            args.jitter,
+            entries_only,
+            filepath,
+            writer_options,
+            executor_options,
+            args.metrics_port,
+            args.config_check,
+            serve_options,
+            websub_options,
+        )
+        return
+
     if scheduling:
         total_time = scheduling[0]
         interval_time = scheduling[1]
-        scheduler_run(
+        call_run(
+            profile_dir,
+            scheduler_run,
             total_time,
             interval_time,
             caching,
             entries_only,
             parsing,
             filepath,
+            writer_options,
+            executor_options,
+            args.config_check,
         )
         return
 
-    config_logging()
-
-    run_(caching, entries_only, parsing, filepath)
+    call_run(
+        profile_dir,
+        run_,
+        caching,
+        entries_only,
+        parsing,
+        filepath,
+        writer_options=writer_options,
+        executor_options=executor_options,
+    )
 
 
 if __name__ == "__main__":
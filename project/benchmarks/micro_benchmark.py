@@ -0,0 +1,351 @@
+from helpers.feed_helpers.feed_writer_class import (
+    FeedProcessorET,
+    FeedProcessorSTR,
+)
+from helpers.feed_helpers.feed_parser_class import FeedProcessor
+import helpers.feed_helpers.retention as retention
+import helpers.yaml_helpers.config_loader as config_loader
+import helpers.cache_helpers.cacher as cacher
+import helpers.metrics_helpers.metrics as metrics
+import benchmarks.synthetic as synthetic
+import statistics
+import platform
+import argparse
+import tempfile
+import atexit
+import yaml
+import shutil
+import json
+import time
+import sys
+import os
+
+DEFAULT_THRESHOLD = 0.10
+
+
+def bench_process_feed(scale):
+    """
+    Parse and filter one RSS feed with FeedProcessor.process_feed.
+    """
+
+    num_items = int(200 * scale)
+    feed_bytes = synthetic.make_feed_bytes(num_items)
+    config = {
+        "slug": "bench",
+        "match": synthetic.make_keywords(10),
+        "exclude": synthetic.make_keywords(5, seed=1)[:-1],
+    }
+    args = (
+        200,
+        config,
+        "https://example.com/feed.xml",
+        feed_bytes,
+        False,
+        None,
+        "application/rss+xml",
+    )
+
+    def run():
+        FeedProcessor(args).process_feed()
+
+    return run, num_items
+
+
+def bench_check_keywords(scale):
+    """
+    check_keywords over many entries with a realistic keyword list.
+    """
+
+    entries = synthetic.make_entries(int(2000 * scale), summary_size=400)
+    match_keywords = synthetic.make_keywords(25)
+    exclude_keywords = synthetic.make_keywords(10, seed=1)[:-1]
+
+    def run():
+        for entry in entries:
+            FeedProcessor.check_keywords(
+                entry, match_keywords, exclude_keywords
+            )
+
+    return run, len(entries)
+
+
+def bench_render_et(scale):
+    """
+    Atom rendering with FeedProcessorET.
+    """
+
+    entries = synthetic.make_entries(int(500 * scale), summary_size=500)
+    feed_data = synthetic.make_feed_data()
+
+    def run():
+        processor = FeedProcessorET(entries, feed_data, os.devnull)
+        processor.process_all()
+        processor.get_xml()
+
+    return run, len(entries)
+
+
+def bench_render_str(scale):
+    """
+    Entries-only rendering with FeedProcessorSTR.
+    """
+
+    entries = synthetic.make_entries(int(500 * scale), summary_size=500)
+    feed_data = synthetic.make_feed_data()
+
+    def run():
+        processor = FeedProcessorSTR(entries, feed_data, "rss", os.devnull)
+        processor.process_all()
+        processor.get_xml()
+
+    return run, len(entries)
+
+
+def bench_date_normalization(scale):
+    """
+    RFC-3339 normalization of mixed feed dates, as done while rendering,
+    and timestamp parsing, as done by retention.
+    """
+
+    dates = synthetic.make_dates(int(2000 * scale))
+    processor = FeedProcessorET([], synthetic.make_feed_data(), os.devnull)
+
+    def run():
+        for date in dates:
+            if not processor.is_atom_time(date):
+                processor.custom_timezone_parser(date).isoformat()
+            retention.parse_timestamp(date)
+
+    return run, len(dates)
+
+
+def bench_cacher(scale):
+    """
+    Cache writes and reads of the fetch stage against a scratch database.
+    """
+
+    num_urls = int(200 * scale)
+    temp_dir = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, temp_dir, True)
+    cacher.DATABASE_FILEPATH = os.path.join(temp_dir, "cache.db")
+    cacher.STATE_FILEPATH = os.path.join(temp_dir, "state.db")
+    cacher.setup_database()
+    slug_urls = [f"bench https://example.com/{i}.xml" for i in range(num_urls)]
+
+    def run():
+        for i, slug_url in enumerate(slug_urls):
+            cacher.update_cache_etag_last(slug_url, f'"{i}"', "Mon, 02 Oct")
+            cacher.update_cache_id(slug_url, f"https://example.com/{i}")
+            cacher.fetch_cache(slug_url)
+
+    return run, num_urls
+
+
+def bench_metrics(scale):
+    """
+    Recording a run's fetches with mixed outcomes (statuses, errors and
+    timeouts) and exporting them as Prometheus text and the JSON report.
+    """
+
+    num_urls = int(200 * scale)
+    outcomes = [200, 304, 404, "error", "timeout"]
+    urls = [f"https://example.com/{i}.xml" for i in range(num_urls)]
+
+    def run():
+        run_metrics = metrics.Metrics()
+        for i, url in enumerate(urls):
+            status = outcomes[i % len(outcomes)]
+            num_bytes = 4096 if status == 200 else 0
+            run_metrics.record_fetch(
+                f"slug{i % 7}", url, status, 0.05, num_bytes
+            )
+            if status == 200:
+                run_metrics.record_parse(f"slug{i % 7}", url, 0.01, 20, 3)
+        run_metrics.finish_run()
+        run_metrics.prometheus_text()
+        run_metrics.report()
+
+    return run, num_urls
+
+
+def bench_config_load(scale):
+    """
+    Parsing and compiling a large YAML config with the config loader.
+    """
+
+    num_records = int(1000 * scale)
+    temp_dir = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, temp_dir, True)
+    filepath = os.path.join(temp_dir, "rss_config.yaml")
+    with open(filepath, "w") as f:
+        f.write(synthetic.make_config_yaml(num_records))
+
+    def run():
+        with open(filepath, "rb") as f:
+            config_loader.compile_config(
+                yaml.load(f, Loader=config_loader.Loader)
+            )
+
+    return run, num_records
+
+
+CASES = {
+    "process_feed": bench_process_feed,
+    "check_keywords": bench_check_keywords,
+    "render_et": bench_render_et,
+    "render_str": bench_render_str,
+    "date_normalization": bench_date_normalization,
+    "cacher": bench_cacher,
+    "metrics": bench_metrics,
+    "config_load": bench_config_load,
+}
+
+
+def measure(case, scale, repeat):
+    run, num_items = CASES[case](scale)
+
+    # Warm up lazy imports and caches before timing
+    run()
+
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - start_time)
+
+    median = statistics.median(durations)
+    return {
+        "items": num_items,
+        "median_seconds": median,
+        "min_seconds": min(durations),
+        "items_per_second": num_items / median if median else None,
+    }
+
+
+def run_suite(cases, scale, repeat):
+    results = {}
+    for case in cases:
+        result = results[case] = measure(case, scale, repeat)
+        print(
+            f"{case.ljust(20)} {result['median_seconds'] * 1000: 9.2f} ms"
+            f"  {result['items_per_second']: 12.0f} items/s"
+        )
+
+    return {
+        "generated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Print the change of every case against the baseline and return the
+    cases that got slower by more than threshold.
+    """
+
+    if baseline.get("scale") != current.get("scale"):
+        print(
+            f"Warning: baseline scale {baseline.get('scale')} differs from "
+            f"{current.get('scale')}, comparing items per second"
+        )
+
+    regressions = []
+    for case, result in current["results"].items():
+        if case not in baseline["results"]:
+            print(f"{case.ljust(20)} no baseline")
+            continue
+
+        before = baseline["results"][case]["items_per_second"]
+        after = result["items_per_second"]
+        change = before / after - 1
+
+        status = "ok"
+        if change > threshold:
+            status = "REGRESSION"
+            regressions.append(case)
+        elif change < -threshold:
+            status = "faster"
+
+        print(f"{case.ljust(20)} {change * 100:+7.1f}% time  {status}")
+
+    return regressions
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Micro-benchmarks of the parse, match, render and cache "
+        "hot paths"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the suite")
+    run_parser.add_argument(
+        "--cases",
+        type=lambda value: [name.strip() for name in value.split(",")],
+        default=list(CASES),
+        help=f"Comma separated cases: {', '.join(CASES)}",
+    )
+    run_parser.add_argument("--scale", type=float, default=1.0)
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument(
+        "--output", type=str, default=None, help="Save results as JSON"
+    )
+    run_parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="Compare against a saved baseline JSON",
+    )
+    run_parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD
+    )
+
+    compare_parser = commands.add_parser(
+        "compare", help="Compare two saved result files"
+    )
+    compare_parser.add_argument("baseline", type=str)
+    compare_parser.add_argument("current", type=str)
+    compare_parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        current = load_results(args.current)
+        baseline = load_results(args.baseline)
+    else:
+        unknown = [case for case in args.cases if case not in CASES]
+        if unknown:
+            parser.error(f"Unknown cases: {', '.join(unknown)}")
+
+        current = run_suite(args.cases, args.scale, args.repeat)
+        if args.output:
+            os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=2)
+            print(f"Saved results to {args.output}")
+
+        if not args.baseline:
+            return
+        baseline = load_results(args.baseline)
+
+    print("")
+    print(f"Against {args.baseline} (threshold {args.threshold:.0%}):")
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
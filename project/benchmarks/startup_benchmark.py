@@ -0,0 +1,128 @@
+import statistics
+import subprocess
+import argparse
+import tempfile
+import time
+import sys
+import os
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGGREGATOR = os.path.join(PROJECT_DIR, "aggregator.py")
+
+# Invocations that should start quickly, the worker entries are what a
+# freshly spawned pool worker imports before it can take work
+COMMANDS = {
+    "help": [AGGREGATOR, "--help"],
+    "yaml_only": [AGGREGATOR, "-np", "-y", "{yaml}"],
+    "parse_worker": ["-c", "import helpers.feed_helpers.feed_parser_class"],
+    "write_worker": ["-c", "import helpers.feed_helpers.feed_writer"],
+}
+
+
+def run_command(args, cwd, extra_options=()):
+    return subprocess.run(
+        [sys.executable, *extra_options, *args],
+        cwd=cwd,
+        env={**os.environ, "PYTHONPATH": PROJECT_DIR},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+
+
+def time_command(args, cwd, repeat):
+    """
+    Median wall time in milliseconds of starting the command.
+    """
+
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        run_command(args, cwd)
+        durations.append((time.perf_counter() - start_time) * 1000)
+
+    return statistics.median(durations)
+
+
+def import_report(args, cwd, top):
+    """
+    Slowest imports of a command from -X importtime, by cumulative time.
+    """
+
+    stderr = run_command(args, cwd, ["-X", "importtime"]).stderr
+
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        imports.append((int(cumulative_us), int(self_us), name.rstrip()))
+
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure CLI and worker startup time"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget_ms",
+        type=float,
+        default=100,
+        help="Fail when a command needs more than this on top of a bare "
+        "interpreter start (median)",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        choices=list(COMMANDS),
+        default=None,
+        help="Print the slowest imports of one command",
+    )
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yaml_file = os.path.join(temp_dir, "rss_config.yaml")
+        with open(yaml_file, "w") as f:
+            f.write("[]\n")
+
+        commands = {
+            name: [arg.format(yaml=yaml_file) for arg in command]
+            for name, command in COMMANDS.items()
+        }
+
+        if args.report:
+            print(f"Slowest imports of {args.report} (cumulative / self us)")
+            for cumulative_us, self_us, name in import_report(
+                commands[args.report], temp_dir, args.top
+            ):
+                print(f"{cumulative_us: >9} | {self_us: >7} | {name}")
+            return
+
+        baseline = time_command(["-c", "pass"], temp_dir, args.repeat)
+        print(f"{'interpreter'.ljust(13)} {baseline: 7.1f} ms")
+
+        over_budget = []
+        for name, command in commands.items():
+            duration = time_command(command, temp_dir, args.repeat)
+            overhead = duration - baseline
+            status = "ok" if overhead <= args.budget_ms else "OVER BUDGET"
+            print(
+                f"{name.ljust(13)} {duration: 7.1f} ms "
+                f"(+{overhead: .1f} ms)  {status}"
+            )
+            if overhead > args.budget_ms:
+                over_budget.append(name)
+
+    if over_budget:
+        print(
+            f"Over the {args.budget_ms:g} ms budget: {', '.join(over_budget)}"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
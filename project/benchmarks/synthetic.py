@@ -0,0 +1,154 @@
+from xml.sax.saxutils import escape
+import random
+import yaml
+
+WORDS = (
+    "python release security update rust kernel database cloud browser "
+    "compiler network storage benchmark memory parser feed atom protocol "
+    "design review outage patch vulnerability performance latency queue"
+).split()
+
+# Date formats seen in real feeds, in roughly the mix they show up in
+DATE_FORMATS = [
+    "Mon, 02 Oct 2023 10:{minute:02d}:00 GMT",
+    "Mon, 02 Oct 2023 10:{minute:02d}:00 +0200",
+    "2023-10-02T10:{minute:02d}:00Z",
+    "2023-10-02T10:{minute:02d}:00+02:00",
+    "02 Oct 2023 10:{minute:02d} UT",
+]
+
+
+def make_text(rng, num_words):
+    return " ".join(rng.choice(WORDS) for _ in range(num_words))
+
+
+def make_dates(num_dates, seed=0):
+    rng = random.Random(seed)
+    return [
+        rng.choice(DATE_FORMATS).format(minute=rng.randrange(60))
+        for _ in range(num_dates)
+    ]
+
+
+def make_entries(num_entries, summary_size=2000, seed=0):
+    """
+    Build feedparser-like entries for a large synthetic slug.
+    """
+
+    rng = random.Random(seed)
+    summary = ("Lorem ipsum <b>dolor</b> & sit amet " * summary_size)[
+        :summary_size
+    ]
+    dates = make_dates(num_entries, seed)
+
+    return [
+        {
+            "title": f"Entry {i} {make_text(rng, 6)} & <friends>",
+            "title_detail": {"type": "text/plain"},
+            "published": dates[i],
+            "updated": "2023-10-02T10:00:00Z",
+            "id": f"https://example.com/entries/{i}",
+            "summary": summary,
+            "summary_detail": {"type": "text/html"},
+            "tags": [{"term": "news", "scheme": "", "label": "News"}],
+            "links": [
+                {
+                    "rel": "alternate",
+                    "type": "text/html",
+                    "href": f"https://example.com/entries/{i}",
+                }
+            ],
+            "link": f"https://example.com/entries/{i}",
+            "author": "Benchmark",
+        }
+        for i in range(num_entries)
+    ]
+
+
+def make_feed_data():
+    return {
+        "encoding": "utf-8",
+        "title": "Latest Updates",
+        "id": "https://example.com/feed",
+        "updated": "2023-10-02T10:00:00Z",
+        "author": "Benchmark",
+    }
+
+
+def make_feed_bytes(num_items, feed_type="rss", summary_words=80, seed=0):
+    """
+    Serialized RSS 2.0 or Atom feed with num_items entries.
+    """
+
+    rng = random.Random(seed)
+    dates = make_dates(num_items, seed)
+    items = []
+
+    for i in range(num_items):
+        title = escape(f"Item {i} {make_text(rng, 6)}")
+        summary = escape(f"<p>{make_text(rng, summary_words)}</p>")
+        link = f"https://example.com/items/{i}"
+
+        if feed_type == "rss":
+            items.append(
+                f"<item><title>{title}</title><link>{link}</link>"
+                f"<guid>{link}</guid><pubDate>{dates[i]}</pubDate>"
+                f"<description>{summary}</description></item>"
+            )
+        else:
+            items.append(
+                f"<entry><title>{title}</title>"
+                f'<link href="{link}"/><id>{link}</id>'
+                f"<updated>2023-10-02T10:00:00Z</updated>"
+                f'<summary type="html">{summary}</summary></entry>'
+            )
+
+    if feed_type == "rss":
+        document = (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            '<rss version="2.0"><channel><title>Synthetic</title>'
+            "<link>https://example.com/</link>"
+            "<description>Synthetic feed</description>"
+            + "".join(items)
+            + "</channel></rss>"
+        )
+    else:
+        document = (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            '<feed xmlns="http://www.w3.org/2005/Atom">'
+            "<title>Synthetic</title><id>https://example.com/</id>"
+            "<updated>2023-10-02T10:00:00Z</updated>"
+            + "".join(items)
+            + "</feed>"
+        )
+
+    return document.encode("utf-8")
+
+
+def make_keywords(num_keywords, seed=0):
+    rng = random.Random(seed)
+    keywords = [rng.choice(WORDS) + str(i) for i in range(num_keywords - 1)]
+    # One keyword that actually matches, so both branches are exercised
+    return keywords + ["python"]
+
+
+def make_config_yaml(num_records, seed=0):
+    """
+    rss_config.yaml text with num_records records, as yaml_writer dumps it.
+    """
+
+    rng = random.Random(seed)
+    records = [
+        {
+            "name": f"Record {i}",
+            "slug": f"record-{i}",
+            "urls": [
+                f"https://example.com/{i}/{j}.xml"
+                for j in range(rng.randint(1, 5))
+            ],
+            "match": make_keywords(rng.randint(1, 10), seed + i),
+            "exclude": make_keywords(rng.randint(1, 5), seed - i)[:-1],
+        }
+        for i in range(num_records)
+    ]
+    return yaml.dump(records, sort_keys=False, indent=4, allow_unicode=True)
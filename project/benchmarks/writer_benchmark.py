@@ -0,0 +1,65 @@
+from helpers.feed_helpers.feed_writer_class import (
+    FeedProcessorStream,
+    FeedProcessorET,
+)
+from benchmarks.synthetic import make_entries, make_feed_data
+import tracemalloc
+import argparse
+import tempfile
+import time
+import os
+
+
+def write_et(entries, feed_data, output_file):
+    processor = FeedProcessorET(entries, feed_data, output_file)
+    processor.process_all()
+    with open(output_file, "w") as f:
+        f.write(processor.get_xml())
+
+
+def write_stream(entries, feed_data, output_file):
+    FeedProcessorStream(entries, feed_data, output_file).write()
+
+
+def measure(write_func, entries, feed_data, output_file):
+    """
+    Return (seconds, peak traced bytes, output size) for one write.
+    """
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    write_func(entries, feed_data, output_file)
+    duration = time.perf_counter() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return duration, peak, os.path.getsize(output_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the ET and streaming Atom writers"
+    )
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--summary_size", type=int, default=2000)
+    args = parser.parse_args()
+
+    entries = make_entries(args.entries, args.summary_size)
+    feed_data = make_feed_data()
+
+    print(f"Writing {args.entries} entries per writer")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, write_func in [("et", write_et), ("stream", write_stream)]:
+            output_file = os.path.join(temp_dir, f"{name}_feed.xml")
+            duration, peak, size = measure(
+                write_func, entries, feed_data, output_file
+            )
+            print(
+                f"{name.ljust(6)} time: {duration: .2f}s  "
+                f"peak memory: {peak / 2**20: .1f} MiB  "
+                f"output: {size / 2**20: .1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
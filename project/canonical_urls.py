@@ -0,0 +1,234 @@
+import helpers.feed_helpers.url_helper as url_helper
+import helpers.yaml_helpers.config_loader as config_loader
+import helpers.yaml_helpers.airtable_sync as airtable_sync
+import helpers.yaml_helpers.yaml_writer as yaml_writer
+import helpers.cache_helpers.cacher as cacher
+from helpers.feed_helpers.file_helper import atomic_write
+import argparse
+import json
+import yaml
+import sys
+import os
+
+
+def load_redirects():
+    """
+    Final URL of every (normalized) URL that permanently redirected.
+    """
+
+    return {
+        redirect["url"]: (redirect["target"], redirect["status"])
+        for redirect in cacher.fetch_redirects()
+    }
+
+
+def canonical_url(url, redirects):
+    """
+    Canonical form of a configured URL and why it differs, the reason is
+    None when it is already canonical.
+    """
+
+    normalized = url_helper.normalize_url(url)
+    if normalized in redirects:
+        target, status = redirects[normalized]
+        return url_helper.normalize_url(target), f"{status} redirect"
+    if normalized != url:
+        return normalized, "normalized"
+    return url, None
+
+
+def canonical_urls(urls, redirects):
+    """
+    Canonical URLs of a record, near-identical ones dropped, plus a change
+    (url, canonical url or None when dropped, reason) per URL that changed.
+    """
+
+    canonical, changes, seen = [], [], {}
+    for url in urls:
+        new_url, reason = canonical_url(url.strip(), redirects)
+        key = url_helper.url_key(new_url)
+        if key in seen:
+            changes.append((url, None, f"same feed as {seen[key]}"))
+            continue
+
+        seen[key] = new_url
+        canonical.append(new_url)
+        if reason:
+            changes.append((url, new_url, reason))
+
+    return canonical, changes
+
+
+def load_records(filepath):
+    with open(filepath, "rb") as f:
+        records = yaml.load(f, Loader=config_loader.Loader) or []
+    return [
+        record
+        for record in records
+        if config_loader.record_error(record) is None
+    ]
+
+
+def report_command(args):
+    redirects = load_redirects()
+    report = []
+    for record in load_records(args.yaml):
+        _, changes = canonical_urls(record["urls"], redirects)
+        for url, new_url, reason in changes:
+            report.append(
+                {
+                    "slug": record["slug"],
+                    "name": record["name"],
+                    "url": url,
+                    "canonical": new_url,
+                    "reason": reason,
+                }
+            )
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print("")
+        return
+
+    for change in report:
+        print(f"{change['slug']} ({change['name']}): {change['url']}")
+        if change["canonical"]:
+            print(f"    -> {change['canonical']} ({change['reason']})")
+        else:
+            print(f"    drop, {change['reason']}")
+    print(
+        f"{len(report)} URLs to change, {len(redirects)} permanent "
+        "redirects recorded"
+    )
+
+
+def rewrite_yaml(filepath, redirects):
+    with open(filepath, "rb") as f:
+        records = yaml.load(f, Loader=config_loader.Loader) or []
+
+    num_changed = 0
+    for record in records:
+        if config_loader.record_error(record) is not None:
+            continue
+        urls, changes = canonical_urls(record["urls"], redirects)
+        if changes:
+            record["urls"] = urls
+            num_changed += len(changes)
+
+    if num_changed:
+        atomic_write(
+            filepath,
+            yaml.dump(
+                records,
+                sort_keys=False,
+                indent=4,
+                allow_unicode=True,
+                Dumper=yaml_writer.MyDumper,
+            ),
+        )
+    print(f"Rewrote {num_changed} URLs in {filepath}")
+
+    if os.path.abspath(filepath) == os.path.abspath(yaml_writer.YAML_FILEPATH):
+        print(
+            "This file is generated from Airtable, the next sync overwrites "
+            "it unless Airtable is rewritten too (--airtable)"
+        )
+
+
+def rewrite_airtable(redirects):
+    """
+    Update the URLs of the Airtable records, found through the snapshot of
+    the last sync, the next sync brings the changes back.
+    """
+
+    snapshot = airtable_sync.load_snapshot()
+    if snapshot is None:
+        print("No Airtable snapshot yet, run aggregator.py first")
+        sys.exit(1)
+
+    airtable_data = yaml_writer.get_airtable_config()
+    api = yaml_writer.auth(airtable_data)
+    if api is None:
+        sys.exit(1)
+    table = api.table(
+        airtable_data["AIRTABLE_BASE_ID"], airtable_data["AIRTABLE_TABLE_NAME"]
+    )
+
+    num_records = num_changed = 0
+    for record_id, record in snapshot["records"].items():
+        urls = record["fields"].get("urls")
+        if not isinstance(urls, list):
+            continue
+        new_urls, changes = canonical_urls(urls, redirects)
+        if not changes:
+            continue
+
+        table.update(record_id, {"urls": new_urls}, typecast=True)
+        num_records += 1
+        num_changed += len(changes)
+
+    print(f"Rewrote {num_changed} URLs of {num_records} Airtable records")
+
+
+def rewrite_command(args):
+    redirects = load_redirects()
+    if args.airtable:
+        rewrite_airtable(redirects)
+    else:
+        rewrite_yaml(args.yaml, redirects)
+
+
+def cli_main():
+    """
+    Report or write back the canonical form of the configured feed URLs:
+    permanent redirects followed, normalized and without near-duplicates.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Canonical feed URLs from the recorded permanent "
+        "redirects and URL normalization"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = commands.add_parser(
+        "report", help="List the URLs whose canonical form differs"
+    )
+    rewrite_parser = commands.add_parser(
+        "rewrite", help="Replace the URLs with their canonical form"
+    )
+    for command_parser in (report_parser, rewrite_parser):
+        command_parser.add_argument(
+            "--yaml",
+            "-y",
+            type=str,
+            default=yaml_writer.YAML_FILEPATH,
+            help=f"Config YAML (default: {yaml_writer.YAML_FILEPATH})",
+        )
+    report_parser.add_argument(
+        "--json", default=False, action="store_true", help="Print JSON"
+    )
+    rewrite_parser.add_argument(
+        "--airtable",
+        default=False,
+        action="store_true",
+        help="Update the Airtable records instead of the YAML",
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(cacher.STATE_FILEPATH):
+        print("No redirects recorded yet, run aggregator.py first")
+        sys.exit(1)
+    cacher.setup_database()
+    if not getattr(args, "airtable", False) and not os.path.exists(args.yaml):
+        print(f"{args.yaml} does not exist")
+        sys.exit(1)
+
+    if args.command == "report":
+        report_command(args)
+    else:
+        rewrite_command(args)
+
+
+if __name__ == "__main__":
+    cli_main()
@@ -0,0 +1,204 @@
+from aiohttp import web
+import argparse
+import calendar
+import random
+import json
+import time
+import re
+import os
+
+# Airtable returns at most 100 records per page
+MAX_PAGE_SIZE = 100
+
+# The only formula the incremental sync sends
+CHANGED_FORMULA = re.compile(
+    r"IS_AFTER\(LAST_MODIFIED_TIME\(\), DATETIME_PARSE\('([^']+)'\)\)"
+)
+
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(timestamp))
+
+
+def parse_time(value):
+    return calendar.timegm(time.strptime(value, "%Y-%m-%dT%H:%M:%S.000Z"))
+
+
+def make_records(num_records, seed=0):
+    rng = random.Random(seed)
+    # Created a day ago, one second apart
+    start = time.time() - 24 * 60 * 60
+    return [
+        {
+            "id": f"rec{i:014d}",
+            "createdTime": format_time(start + i),
+            "lastModified": start + i,
+            "fields": {
+                "name": f"Record {i}",
+                "slug": f"record-{i}",
+                "urls": [
+                    f"https://example.com/{i}/{j}.xml"
+                    for j in range(rng.randint(1, 3))
+                ],
+                "match": ["python"],
+            },
+        }
+        for i in range(num_records)
+    ]
+
+
+class StandIn:
+    """
+    Records of one table, kept in a JSON file so edits survive restarts.
+    Every change sets the record's last modified time like Airtable does.
+    """
+
+    def __init__(self, data_file, num_records):
+        self.data_file = data_file
+        self.num_requests = 0
+
+        if os.path.exists(data_file):
+            with open(data_file) as f:
+                self.records = json.load(f)
+        else:
+            self.records = make_records(num_records)
+            self.save()
+
+    def save(self):
+        with open(self.data_file, "w") as f:
+            json.dump(self.records, f, indent=2)
+
+    def list_records(self, options):
+        records = self.records
+        formula = options.get("filterByFormula")
+        if formula:
+            match = CHANGED_FORMULA.fullmatch(formula)
+            if not match:
+                raise web.HTTPUnprocessableEntity(
+                    text=json.dumps(
+                        {"error": {"type": "INVALID_FILTER_BY_FORMULA"}}
+                    ),
+                    content_type="application/json",
+                )
+            since = parse_time(match[1])
+            records = [r for r in records if r["lastModified"] > since]
+
+        page_size = min(int(options.get("pageSize", 100)), MAX_PAGE_SIZE)
+        start = int(options.get("offset", 0))
+        page = records[start : start + page_size]
+        fields = options.get("fields")
+
+        response = {
+            "records": [
+                {
+                    "id": record["id"],
+                    "createdTime": record["createdTime"],
+                    "fields": {
+                        key: value
+                        for key, value in record["fields"].items()
+                        if not fields or key in fields
+                    },
+                }
+                for record in page
+            ]
+        }
+        if start + page_size < len(records):
+            response["offset"] = str(start + page_size)
+        return response
+
+    def find(self, record_id):
+        for record in self.records:
+            if record["id"] == record_id:
+                return record
+        raise web.HTTPNotFound()
+
+
+def make_app(stand_in, api_key):
+    routes = web.RouteTableDef()
+
+    @web.middleware
+    async def check_auth(request, handler):
+        stand_in.num_requests += 1
+        print(
+            f"{stand_in.num_requests: >5} {request.method} {request.path_qs}"
+        )
+        if request.headers.get("Authorization") != f"Bearer {api_key}":
+            raise web.HTTPUnauthorized()
+        return await handler(request)
+
+    @routes.get("/v0/{base}/{table}")
+    async def list_records(request):
+        options = dict(request.query)
+        options["fields"] = request.query.getall("fields[]", None)
+        return web.json_response(stand_in.list_records(options))
+
+    @routes.post("/v0/{base}/{table}/listRecords")
+    async def list_records_post(request):
+        return web.json_response(stand_in.list_records(await request.json()))
+
+    @routes.post("/v0/{base}/{table}")
+    async def create_records(request):
+        body = await request.json()
+        created = []
+        for new in body.get("records", [body]):
+            record = {
+                "id": f"rec{int(time.time() * 1000):014d}{len(created)}",
+                "createdTime": format_time(time.time()),
+                "lastModified": time.time(),
+                "fields": new["fields"],
+            }
+            stand_in.records.append(record)
+            created.append(record)
+        stand_in.save()
+        return web.json_response({"records": created})
+
+    @routes.patch("/v0/{base}/{table}/{record_id}")
+    async def update_record(request):
+        record = stand_in.find(request.match_info["record_id"])
+        record["fields"].update((await request.json())["fields"])
+        record["lastModified"] = time.time()
+        stand_in.save()
+        return web.json_response(record)
+
+    @routes.delete("/v0/{base}/{table}/{record_id}")
+    async def delete_record(request):
+        record = stand_in.find(request.match_info["record_id"])
+        stand_in.records.remove(record)
+        stand_in.save()
+        return web.json_response({"id": record["id"], "deleted": True})
+
+    app = web.Application(middlewares=[check_auth])
+    app.add_routes(routes)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the Airtable records API. Point "
+        "AIRTABLE_ENDPOINT_URL in airtable_config.json at it"
+    )
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--api_key", type=str, default="stand-in")
+    parser.add_argument(
+        "--data",
+        type=str,
+        default="airtable_stand_in.json",
+        help="JSON file of the table records, created when missing",
+    )
+    parser.add_argument(
+        "--records",
+        type=int,
+        default=500,
+        help="Number of synthetic records of a new data file",
+    )
+    args = parser.parse_args()
+
+    stand_in = StandIn(args.data, args.records)
+    print(f"Serving {len(stand_in.records)} records from {args.data}")
+    web.run_app(
+        make_app(stand_in, args.api_key), host="127.0.0.1", port=args.port
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+from aiohttp import web
+import aiohttp
+import argparse
+import secrets
+import hashlib
+import asyncio
+import hmac
+import time
+
+# Lease granted when the subscriber does not ask for one
+DEFAULT_LEASE_SECONDS = 600
+
+
+class Hub:
+    """
+    Subscriptions of a WebSub hub by (topic, callback). Intents are verified
+    with a challenge like a real hub does, publishing fetches the topic and
+    pushes the full body, signed with the subscriber's secret.
+    """
+
+    def __init__(self, max_lease_seconds):
+        self.max_lease_seconds = max_lease_seconds
+        self.subscriptions = {}
+        self.session = None
+
+    async def verify(self, mode, topic, callback, secret, lease_seconds):
+        challenge = secrets.token_urlsafe(16)
+        params = {
+            "hub.mode": mode,
+            "hub.topic": topic,
+            "hub.challenge": challenge,
+        }
+        if mode == "subscribe":
+            params["hub.lease_seconds"] = str(lease_seconds)
+
+        try:
+            async with self.session.get(callback, params=params) as response:
+                verified = (
+                    response.status < 300
+                    and await response.text() == challenge
+                )
+        except aiohttp.ClientError as e:
+            print(f"Verification of {callback} failed: {e}")
+            return
+
+        print(f"{mode} {topic} -> {callback}: verified={verified}")
+        if not verified:
+            return
+
+        if mode == "subscribe":
+            self.subscriptions[(topic, callback)] = {
+                "secret": secret,
+                "expires": time.time() + lease_seconds,
+            }
+        else:
+            self.subscriptions.pop((topic, callback), None)
+
+    async def publish(self, topic):
+        async with self.session.get(topic) as response:
+            body = await response.read()
+            content_type = response.headers.get(
+                "Content-Type", "application/xml"
+            )
+
+        num_pushed = 0
+        now = time.time()
+        for (sub_topic, callback), subscription in list(
+            self.subscriptions.items()
+        ):
+            if sub_topic != topic:
+                continue
+            if subscription["expires"] < now:
+                print(f"Lease of {callback} expired")
+                del self.subscriptions[(sub_topic, callback)]
+                continue
+
+            headers = {"Content-Type": content_type}
+            if subscription["secret"]:
+                digest = hmac.new(
+                    subscription["secret"].encode("utf-8"),
+                    body,
+                    hashlib.sha256,
+                ).hexdigest()
+                headers["X-Hub-Signature"] = f"sha256={digest}"
+
+            try:
+                async with self.session.post(
+                    callback, data=body, headers=headers
+                ) as response:
+                    print(f"Pushed {topic} to {callback}: {response.status}")
+                    if response.status == 410:
+                        del self.subscriptions[(sub_topic, callback)]
+                    else:
+                        num_pushed += 1
+            except aiohttp.ClientError as e:
+                print(f"Push of {topic} to {callback} failed: {e}")
+
+        return num_pushed
+
+
+def make_app(hub):
+    routes = web.RouteTableDef()
+
+    @routes.post("/")
+    async def subscribe(request):
+        form = await request.post()
+        mode = form.get("hub.mode")
+
+        if mode == "publish":
+            topic = form.get("hub.url") or form.get("hub.topic")
+            num_pushed = await hub.publish(topic)
+            return web.json_response({"pushed": num_pushed})
+
+        if mode not in ("subscribe", "unsubscribe"):
+            raise web.HTTPBadRequest(text="hub.mode is not supported")
+        if not form.get("hub.topic") or not form.get("hub.callback"):
+            raise web.HTTPBadRequest(text="hub.topic and hub.callback needed")
+
+        lease_seconds = min(
+            int(form.get("hub.lease_seconds") or DEFAULT_LEASE_SECONDS),
+            hub.max_lease_seconds,
+        )
+        # Verified asynchronously, after the 202
+        asyncio.get_running_loop().call_later(
+            0.1,
+            asyncio.ensure_future,
+            hub.verify(
+                mode,
+                form["hub.topic"],
+                form["hub.callback"],
+                form.get("hub.secret"),
+                lease_seconds,
+            ),
+        )
+        return web.Response(status=202)
+
+    @routes.get("/subscriptions")
+    async def list_subscriptions(request):
+        return web.json_response(
+            [
+                {
+                    "topic": key[0],
+                    "callback": key[1],
+                    "expires_in": round(subscription["expires"] - time.time()),
+                }
+                for key, subscription in hub.subscriptions.items()
+            ]
+        )
+
+    async def start_session(app):
+        hub.session = aiohttp.ClientSession()
+
+    async def close_session(app):
+        await hub.session.close()
+
+    app = web.Application()
+    app.add_routes(routes)
+    app.on_startup.append(start_session)
+    app.on_cleanup.append(close_session)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for a WebSub hub. Advertise it in a test "
+        'feed with <atom:link rel="hub" href="http://127.0.0.1:8791/"/> and '
+        "publish with: curl -d hub.mode=publish -d hub.url=<feed URL> "
+        "http://127.0.0.1:8791/"
+    )
+    parser.add_argument("--port", type=int, default=8791)
+    parser.add_argument(
+        "--max_lease_seconds",
+        type=int,
+        default=DEFAULT_LEASE_SECONDS,
+        help="Longest lease granted, short leases exercise renewals",
+    )
+    args = parser.parse_args()
+
+    web.run_app(
+        make_app(Hub(args.max_lease_seconds)), host="127.0.0.1", port=args.port
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import helpers.cache_helpers.feed_health as feed_health
+import helpers.yaml_helpers.config_loader as config_loader
+import helpers.cache_helpers.cacher as cacher
+import argparse
+import json
+import time
+import sys
+import os
+
+DEFAULT_YAML_FILEPATH = os.path.join("yaml_config", "rss_config.yaml")
+
+# Worst first
+STATUS_ORDER = {"disabled": 0, "demoted": 1, "ok": 2}
+
+
+def url_owners(filepath):
+    """
+    Slugs (and record names) following each URL, to find them in Airtable.
+    """
+
+    if not filepath or not os.path.exists(filepath):
+        return {}
+
+    owners = {}
+    for record in config_loader.load_config(filepath):
+        owner = record["slug"]
+        if record.get("name"):
+            owner += f" ({record['name']})"
+        for url in record["urls"]:
+            owners.setdefault(url, []).append(owner)
+    return owners
+
+
+def offense(row):
+    if row["status"] != "ok" or row["failure_streak"]:
+        return row["reason"] or "failing"
+    if row["p95_seconds"] is not None and (
+        row["p95_seconds"] > feed_health.SLOW_SECONDS
+    ):
+        return f"slow, p95 {row['p95_seconds']:.1f}s"
+    return "never matches"
+
+
+def format_seconds(value):
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def report_command(args):
+    rows = feed_health.fetch_rows()
+    offenders = [
+        row
+        for row in rows.values()
+        if args.all or feed_health.is_offender(row)
+    ]
+    offenders.sort(
+        key=lambda row: (
+            STATUS_ORDER.get(row["status"], 3),
+            -row["failure_streak"],
+            row["url"],
+        )
+    )
+    if args.limit:
+        offenders = offenders[: args.limit]
+
+    owners = url_owners(args.yaml)
+    now = time.time()
+    report = []
+    for row in offenders:
+        summary = feed_health.summary(row, now)
+        summary["slugs"] = owners.get(row["url"], [])
+        summary["offense"] = offense(summary) if not args.all else None
+        report.append(summary)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print("")
+        return
+
+    for summary in report:
+        print(f"[{summary['status']}] {summary['url']}")
+        if summary["offense"]:
+            print(f"    problem:   {summary['offense']}")
+        if summary["slugs"]:
+            print(f"    slugs:     {', '.join(summary['slugs'])}")
+        print(
+            f"    fetches:   {summary['fetches']}, failure rate "
+            f"{summary['failure_rate']:.0%}, streak "
+            f"{summary['failure_streak']}, last {summary['last_status']}"
+        )
+        print(
+            f"    latency:   p50 {format_seconds(summary['p50_seconds'])}, "
+            f"p95 {format_seconds(summary['p95_seconds'])}"
+        )
+        if summary["avg_bytes"] is not None:
+            print(f"    body:      {summary['avg_bytes'] / 1024:.1f} KiB avg")
+        if summary["entries_per_parse"] is not None:
+            matching = ""
+            if summary["match_rate"] is not None:
+                matching = f", {summary['match_rate']:.1%} matching"
+            print(
+                f"    yield:     {summary['entries_per_parse']} entries per "
+                f"parse{matching}"
+            )
+        if summary["last_success_days"] is not None:
+            print(f"    last ok:   {summary['last_success_days']} days ago")
+        if summary["next_poll_seconds"] is not None:
+            print(
+                f"    next poll: in {summary['next_poll_seconds'] / 60:.0f} "
+                "minutes (with --demote_feeds)"
+            )
+
+    kind = "URLs" if args.all else "offending URLs"
+    print(f"{len(report)} {kind} of {len(rows)} tracked")
+
+
+def enable_command(args):
+    num_enabled = feed_health.enable(args.urls)
+    print(f"Re-enabled {num_enabled} URLs")
+
+
+def cli_main():
+    """
+    Report on and manage the feed health recorded by aggregator.py.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Feed health: failing, slow and never matching URLs"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = commands.add_parser(
+        "report", help="List offending URLs, worst first"
+    )
+    report_parser.add_argument(
+        "--yaml",
+        "-y",
+        type=str,
+        default=DEFAULT_YAML_FILEPATH,
+        help="Config to look up the slugs following each URL "
+        f"(default: {DEFAULT_YAML_FILEPATH})",
+    )
+    report_parser.add_argument(
+        "--all",
+        default=False,
+        action="store_true",
+        help="List every tracked URL, not only offenders",
+    )
+    report_parser.add_argument("--limit", type=int, default=None)
+    report_parser.add_argument(
+        "--json", default=False, action="store_true", help="Print JSON"
+    )
+
+    enable_parser = commands.add_parser(
+        "enable",
+        help="Put demoted or disabled URLs back into normal polling",
+    )
+    enable_parser.add_argument(
+        "urls", nargs="*", help="URLs to enable, every URL when omitted"
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(cacher.STATE_FILEPATH):
+        print("No feed health yet, run aggregator.py first")
+        sys.exit(1)
+    feed_health.setup_health()
+
+    if args.command == "report":
+        report_command(args)
+    else:
+        enable_command(args)
+
+
+if __name__ == "__main__":
+    cli_main()
@@ -1,10 +1,14 @@
 import sqlite3
 import logging
+import time
 import os
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATABASE_FILEPATH = os.path.join(BASE_DIR, "cache.db")
 
+# State that has to outlive the cache, which the scheduler clears on start
+STATE_FILEPATH = os.path.join(BASE_DIR, "state.db")
+
 CREATE_TABLE_SQL = """
     CREATE TABLE IF NOT EXISTS cache (
         slug_url TEXT PRIMARY KEY,
@@ -12,25 +16,59 @@ CREATE_TABLE_SQL = """
         etag TEXT,
         last_modified TEXT
     );
+
+    CREATE TABLE IF NOT EXISTS outputs (
+        output_file TEXT PRIMARY KEY,
+        content_hash TEXT,
+        size INTEGER
+    );
+"""
+
+STATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        url TEXT PRIMARY KEY,
+        token TEXT UNIQUE NOT NULL,
+        hub TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        secret TEXT NOT NULL,
+        status TEXT NOT NULL,
+        lease_expires REAL,
+        updated REAL NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS redirects (
+        url TEXT PRIMARY KEY,
+        target TEXT NOT NULL,
+        status INTEGER NOT NULL,
+        updated REAL NOT NULL
+    );
 """
 
 
 def setup_database():
     # Check if database file exists
-    if not os.path.exists(DATABASE_FILEPATH):
-        # Create database
-        with sqlite3.connect(DATABASE_FILEPATH) as conn:
-            cursor = conn.cursor()
+    database_exists = os.path.exists(DATABASE_FILEPATH)
 
-            # Table setup
-            try:
-                cursor.execute(CREATE_TABLE_SQL)
-            except sqlite3.error as e:
-                logging.error(f"Error: {e}")
+    # Create database, or add tables missing from an older one
+    with sqlite3.connect(DATABASE_FILEPATH) as conn:
+        cursor = conn.cursor()
 
-            logging.info("Database set up complete")
-    else:
+        # Table setup
+        try:
+            cursor.executescript(CREATE_TABLE_SQL)
+        except sqlite3.Error as e:
+            logging.error(f"Error: {e}")
+
+    with sqlite3.connect(STATE_FILEPATH) as conn:
+        try:
+            conn.executescript(STATE_TABLE_SQL)
+        except sqlite3.Error as e:
+            logging.error(f"Error: {e}")
+
+    if database_exists:
         logging.info("Database exists")
+    else:
+        logging.info("Database set up complete")
 
 
 def update_cache_etag_last(slug_url, etag=None, last_modified=None):
@@ -94,3 +132,156 @@ def fetch_cache(slug_url):
         result = cursor.fetchone()
 
     return None if result is None else result
+
+
+def delete_cache(slug_urls):
+    # Connect to database
+    with sqlite3.connect(DATABASE_FILEPATH, timeout=30) as conn:
+        cursor = conn.cursor()
+
+        # Forget etag / last modified / last seen id, so the next run
+        # fetches and filters the whole feed again
+        cursor.executemany(
+            "DELETE FROM cache WHERE slug_url=?",
+            [(slug_url,) for slug_url in slug_urls],
+        )
+
+
+def update_output_hash(output_file, content_hash, size):
+    # Connect to database
+    with sqlite3.connect(DATABASE_FILEPATH, timeout=30) as conn:
+        cursor = conn.cursor()
+
+        # Insert or update content hash of an output file
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO outputs (output_file, content_hash, size)
+            VALUES (?, ?, ?)
+            """,
+            (output_file, content_hash, size),
+        )
+
+
+def fetch_output_hash(output_file):
+    # Connect to database
+    try:
+        with sqlite3.connect(DATABASE_FILEPATH, timeout=30) as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(
+                "SELECT content_hash FROM outputs WHERE output_file=?",
+                (output_file,),
+            )
+            result = cursor.fetchone()
+
+    except sqlite3.Error as e:
+        logging.error(f"Error: {e}")
+        return None
+
+    return None if result is None else result[0]
+
+
+SUBSCRIPTION_COLUMNS = [
+    "url",
+    "token",
+    "hub",
+    "topic",
+    "secret",
+    "status",
+    "lease_expires",
+    "updated",
+]
+
+
+def fetch_subscriptions():
+    # Connect to database
+    with sqlite3.connect(STATE_FILEPATH, timeout=30) as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(
+            f"SELECT {', '.join(SUBSCRIPTION_COLUMNS)} FROM subscriptions"
+        )
+        rows = cursor.fetchall()
+
+    return [dict(zip(SUBSCRIPTION_COLUMNS, row)) for row in rows]
+
+
+def update_subscription(subscription):
+    # Connect to database
+    with sqlite3.connect(STATE_FILEPATH, timeout=30) as conn:
+        cursor = conn.cursor()
+
+        # Insert or update the WebSub subscription of a feed URL
+        cursor.execute(
+            f"""
+            INSERT OR REPLACE INTO subscriptions
+                ({', '.join(SUBSCRIPTION_COLUMNS)})
+            VALUES ({', '.join('?' * len(SUBSCRIPTION_COLUMNS))})
+            """,
+            [subscription[column] for column in SUBSCRIPTION_COLUMNS],
+        )
+
+
+def delete_subscription(url):
+    # Connect to database
+    with sqlite3.connect(STATE_FILEPATH, timeout=30) as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("DELETE FROM subscriptions WHERE url=?", (url,))
+
+
+REDIRECT_COLUMNS = ["url", "target", "status", "updated"]
+
+
+def fetch_redirect(url):
+    # Connect to database
+    try:
+        with sqlite3.connect(STATE_FILEPATH, timeout=30) as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("SELECT target FROM redirects WHERE url=?", (url,))
+            result = cursor.fetchone()
+
+    except sqlite3.Error as e:
+        logging.error(f"Error: {e}")
+        return None
+
+    return None if result is None else result[0]
+
+
+def fetch_redirects():
+    # Connect to database
+    with sqlite3.connect(STATE_FILEPATH, timeout=30) as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(
+            f"SELECT {', '.join(REDIRECT_COLUMNS)} FROM redirects ORDER BY url"
+        )
+        rows = cursor.fetchall()
+
+    return [dict(zip(REDIRECT_COLUMNS, row)) for row in rows]
+
+
+def update_redirect(url, target, status):
+    # Connect to database
+    with sqlite3.connect(STATE_FILEPATH, timeout=30) as conn:
+        cursor = conn.cursor()
+
+        # Insert or update the final URL a feed URL permanently redirects to
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO redirects (url, target, status, updated)
+            VALUES (?, ?, ?, ?)
+            """,
+            (url, target, status, time.time()),
+        )
+
+
+def delete_redirects(urls):
+    # Connect to database
+    with sqlite3.connect(STATE_FILEPATH, timeout=30) as conn:
+        cursor = conn.cursor()
+
+        cursor.executemany(
+            "DELETE FROM redirects WHERE url=?", [(url,) for url in urls]
+        )
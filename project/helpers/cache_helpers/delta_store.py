@@ -0,0 +1,57 @@
+import sqlite3
+import time
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DELTA_FILEPATH = os.path.join(BASE_DIR, "deltas.db")
+
+# Entries delivered longer ago are forgotten, one that shows up again after
+# that is delivered again
+SEEN_DAYS = 30
+
+# Kept apart from cache.db, which the scheduler clears on start, so a new
+# session does not deliver every entry again
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS delivered (
+        slug TEXT NOT NULL,
+        entry_id TEXT NOT NULL,
+        delivered REAL NOT NULL,
+        PRIMARY KEY (slug, entry_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS delivered_time ON delivered (delivered);
+"""
+
+
+def connect(filepath=None):
+    conn = sqlite3.connect(filepath or DELTA_FILEPATH, timeout=30)
+    conn.executescript(CREATE_TABLE_SQL)
+    return conn
+
+
+def claim_new(conn, slug_entries):
+    """
+    Normalized entries, by slug, that no earlier delta delivered, marked as
+    delivered when the transaction commits.
+    """
+
+    now = time.time()
+    conn.execute(
+        "DELETE FROM delivered WHERE delivered < ?",
+        (now - SEEN_DAYS * 24 * 60 * 60,),
+    )
+
+    new = {}
+    for slug, entries in slug_entries.items():
+        fresh = []
+        for entry in entries:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO delivered VALUES (?, ?, ?)",
+                (slug, entry["id"], now),
+            )
+            if cursor.rowcount:
+                fresh.append(entry)
+        if fresh:
+            new[slug] = fresh
+
+    return new
@@ -0,0 +1,206 @@
+from helpers.feed_helpers.entry_model import entry_key
+import helpers.feed_helpers.retention as retention
+import calendar
+import sqlite3
+import logging
+import json
+import time
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_FILEPATH = os.path.join(BASE_DIR, "entries.db")
+
+CREATE_TABLES_SQL = """
+    CREATE TABLE IF NOT EXISTS entries (
+        slug TEXT NOT NULL,
+        entry_id TEXT NOT NULL,
+        published REAL,
+        updated REAL,
+        first_seen REAL NOT NULL,
+        last_seen REAL NOT NULL,
+        sort_time REAL NOT NULL,
+        title TEXT,
+        link TEXT,
+        author TEXT,
+        summary TEXT,
+        entry_json TEXT NOT NULL,
+        PRIMARY KEY (slug, entry_id)
+    );
+
+    CREATE INDEX IF NOT EXISTS entries_slug_time
+        ON entries (slug, sort_time DESC);
+
+    CREATE TABLE IF NOT EXISTS feeds (
+        slug TEXT PRIMARY KEY,
+        feed_type TEXT,
+        feed_data_json TEXT NOT NULL
+    );
+"""
+
+UPSERT_ENTRY_SQL = """
+    INSERT INTO entries (
+        slug, entry_id, published, updated, first_seen, last_seen,
+        sort_time, title, link, author, summary, entry_json
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (slug, entry_id) DO UPDATE SET
+        published=excluded.published,
+        updated=excluded.updated,
+        last_seen=excluded.last_seen,
+        sort_time=excluded.sort_time,
+        title=excluded.title,
+        link=excluded.link,
+        author=excluded.author,
+        summary=excluded.summary,
+        entry_json=excluded.entry_json
+"""
+
+
+def connect():
+    """
+    Open the store, several writer processes may use it at the same time.
+    """
+
+    conn = sqlite3.connect(STORE_FILEPATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def setup_store():
+    with connect() as conn:
+        try:
+            conn.executescript(CREATE_TABLES_SQL)
+        except sqlite3.Error as e:
+            logging.error(f"Error: {e}")
+
+    logging.info("Entry store set up complete")
+
+
+def parsed_timestamp(entry, field):
+    parsed = entry.get(f"{field}_parsed")
+    if parsed:
+        return calendar.timegm(tuple(parsed)[:9])
+    return retention.parse_timestamp(entry.get(field))
+
+
+def upsert_entries(slug, entries, feed_data, feed_type):
+    """
+    Insert new matches for a slug, refreshing entries that were seen before.
+    """
+
+    now = time.time()
+    rows = []
+
+    for entry in entries:
+        published = parsed_timestamp(entry, "published")
+        updated = parsed_timestamp(entry, "updated")
+
+        rows.append(
+            (
+                slug,
+                entry_key(entry),
+                published,
+                updated,
+                now,
+                now,
+                updated or published or now,
+                entry.get("title"),
+                entry.get("link"),
+                entry.get("author"),
+                entry.get("summary"),
+                json.dumps(entry, default=str),
+            )
+        )
+
+    with connect() as conn:
+        conn.executemany(UPSERT_ENTRY_SQL, rows)
+        conn.execute(
+            """
+            INSERT INTO feeds (slug, feed_type, feed_data_json)
+            VALUES (?, ?, ?)
+            ON CONFLICT (slug) DO UPDATE SET
+                feed_type=excluded.feed_type,
+                feed_data_json=excluded.feed_data_json
+            """,
+            (slug, feed_type, json.dumps(feed_data)),
+        )
+
+
+def fetch_entries(slug, retention_policy=None):
+    """
+    Newest entries of a slug within the retention window.
+    """
+
+    query = "SELECT entry_json FROM entries WHERE slug=?"
+    params = [slug]
+
+    cutoff = retention.cutoff_timestamp(retention_policy)
+    if cutoff is not None:
+        query += " AND sort_time >= ?"
+        params.append(cutoff)
+
+    query += " ORDER BY sort_time DESC, first_seen DESC, rowid"
+
+    if retention_policy and retention_policy["max_entries"]:
+        query += " LIMIT ?"
+        params.append(retention_policy["max_entries"])
+
+    with connect() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    return [json.loads(row[0]) for row in rows]
+
+
+def fetch_feed(slug):
+    """
+    Return (feed_data, feed_type) last stored for a slug.
+    """
+
+    with connect() as conn:
+        row = conn.execute(
+            "SELECT feed_data_json, feed_type FROM feeds WHERE slug=?",
+            (slug,),
+        ).fetchone()
+
+    if row is None:
+        return None, None
+    return json.loads(row[0]), row[1]
+
+
+def fetch_slugs():
+    with connect() as conn:
+        rows = conn.execute("SELECT slug FROM feeds ORDER BY slug").fetchall()
+
+    return [row[0] for row in rows]
+
+
+def prune(slug, retention_policy):
+    """
+    Delete entries of a slug that fall outside its retention window.
+    """
+
+    if not retention_policy:
+        return 0
+
+    num_deleted = 0
+    with connect() as conn:
+        cutoff = retention.cutoff_timestamp(retention_policy)
+        if cutoff is not None:
+            num_deleted += conn.execute(
+                "DELETE FROM entries WHERE slug=? AND sort_time < ?",
+                (slug, cutoff),
+            ).rowcount
+
+        if retention_policy["max_entries"]:
+            num_deleted += conn.execute(
+                """
+                DELETE FROM entries WHERE slug=? AND entry_id NOT IN (
+                    SELECT entry_id FROM entries WHERE slug=?
+                    ORDER BY sort_time DESC, first_seen DESC, rowid LIMIT ?
+                )
+                """,
+                (slug, slug, retention_policy["max_entries"]),
+            ).rowcount
+
+    return num_deleted
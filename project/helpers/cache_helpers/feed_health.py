@@ -0,0 +1,393 @@
+import helpers.cache_helpers.cacher as cacher
+import sqlite3
+import logging
+import json
+import time
+
+# Latencies kept per URL for the percentiles
+LATENCY_WINDOW = 50
+
+# Failures in a row before a URL is polled less often, the wait doubles
+# with every further failure up to MAX_BACKOFF_SECONDS
+DEMOTE_AFTER_FAILURES = 3
+BACKOFF_SECONDS = 15 * 60
+MAX_BACKOFF_SECONDS = 24 * 60 * 60
+
+# Failures in a row before a URL is disabled, disabled URLs are still
+# probed once a week so a revived feed comes back on its own
+DISABLE_AFTER_FAILURES = 10
+DISABLED_PROBE_SECONDS = 7 * 24 * 60 * 60
+
+# URLs whose 95th percentile latency is above SLOW_SECONDS (over at least
+# MIN_SLOW_SAMPLES fetches) are polled at most every SLOW_POLL_SECONDS
+SLOW_SECONDS = 10
+MIN_SLOW_SAMPLES = 5
+SLOW_POLL_SECONDS = 60 * 60
+
+# Reported as never matching after this many parses without a match
+MIN_YIELD_PARSES = 10
+
+COLUMNS = [
+    "url",
+    "status",
+    "reason",
+    "fetches",
+    "failures",
+    "success_streak",
+    "failure_streak",
+    "last_status",
+    "last_attempt",
+    "last_success",
+    "latencies",
+    "bodies",
+    "bytes_total",
+    "bytes_last",
+    "parses",
+    "entries_total",
+    "matched_total",
+    "next_poll",
+]
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS feed_health (
+        url TEXT PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'ok',
+        reason TEXT,
+        fetches INTEGER NOT NULL DEFAULT 0,
+        failures INTEGER NOT NULL DEFAULT 0,
+        success_streak INTEGER NOT NULL DEFAULT 0,
+        failure_streak INTEGER NOT NULL DEFAULT 0,
+        last_status TEXT,
+        last_attempt REAL,
+        last_success REAL,
+        latencies TEXT NOT NULL DEFAULT '[]',
+        bodies INTEGER NOT NULL DEFAULT 0,
+        bytes_total INTEGER NOT NULL DEFAULT 0,
+        bytes_last INTEGER,
+        parses INTEGER NOT NULL DEFAULT 0,
+        entries_total INTEGER NOT NULL DEFAULT 0,
+        matched_total INTEGER NOT NULL DEFAULT 0,
+        next_poll REAL
+    );
+"""
+
+
+def connect():
+    # Streaks and demotions have to outlive the cache cleared on every
+    # scheduler start
+    return sqlite3.connect(cacher.STATE_FILEPATH, timeout=30)
+
+
+def setup_health():
+    with connect() as conn:
+        try:
+            conn.executescript(CREATE_TABLE_SQL)
+        except sqlite3.Error as e:
+            logging.error(f"Error: {e}")
+
+
+def new_row(url):
+    return {
+        "url": url,
+        "status": "ok",
+        "reason": None,
+        "fetches": 0,
+        "failures": 0,
+        "success_streak": 0,
+        "failure_streak": 0,
+        "last_status": None,
+        "last_attempt": None,
+        "last_success": None,
+        "latencies": [],
+        "bodies": 0,
+        "bytes_total": 0,
+        "bytes_last": None,
+        "parses": 0,
+        "entries_total": 0,
+        "matched_total": 0,
+        "next_poll": None,
+    }
+
+
+def fetch_rows(urls=None):
+    """
+    Health rows by URL, of the given URLs or of every URL.
+    """
+
+    sql = f"SELECT {', '.join(COLUMNS)} FROM feed_health"
+    params = []
+    if urls is not None:
+        urls = list(urls)
+        if not urls:
+            return {}
+        sql += f" WHERE url IN ({', '.join('?' * len(urls))})"
+        params = urls
+
+    with connect() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    result = {}
+    for values in rows:
+        row = dict(zip(COLUMNS, values))
+        row["latencies"] = json.loads(row["latencies"])
+        result[row["url"]] = row
+    return result
+
+
+def save_rows(rows):
+    with connect() as conn:
+        conn.executemany(
+            f"""
+            INSERT OR REPLACE INTO feed_health ({', '.join(COLUMNS)})
+            VALUES ({', '.join('?' * len(COLUMNS))})
+            """,
+            [
+                [
+                    {**row, "latencies": json.dumps(row["latencies"])}[column]
+                    for column in COLUMNS
+                ]
+                for row in rows
+            ],
+        )
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_outcomes(metrics):
+    """
+    One outcome per fetched URL of a run: (status, seconds, bytes, parse),
+    parse is None when a fetched body could not be parsed. A URL several
+    slugs follow counts once.
+    """
+
+    parses = {parse["url"]: parse for parse in metrics.parses}
+    outcomes = {}
+    for fetch in metrics.fetches:
+        if fetch["url"] not in outcomes:
+            outcomes[fetch["url"]] = (
+                fetch["status"],
+                fetch["seconds"],
+                fetch["bytes"],
+                parses.get(fetch["url"]),
+            )
+    return outcomes
+
+
+def failure_reason(status, parse):
+    if status in ("error", "timeout"):
+        return f"fetch {status}"
+    if isinstance(status, int) and status >= 400:
+        return f"HTTP {status}"
+    if status != 304 and parse is None:
+        return "parse error"
+    return None
+
+
+def apply_policy(row, now):
+    """
+    Demote, disable or restore a URL from its streaks and latencies.
+    """
+
+    streak = row["failure_streak"]
+    if streak >= DISABLE_AFTER_FAILURES:
+        if row["status"] != "disabled":
+            logging.warning(
+                f"Disabling {row['url']} after {streak} failures "
+                f"({row['reason']})"
+            )
+        row["status"] = "disabled"
+        row["next_poll"] = now + DISABLED_PROBE_SECONDS
+        return
+
+    if streak >= DEMOTE_AFTER_FAILURES:
+        backoff = BACKOFF_SECONDS * 2 ** (streak - DEMOTE_AFTER_FAILURES)
+        row["status"] = "demoted"
+        row["next_poll"] = now + min(backoff, MAX_BACKOFF_SECONDS)
+        return
+
+    p95 = percentile(row["latencies"], 0.95)
+    if (
+        streak == 0
+        and len(row["latencies"]) >= MIN_SLOW_SAMPLES
+        and p95 > SLOW_SECONDS
+    ):
+        row["status"] = "demoted"
+        row["reason"] = f"slow, p95 {p95:.1f}s"
+        row["next_poll"] = now + SLOW_POLL_SECONDS
+        return
+
+    if row["status"] != "ok" and streak == 0:
+        logging.info(f"Feed {row['url']} is healthy again")
+    if streak == 0:
+        row["status"] = "ok"
+        row["reason"] = None
+        row["next_poll"] = None
+
+
+def record_run(metrics):
+    """
+    Update the health of every URL the run fetched from its metrics.
+    """
+
+    outcomes = run_outcomes(metrics)
+    if not outcomes:
+        return
+
+    now = time.time()
+    try:
+        rows = fetch_rows(outcomes)
+        for url, (status, seconds, num_bytes, parse) in outcomes.items():
+            row = rows.setdefault(url, new_row(url))
+            reason = failure_reason(status, parse)
+
+            row["fetches"] += 1
+            row["last_status"] = str(status)
+            row["last_attempt"] = now
+            row["latencies"] = (row["latencies"] + [seconds])[-LATENCY_WINDOW:]
+            if num_bytes:
+                row["bodies"] += 1
+                row["bytes_total"] += num_bytes
+                row["bytes_last"] = num_bytes
+            if parse is not None:
+                row["parses"] += 1
+                row["entries_total"] += parse["entries"]
+                row["matched_total"] += parse["matched"]
+
+            if reason:
+                row["failures"] += 1
+                row["failure_streak"] += 1
+                row["success_streak"] = 0
+                row["reason"] = reason
+            else:
+                row["failure_streak"] = 0
+                row["success_streak"] += 1
+                row["last_success"] = now
+
+            apply_policy(row, now)
+
+        save_rows(rows.values())
+
+    except sqlite3.Error as e:
+        logging.error(f"Error recording feed health: {e}")
+
+
+def polled_config(config):
+    """
+    Config without the URLs that are demoted or disabled until later,
+    records left without URLs drop.
+    """
+
+    now = time.time()
+    try:
+        with connect() as conn:
+            waiting = {
+                url
+                for (url,) in conn.execute(
+                    "SELECT url FROM feed_health WHERE next_poll > ?", (now,)
+                )
+            }
+    except sqlite3.Error as e:
+        logging.error(f"Error reading feed health: {e}")
+        return config
+
+    if not waiting:
+        return config
+
+    polled = []
+    for record in config:
+        urls = [url for url in record["urls"] if url not in waiting]
+        if urls:
+            polled.append({**record, "urls": urls})
+
+    num_skipped = sum(len(record["urls"]) for record in config) - sum(
+        len(record["urls"]) for record in polled
+    )
+    if num_skipped:
+        logging.info(f"Skipping {num_skipped} demoted or disabled URLs")
+    return polled
+
+
+def round_seconds(value):
+    return None if value is None else round(value, 3)
+
+
+def summary(row, now=None):
+    """
+    Report fields of a health row.
+    """
+
+    now = now or time.time()
+    return {
+        "url": row["url"],
+        "status": row["status"],
+        "reason": row["reason"],
+        "fetches": row["fetches"],
+        "failure_rate": (
+            round(row["failures"] / row["fetches"], 3)
+            if row["fetches"]
+            else None
+        ),
+        "failure_streak": row["failure_streak"],
+        "last_status": row["last_status"],
+        "p50_seconds": round_seconds(percentile(row["latencies"], 0.5)),
+        "p95_seconds": round_seconds(percentile(row["latencies"], 0.95)),
+        "avg_bytes": (
+            round(row["bytes_total"] / row["bodies"])
+            if row["bodies"]
+            else None
+        ),
+        "last_bytes": row["bytes_last"],
+        "entries_per_parse": (
+            round(row["entries_total"] / row["parses"], 1)
+            if row["parses"]
+            else None
+        ),
+        "match_rate": (
+            round(row["matched_total"] / row["entries_total"], 3)
+            if row["entries_total"]
+            else None
+        ),
+        "last_success_days": (
+            round((now - row["last_success"]) / 86400, 1)
+            if row["last_success"]
+            else None
+        ),
+        "next_poll_seconds": (
+            round(row["next_poll"] - now)
+            if row["next_poll"] and row["next_poll"] > now
+            else None
+        ),
+    }
+
+
+def is_offender(row):
+    return (
+        row["status"] != "ok"
+        or row["failure_streak"] > 0
+        or (row["parses"] >= MIN_YIELD_PARSES and row["matched_total"] == 0)
+    )
+
+
+def enable(urls=None):
+    """
+    Put demoted or disabled URLs (all of them without urls) back into
+    normal polling, returning how many changed.
+    """
+
+    sql = """
+        UPDATE feed_health
+        SET status='ok', reason=NULL, failure_streak=0, next_poll=NULL
+        WHERE status != 'ok'
+    """
+    params = []
+    if urls:
+        sql += f" AND url IN ({', '.join('?' * len(urls))})"
+        params = list(urls)
+
+    with connect() as conn:
+        return conn.execute(sql, params).rowcount
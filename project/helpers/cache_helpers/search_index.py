@@ -0,0 +1,322 @@
+from helpers.feed_helpers.entry_model import entry_key, strip_html
+from helpers.cache_helpers.entry_store import parsed_timestamp
+import sqlite3
+import logging
+import time
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_FILEPATH = os.path.join(BASE_DIR, "search.db")
+
+# Title matches count more than summary and author matches, the slug key
+# is only there for filtering
+COLUMN_WEIGHTS = (5.0, 1.0, 1.0, 0.0)
+
+# Ranked searches score the newest matches only, so a term found in most
+# entries costs the same as a rare one. Rare terms are ranked exactly.
+RANK_WINDOW = 5000
+
+# FTS5 merges index segments while writing once this many are waiting,
+# which keeps queries fast without a full optimize after every run
+AUTOMERGE = 8
+
+# The text lives once in docs, docs_fts only holds the full-text index
+# (an external content table), kept in sync by the triggers. Rowids grow
+# as entries are indexed, so the index can walk matches newest first and
+# stop early. slug_key is the slug as a single token, which turns a slug
+# filter into an intersection of full-text matches.
+CREATE_TABLES_SQL = """
+    CREATE TABLE IF NOT EXISTS docs (
+        rowid INTEGER PRIMARY KEY,
+        slug TEXT NOT NULL,
+        entry_id TEXT NOT NULL,
+        sort_time REAL NOT NULL,
+        indexed REAL NOT NULL,
+        title TEXT,
+        link TEXT,
+        author TEXT,
+        summary TEXT,
+        slug_key TEXT GENERATED ALWAYS AS ('s' || hex(slug) || '0') VIRTUAL,
+        UNIQUE (slug, entry_id)
+    );
+
+    CREATE INDEX IF NOT EXISTS docs_time ON docs (sort_time);
+
+    CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(
+        title, summary, author, slug_key,
+        content='docs', content_rowid='rowid',
+        tokenize='porter unicode61 remove_diacritics 2'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS docs_insert AFTER INSERT ON docs BEGIN
+        INSERT INTO docs_fts (rowid, title, summary, author, slug_key)
+        VALUES (
+            new.rowid, new.title, new.summary, new.author, new.slug_key
+        );
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS docs_delete AFTER DELETE ON docs BEGIN
+        INSERT INTO docs_fts (
+            docs_fts, rowid, title, summary, author, slug_key
+        )
+        VALUES (
+            'delete', old.rowid, old.title, old.summary, old.author,
+            old.slug_key
+        );
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS docs_update AFTER UPDATE ON docs BEGIN
+        INSERT INTO docs_fts (
+            docs_fts, rowid, title, summary, author, slug_key
+        )
+        VALUES (
+            'delete', old.rowid, old.title, old.summary, old.author,
+            old.slug_key
+        );
+        INSERT INTO docs_fts (rowid, title, summary, author, slug_key)
+        VALUES (
+            new.rowid, new.title, new.summary, new.author, new.slug_key
+        );
+    END;
+"""
+
+# Entries seen again only touch the index when their text changed
+UPSERT_DOC_SQL = """
+    INSERT INTO docs (
+        slug, entry_id, sort_time, indexed, title, link, author, summary
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (slug, entry_id) DO UPDATE SET
+        sort_time=excluded.sort_time,
+        indexed=excluded.indexed,
+        title=excluded.title,
+        link=excluded.link,
+        author=excluded.author,
+        summary=excluded.summary
+    WHERE docs.title IS NOT excluded.title
+        OR docs.summary IS NOT excluded.summary
+        OR docs.author IS NOT excluded.author
+        OR docs.link IS NOT excluded.link
+        OR docs.sort_time IS NOT excluded.sort_time
+"""
+
+
+def connect(filepath=None):
+    """
+    Open the index, several writer processes may use it at the same time.
+    """
+
+    conn = sqlite3.connect(filepath or INDEX_FILEPATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def setup_index(filepath=None):
+    with connect(filepath) as conn:
+        try:
+            conn.executescript(CREATE_TABLES_SQL)
+            conn.execute(
+                "INSERT INTO docs_fts (docs_fts, rank) VALUES ('automerge', ?)",
+                (AUTOMERGE,),
+            )
+        except sqlite3.Error as e:
+            logging.error(f"Error: {e}")
+
+    logging.info("Search index set up complete")
+
+
+def index_entries(slug, entries, filepath=None):
+    """
+    Add the new matches of a slug to the index, or refresh entries whose
+    text changed since they were indexed.
+    """
+
+    now = time.time()
+    rows = []
+
+    for entry in entries:
+        rows.append(
+            (
+                slug,
+                entry_key(entry),
+                parsed_timestamp(entry, "updated")
+                or parsed_timestamp(entry, "published")
+                or now,
+                now,
+                strip_html(entry.get("title") or ""),
+                entry.get("link"),
+                entry.get("author"),
+                strip_html(entry.get("summary") or ""),
+            )
+        )
+
+    with connect(filepath) as conn:
+        conn.executemany(UPSERT_DOC_SQL, rows)
+
+
+def quote_query(query):
+    """
+    Search every word of a query that is not valid FTS5 syntax as a plain
+    term, e.g. a stray quote or a trailing operator.
+    """
+
+    words = [word.replace('"', '""') for word in query.split()]
+    return " ".join(f'"{word}"' for word in words if word)
+
+
+def slug_key(slug):
+    # Same token as the slug_key column, tokens are case insensitive
+    return "s" + slug.encode("utf-8").hex() + "0"
+
+
+def match_expression(query, slugs=None):
+    if not slugs:
+        return query
+    keys = " OR ".join(slug_key(slug) for slug in slugs)
+    return f"({query}) AND slug_key : ({keys})"
+
+
+def search(
+    query,
+    slugs=None,
+    since=None,
+    until=None,
+    page=1,
+    per_page=20,
+    order="rank",
+    filepath=None,
+):
+    """
+    Full-text search, optionally limited to some slugs and a [since, until)
+    range of entry timestamps. order "rank" returns the best (bm25) of the
+    newest RANK_WINDOW matches first, "time" the most recently indexed
+    matches first. Returns one page of hits and whether more pages exist.
+    """
+
+    # bm25 counts every match of each term once per query, newest first
+    # does without it
+    score = "NULL"
+    if order != "time":
+        score = f"bm25(docs_fts, {', '.join(map(str, COLUMN_WEIGHTS))})"
+
+    # The CROSS JOIN keeps the full-text index as the outer loop, so
+    # matches are read newest first and reading stops at the limit
+    sql = f"""
+        SELECT f.rowid AS id, {score} AS score
+        FROM docs_fts f CROSS JOIN docs d ON d.rowid = f.rowid
+        WHERE docs_fts MATCH ?
+    """
+    filters = []
+    if since is not None:
+        sql += " AND d.sort_time >= ?"
+        filters.append(since)
+    if until is not None:
+        sql += " AND d.sort_time < ?"
+        filters.append(until)
+    sql += " ORDER BY f.rowid DESC LIMIT ?"
+
+    offset = (page - 1) * per_page
+    if order == "time":
+        # One extra row tells whether another page exists without a count
+        sql += " OFFSET ?"
+        limits = [per_page + 1, offset]
+    else:
+        sql = f"""
+            SELECT id, score FROM ({sql})
+            ORDER BY score, id DESC LIMIT ? OFFSET ?
+        """
+        limits = [RANK_WINDOW, per_page + 1, offset]
+
+    with connect(filepath) as conn:
+        match = match_expression(query, slugs)
+        try:
+            rows = conn.execute(sql, [match, *filters, *limits]).fetchall()
+        except sqlite3.OperationalError:
+            match = match_expression(quote_query(query), slugs)
+            rows = conn.execute(sql, [match, *filters, *limits]).fetchall()
+
+        scores = dict(rows[:per_page])
+        if not scores:
+            return [], False
+
+        # Snippets and fields of the page only
+        placeholders = ", ".join("?" * len(scores))
+        details = conn.execute(
+            f"""
+            SELECT f.rowid, d.slug, d.entry_id, d.sort_time, d.title, d.link,
+                snippet(docs_fts, 1, '[', ']', '...', 16)
+            FROM docs_fts f CROSS JOIN docs d ON d.rowid = f.rowid
+            WHERE docs_fts MATCH ? AND f.rowid IN ({placeholders})
+            """,
+            [match, *scores],
+        ).fetchall()
+
+    details = {row[0]: row[1:] for row in details}
+    hits = [
+        {
+            "slug": details[rowid][0],
+            "entry_id": details[rowid][1],
+            "timestamp": details[rowid][2],
+            "title": details[rowid][3],
+            "link": details[rowid][4],
+            "snippet": details[rowid][5],
+            "score": None if score is None else -score,
+        }
+        for rowid, score in scores.items()
+    ]
+    return hits, len(rows) > per_page
+
+
+def stats(filepath=None):
+    with connect(filepath) as conn:
+        num_docs, oldest, newest = conn.execute(
+            "SELECT COUNT(*), MIN(sort_time), MAX(sort_time) FROM docs"
+        ).fetchone()
+        slugs = conn.execute(
+            "SELECT slug, COUNT(*) FROM docs GROUP BY slug ORDER BY slug"
+        ).fetchall()
+
+    path = filepath or INDEX_FILEPATH
+    size = sum(
+        os.path.getsize(path + suffix)
+        for suffix in ["", "-wal"]
+        if os.path.exists(path + suffix)
+    )
+    return {
+        "entries": num_docs,
+        "oldest": oldest,
+        "newest": newest,
+        "slugs": dict(slugs),
+        "size": size,
+    }
+
+
+def compact(older_than=None, slugs=None, filepath=None):
+    """
+    Drop entries older than a timestamp or of the given slugs, merge the
+    full-text index into a single segment and give the free pages back to
+    the file system. Returns the number of dropped entries.
+    """
+
+    num_deleted = 0
+    with connect(filepath) as conn:
+        if older_than is not None:
+            num_deleted += conn.execute(
+                "DELETE FROM docs WHERE sort_time < ?", (older_than,)
+            ).rowcount
+        for slug in slugs or []:
+            num_deleted += conn.execute(
+                "DELETE FROM docs WHERE slug=?", (slug,)
+            ).rowcount
+
+        conn.execute("INSERT INTO docs_fts (docs_fts) VALUES ('optimize')")
+
+    conn = connect(filepath)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    return num_deleted
@@ -0,0 +1,167 @@
+from helpers.feed_helpers.file_helper import atomic_write
+import helpers.cache_helpers.delta_store as delta_store
+import sqlite3
+import logging
+import json
+import time
+import os
+
+DELTA_DIR = os.path.join("rss_feeds", "deltas")
+LATEST_FILEPATH = os.path.join(DELTA_DIR, "latest.json")
+
+
+def new_run_id():
+    """
+    Create the folder of a new delta run and return its id, sortable and
+    unique even for runs in the same second.
+    """
+
+    now = time.time()
+    base = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime(now))
+    base += f"-{int(now * 1000) % 1000:03d}"
+    os.makedirs(DELTA_DIR, exist_ok=True)
+
+    run_id, num = base, 1
+    while True:
+        try:
+            os.mkdir(os.path.join(DELTA_DIR, run_id))
+            return run_id
+        except FileExistsError:
+            run_id, num = f"{base}-{num}", num + 1
+
+
+def read_latest():
+    try:
+        with open(LATEST_FILEPATH, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.error(f"Error reading {LATEST_FILEPATH}: {e}")
+        return None
+
+
+def write_delta_files(run_id, new_entries):
+    results = {}
+    for slug, entries in new_entries.items():
+        results[slug] = atomic_write(
+            os.path.join(DELTA_DIR, run_id, f"{slug}.ndjson"),
+            "".join(
+                json.dumps(entry, ensure_ascii=False) + "\n"
+                for entry in entries
+            ),
+            content_type="application/x-ndjson",
+        )
+    return results
+
+
+def run_manifest(
+    run_id, previous_run_id, output_folder, write_results, new_entries
+):
+    """
+    Slugs with new entries or changed outputs, with their entry counts and
+    the hashes and sizes of their delta and output files.
+    """
+
+    slugs = {}
+    for result in write_results:
+        slug = result["slug"]
+        delta = new_entries.get(slug)
+        if not delta and not any(
+            output["changed"] for output in result["outputs"]
+        ):
+            continue
+
+        slugs[slug] = {
+            "new_entries": len(delta["entries"]) if delta else 0,
+            "delta": delta["file"] if delta else None,
+            "outputs": [
+                {
+                    "path": output["path"],
+                    "sha256": output["sha256"],
+                    "size": output["size"],
+                    "changed": output["changed"],
+                }
+                for output in result["outputs"]
+            ],
+        }
+
+    return {
+        "run_id": run_id,
+        "previous_run_id": previous_run_id,
+        "generated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "output_folder": f"rss_feeds/{output_folder}",
+        "new_entries": sum(slug["new_entries"] for slug in slugs.values()),
+        "slugs": slugs,
+    }
+
+
+def write_run(output_folder, write_results):
+    """
+    Write the entries no earlier run delivered, one NDJSON file per slug, and
+    the run manifest to rss_feeds/deltas/<run id>/, then point latest.json
+    at it. Runs without new entries or changed outputs write nothing.
+    Returns the run id, or None.
+    """
+
+    slug_entries = {
+        result["slug"]: result["delta"]
+        for result in write_results
+        if result.get("delta")
+    }
+    any_changed = any(
+        output["changed"]
+        for result in write_results
+        for output in result["outputs"]
+    )
+
+    try:
+        # Entries only count as delivered once the delta is in place
+        with delta_store.connect() as conn:
+            fresh = delta_store.claim_new(conn, slug_entries)
+            if not fresh and not any_changed:
+                return None
+
+            run_id = new_run_id()
+            files = write_delta_files(run_id, fresh)
+            new_entries = {
+                slug: {"entries": entries, "file": files[slug]}
+                for slug, entries in fresh.items()
+            }
+
+            latest = read_latest()
+            previous_run_id = latest["run_id"] if latest else None
+            manifest_path = os.path.join(DELTA_DIR, run_id, "manifest.json")
+            manifest = run_manifest(
+                run_id,
+                previous_run_id,
+                output_folder,
+                write_results,
+                new_entries,
+            )
+            atomic_write(manifest_path, json.dumps(manifest, indent=2) + "\n")
+
+            # Consumers read the pointer first, so it moves last
+            atomic_write(
+                LATEST_FILEPATH,
+                json.dumps(
+                    {
+                        "run_id": run_id,
+                        "previous_run_id": previous_run_id,
+                        "manifest": manifest_path,
+                        "generated": manifest["generated"],
+                    },
+                    indent=2,
+                )
+                + "\n",
+            )
+
+    except (OSError, sqlite3.Error) as e:
+        logging.error(f"Error writing the delta of this run: {e}")
+        return None
+
+    logging.info(
+        f"Delta {run_id}: {manifest['new_entries']} new entries in "
+        f"{len(fresh)} slugs, {len(manifest['slugs'])} slugs changed"
+    )
+    return run_id
@@ -0,0 +1,123 @@
+import helpers.feed_helpers.retention as retention
+from datetime import datetime, timezone
+import calendar
+import hashlib
+import html
+import re
+
+# Convert feedparser content types to Atom / JSON Feed content types
+TYPE_MAPPING = {
+    "text/plain": "text",
+    "text/html": "html",
+    "application/xhtml+xml": "xhtml",
+}
+
+
+def entry_key(entry):
+    """
+    Stable id for an entry, falling back to its link or a content hash.
+    """
+
+    if entry.get("id"):
+        return entry["id"]
+    if entry.get("link"):
+        return entry["link"]
+
+    content = f'{entry.get("title", "")}{entry.get("summary", "")}'
+    return "sha1:" + hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def strip_html(text):
+    return html.unescape(re.sub("<[^<]+?>", "", text))
+
+
+def timestamp_to_rfc3339(timestamp):
+    if timestamp is None:
+        return None
+    return (
+        datetime.fromtimestamp(timestamp, timezone.utc)
+        .isoformat()
+        .replace("+00:00", "Z")
+    )
+
+
+def entry_time(entry, field):
+    """
+    RFC-3339 time of an entry field, preferring feedparser's struct_time.
+    """
+
+    parsed = entry.get(f"{field}_parsed")
+    if parsed:
+        return timestamp_to_rfc3339(calendar.timegm(tuple(parsed)[:9]))
+    return timestamp_to_rfc3339(retention.parse_timestamp(entry.get(field)))
+
+
+def entry_url(entry):
+    if entry.get("link"):
+        return entry["link"]
+
+    for link in entry.get("links", []):
+        if link.get("rel", "alternate") == "alternate" and link.get("href"):
+            return link["href"]
+    return None
+
+
+def latest_update(entries, default):
+    """
+    Newest entry time, so unchanged entries render byte-identical feeds.
+    """
+
+    timestamps = [
+        timestamp
+        for entry in entries
+        if (timestamp := retention.entry_timestamp(entry)) is not None
+    ]
+    if not timestamps:
+        return default
+    return timestamp_to_rfc3339(max(timestamps))
+
+
+def normalize_entry(entry, feed_data):
+    """
+    Convert a feedparser entry into the format independent entry model
+    used by the JSON Feed, NDJSON and RSS 2.0 renderers.
+    """
+
+    title = entry.get("title") or "No title"
+    title_type = TYPE_MAPPING.get(
+        entry.get("title_detail", {}).get("type"), "text"
+    )
+    if title_type == "text":
+        title = strip_html(title).strip()
+
+    summary = entry.get("summary")
+    summary_type = TYPE_MAPPING.get(
+        entry.get("summary_detail", {}).get("type"), "text"
+    )
+
+    published = entry_time(entry, "published")
+    updated = entry_time(entry, "updated") or published or feed_data["updated"]
+
+    return {
+        "id": entry_key(entry),
+        "url": entry_url(entry),
+        "title": title,
+        "title_type": title_type,
+        "summary": summary,
+        "summary_type": summary_type,
+        "published": published,
+        "updated": updated,
+        "author": entry.get("author"),
+        "tags": [
+            tag["term"] for tag in entry.get("tags", []) if tag.get("term")
+        ],
+        "enclosures": [
+            {
+                "url": enclosure["href"],
+                "type": enclosure.get("type"),
+                "length": enclosure.get("length"),
+            }
+            for enclosure in entry.get("enclosures", [])
+            if enclosure.get("href")
+        ],
+    }
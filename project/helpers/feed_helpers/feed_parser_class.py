@@ -1,6 +1,11 @@
+from helpers.import_helpers.lazy_import import lazy_import
+import helpers.log_helpers.log_pipeline as log_pipeline
 import helpers.cache_helpers.cacher as cacher
 from datetime import datetime
-import feedparser
+import logging
+import time
+
+feedparser = lazy_import("feedparser")
 
 
 class FeedProcessor:
@@ -10,9 +15,10 @@ class FeedProcessor:
             self.response_status,
             self.config,
             self.url,
-            self.feed_text,
+            self.feed_bytes,
             self.caching,
             self.cache_data,
+            self.content_type,
         ) = args
 
     @staticmethod
@@ -21,7 +27,10 @@ class FeedProcessor:
         Wrapper for process_feed to allow for multiprocessing.
         """
         processor = FeedProcessor(args)
-        return processor.process_feed()
+        with log_pipeline.log_context(
+            "parse", processor.config["slug"], processor.url
+        ):
+            return processor.process_feed()
 
     def process_feed_metadata(self, feed):
         """
@@ -62,23 +71,59 @@ class FeedProcessor:
 
         return feed_data
 
+    def find_hub(self, feed):
+        """
+        WebSub hub and topic a feed advertises with <link rel="hub"> and
+        <link rel="self">, or None when it has no hub.
+        """
+
+        hub = None
+        topic = self.url
+        for link in feed.feed.get("links", []):
+            if link.get("rel") == "hub" and hub is None:
+                hub = link.get("href")
+            elif link.get("rel") == "self" and link.get("href"):
+                topic = link["href"]
+
+        return (hub, topic) if hub else None
+
+    @staticmethod
+    def compile_keywords(keywords):
+        """
+        Lowercase and deduplicate keywords once, instead of for every entry.
+        """
+
+        return list(
+            dict.fromkeys(keyword.lower() for keyword in keywords or [])
+        )
+
     @staticmethod
     def check_keywords(entry, match_keywords, exclude_keywords):
         """
         Check if entry matches a keyword and does not contain excluded keywords.
         """
 
+        return FeedProcessor.check_compiled_keywords(
+            entry,
+            FeedProcessor.compile_keywords(match_keywords),
+            FeedProcessor.compile_keywords(exclude_keywords),
+        )
+
+    @staticmethod
+    def check_compiled_keywords(entry, match_keywords, exclude_keywords):
+        """
+        check_keywords with keywords already passed through compile_keywords.
+        """
+
         entry_string = str(entry).lower()
         if not match_keywords:
             return not any(
-                keyword.lower() in entry_string for keyword in exclude_keywords
+                keyword in entry_string for keyword in exclude_keywords
             )
 
         return any(
-            keyword.lower() in entry_string for keyword in match_keywords
-        ) and not any(
-            keyword.lower() in entry_string for keyword in exclude_keywords
-        )
+            keyword in entry_string for keyword in match_keywords
+        ) and not any(keyword in entry_string for keyword in exclude_keywords)
 
     def filter_feed_entries(self, feed):
         """
@@ -86,8 +131,15 @@ class FeedProcessor:
         """
 
         entries = []
-        match_keywords = self.config.get("match", [])
-        exclude_keywords = self.config.get("exclude", [])
+        # Configs from the config loader come with compiled keywords
+        match_keywords = self.config.get("match_keywords")
+        if match_keywords is None:
+            match_keywords = self.compile_keywords(self.config.get("match"))
+        exclude_keywords = self.config.get("exclude_keywords")
+        if exclude_keywords is None:
+            exclude_keywords = self.compile_keywords(
+                self.config.get("exclude")
+            )
 
         last_id = self.cache_data[0] if self.cache_data else None
         num_entries_parsed = 0
@@ -96,7 +148,7 @@ class FeedProcessor:
             num_entries_parsed += 1
             if entry.get("id") and self.caching and entry["id"] == last_id:
                 break
-            if FeedProcessor.check_keywords(
+            if FeedProcessor.check_compiled_keywords(
                 entry, match_keywords, exclude_keywords
             ):
                 entries.append(entry)
@@ -107,10 +159,20 @@ class FeedProcessor:
         Parse and process a fetched URL.
         """
 
+        start_time = time.perf_counter()
+
         try:
             slug_url = self.config["slug"] + self.url
 
-            feed = feedparser.parse(self.feed_text)
+            # Hand feedparser the raw bytes and the Content-Type header so
+            # the body is decoded once with the correct encoding
+            response_headers = {}
+            if self.content_type:
+                response_headers["content-type"] = self.content_type
+
+            feed = feedparser.parse(
+                self.feed_bytes, response_headers=response_headers
+            )
 
             feed_type = "rss" if feed.version.startswith("rss") else "atom"
 
@@ -137,11 +199,12 @@ class FeedProcessor:
                 "filtered_entries": config_filtered_entries,
                 "feed_data": feed_data,
                 "feed_type": feed_type,
+                "parse_seconds": time.perf_counter() - start_time,
+                "hub": self.find_hub(feed),
             }
 
             return (self.config, result_dict, total_num_entries)
 
         except Exception as e:
-            print(f"Error: {e}")
-            print("")
+            logging.error(f"Error parsing {self.url}: {e}")
             return (self.config, None, None)
@@ -0,0 +1,293 @@
+from helpers.import_helpers.lazy_import import lazy_import
+import helpers.feed_helpers.file_helper as file_helper
+import helpers.feed_helpers.renderers as renderers
+import helpers.feed_helpers.deltas as deltas
+from email.utils import formatdate, parsedate_to_datetime
+from collections import OrderedDict
+import logging
+import asyncio
+import hashlib
+import gzip
+import json
+import glob
+import os
+
+web = lazy_import("aiohttp.web")
+
+# Bodies (and their gzip variants) kept in memory, least recently served
+# are dropped first
+CACHE_MB = 64
+
+# Compressing tiny bodies costs more than it saves
+MIN_GZIP_BYTES = 1024
+
+OUTPUT_ROOT = "rss_feeds"
+
+
+class CachedBody:
+    """
+    One version of an output as it is served: the bytes, their strong ETag,
+    the file's mtime as Last-Modified and, once requested, the gzip variant.
+    """
+
+    def __init__(self, data, mtime, content_type):
+        self.data = data
+        self.etag = f'"{hashlib.sha256(data).hexdigest()}"'
+        self.last_modified = int(mtime)
+        self.content_type = content_type
+        self.gzip_data = None
+
+    @property
+    def gzip_etag(self):
+        return self.etag[:-1] + '-gzip"'
+
+    @property
+    def size(self):
+        return len(self.data) + len(self.gzip_data or b"")
+
+
+class FeedCache:
+    """
+    Latest output of every slug by file name, e.g. "tech_feed.xml", seeded
+    from the earlier runs on disk. publish() runs after every write stage,
+    an output rewritten with new content drops its cached body, unchanged
+    outputs stay cached. A body is read from disk on its first request
+    only, so serving does no disk I/O in steady state.
+    """
+
+    def __init__(self, max_mb=CACHE_MB):
+        self.max_bytes = int(max_mb * 2**20)
+        self.outputs = {}
+        self.bodies = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def publish(self, write_results):
+        for result in write_results:
+            for output in result["outputs"]:
+                name = os.path.basename(output["path"])
+                old = self.outputs.get(name)
+                self.outputs[name] = output
+
+                if old is not None and not same_output(old, output):
+                    self.invalidate(name)
+
+    def seed(self, output_root=OUTPUT_ROOT):
+        """
+        Know the newest output of every slug already on disk, so after a
+        restart a slug without new entries is still served until it is
+        written again. The run manifests can't tell, every tick of a
+        schedule rewrites the one of its folder.
+        """
+
+        content_types = {}
+        for renderer in renderers.RENDERERS.values():
+            content_types.setdefault(
+                renderer["suffix"], renderer["content_type"]
+            )
+
+        newest = {}
+        for path in glob.glob(os.path.join(output_root, "*", "*")):
+            name = os.path.basename(path)
+            suffix = next(
+                (suffix for suffix in content_types if name.endswith(suffix)),
+                None,
+            )
+            if suffix is None or path.startswith(deltas.DELTA_DIR + os.sep):
+                continue
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if name not in newest or mtime > newest[name][0]:
+                newest[name] = (mtime, path, content_types[suffix])
+
+        for name, (_, path, content_type) in newest.items():
+            self.outputs.setdefault(
+                name,
+                {
+                    "path": path,
+                    "sha256": None,
+                    "content_type": sidecar_content_type(path) or content_type,
+                },
+            )
+
+        logging.info(f"Serving {len(newest)} outputs of earlier runs")
+
+    def invalidate(self, name):
+        body = self.bodies.pop(name, None)
+        if body is not None:
+            self.num_bytes -= body.size
+
+    def add(self, name, body):
+        self.invalidate(name)
+        self.bodies[name] = body
+        self.num_bytes += body.size
+
+        # The body just served always stays, even when it is over budget
+        while self.num_bytes > self.max_bytes and len(self.bodies) > 1:
+            _, evicted = self.bodies.popitem(last=False)
+            self.num_bytes -= evicted.size
+
+    async def get(self, name):
+        """
+        Cached body of an output, or None for an unknown name.
+        """
+
+        output = self.outputs.get(name)
+        if output is None:
+            return None
+
+        body = self.bodies.get(name)
+        if body is not None:
+            self.hits += 1
+            self.bodies.move_to_end(name)
+            return body
+
+        self.misses += 1
+        try:
+            data, mtime = await asyncio.to_thread(read_output, output["path"])
+        except OSError as e:
+            logging.error(f"Error reading {output['path']} to serve: {e}")
+            return None
+
+        body = CachedBody(
+            data, mtime, output.get("content_type", "application/xml")
+        )
+        # publish() may have swapped in a new version during the read, the
+        # old bytes are still fine for this request but must not be cached
+        if same_output(self.outputs.get(name), output):
+            self.add(name, body)
+        return body
+
+    async def get_gzip(self, name, body):
+        if body.gzip_data is None:
+            body.gzip_data = await asyncio.to_thread(
+                gzip.compress, body.data, 6, mtime=0
+            )
+            # Counted once it exists, unless the body was replaced meanwhile
+            if self.bodies.get(name) is body:
+                self.num_bytes += len(body.gzip_data)
+        return body.gzip_data
+
+    def stats(self):
+        return {
+            "outputs": len(self.outputs),
+            "cached": len(self.bodies),
+            "cached_bytes": self.num_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def same_output(old, new):
+    return (
+        old is not None
+        and old["path"] == new["path"]
+        and old["sha256"] == new["sha256"]
+    )
+
+
+def sidecar_content_type(path):
+    # Written with --compress, it has the charset the output was written in
+    try:
+        with open(path + file_helper.SIDECAR_SUFFIX, "r") as f:
+            return json.load(f)["content_type"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_output(path):
+    with open(path, "rb") as f:
+        return f.read(), os.fstat(f.fileno()).st_mtime
+
+
+def accepts_gzip(request):
+    for coding in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() not in ("gzip", "*"):
+            continue
+        params = params.replace(" ", "")
+        return params not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+def not_modified(request, body):
+    """
+    If-None-Match wins over If-Modified-Since, like RFC 9110 asks.
+    """
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        etags = {
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        }
+        return bool(etags & {"*", body.etag, body.gzip_etag})
+
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return body.last_modified <= since
+
+    return False
+
+
+async def start_feed_server(
+    feed_cache, port, host="127.0.0.1", prefix="/feeds"
+):
+    """
+    Serve the latest output of every slug at <prefix>/<file name> on the
+    running event loop, with conditional requests and gzip.
+    """
+
+    async def feed(request):
+        name = request.match_info["name"]
+        body = await feed_cache.get(name)
+        if body is None:
+            raise web.HTTPNotFound()
+
+        use_gzip = len(body.data) >= MIN_GZIP_BYTES and accepts_gzip(request)
+        headers = {
+            "ETag": body.gzip_etag if use_gzip else body.etag,
+            "Last-Modified": formatdate(body.last_modified, usegmt=True),
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+
+        if not_modified(request, body):
+            return web.Response(status=304, headers=headers)
+
+        data = body.data
+        if use_gzip:
+            data = await feed_cache.get_gzip(name, body)
+            headers["Content-Encoding"] = "gzip"
+
+        headers["Content-Type"] = body.content_type
+        return web.Response(body=data, headers=headers)
+
+    async def index(request):
+        return web.json_response(
+            {
+                "feeds": {
+                    name: f"{prefix}/{name}"
+                    for name in sorted(feed_cache.outputs)
+                },
+                "cache": feed_cache.stats(),
+            }
+        )
+
+    app = web.Application()
+    app.router.add_get(prefix, index)
+    app.router.add_get(prefix + "/{name}", feed)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    logging.info(f"Serving feeds on http://{host}:{port}{prefix}/")
+
+    return runner
@@ -1,46 +1,145 @@
-from helpers.feed_helpers.feed_writer_class import (
-    FeedProcessorET,
-    FeedProcessorSTR,
-)
+from helpers.feed_helpers.entry_model import latest_update, normalize_entry
+from helpers.feed_helpers.file_helper import atomic_write
+import helpers.feed_helpers.retention as retention
+import helpers.cache_helpers.entry_store as store
+import helpers.cache_helpers.search_index as search_index
+import helpers.feed_helpers.renderers as renderers
+import helpers.log_helpers.log_pipeline as log_pipeline
+import json
+import time
+
+
+def store_window(slug, entries, feed_data, feed_type, retention_policy):
+    """
+    Upsert new entries into the store and return the slug's current window.
+    """
+
+    if entries:
+        store.upsert_entries(slug, entries, feed_data, feed_type)
+        store.prune(slug, retention_policy)
+
+    if not feed_data:
+        feed_data, feed_type = store.fetch_feed(slug)
+
+    return store.fetch_entries(slug, retention_policy), feed_data, feed_type
 
 
 def output_feed(args_list):
     """
-    Output XML feeds to respective files.
+    Output feeds to respective files in every requested format, logging
+    with the slug as context.
+    """
+
+    with log_pipeline.log_context("write", args_list[0][0]):
+        return write_feed(args_list)
+
+
+def write_feed(args_list):
+    """
+    Write the outputs of one slug.
     """
 
-    slug, entries, feed_data, feed_type, caching, entries_only = args_list[0]
+    (
+        slug,
+        entries,
+        feed_data,
+        feed_type,
+        caching,
+        entries_only,
+        writer_options,
+        slug_options,
+    ) = args_list[0]
     output_folder = args_list[1]
 
-    output_file = f"rss_feeds/{output_folder}/{slug}_feed.xml"
+    start_time = time.perf_counter()
+    retention_policy = slug_options["retention"]
+    result = {
+        "slug": slug,
+        "outputs": [],
+        "stdout": [],
+        "delta": [],
+        "write_seconds": 0,
+    }
 
-    # If no entries or feed_data, then don't write to filex
-    if not entries or not feed_data:
-        if not caching:
-            with open(output_file, "w") as f:
-                pass
-        return None
-
-    xml_output = ""
-    if entries_only:
-        process_ET = FeedProcessorSTR(
-            entries, feed_data, feed_type, output_file
+    # New entries of this run, streamed to stdout as NDJSON and handed back
+    # for the run's delta if requested
+    normalized = []
+    if entries and (
+        writer_options.get("ndjson_stdout") or writer_options.get("deltas")
+    ):
+        normalized = [normalize_entry(entry, feed_data) for entry in entries]
+
+    if writer_options.get("ndjson_stdout"):
+        result["stdout"] = [
+            json.dumps({"slug": slug, **entry}, ensure_ascii=False)
+            for entry in normalized
+        ]
+
+    if writer_options.get("deltas"):
+        result["delta"] = normalized
+
+    # New entries of this run are searchable right after they are written
+    if writer_options.get("index") and entries:
+        search_index.index_entries(slug, entries)
+
+    if writer_options.get("store"):
+        # Render from the entry store instead of merging with the old file
+        entries, feed_data, feed_type = store_window(
+            slug, entries, feed_data, feed_type, retention_policy
         )
-        process_ET.process_all()
+        caching = False
+
+    # If no entries or feed_data, then there is nothing new to write
+    if not entries or not feed_data:
+        return result
+
+    entries = retention.trim_entries(entries, retention_policy)
+    feed_data = {
+        **feed_data,
+        "updated": latest_update(entries, feed_data["updated"]),
+    }
+
+    job = renderers.RenderJob(
+        slug,
+        entries,
+        feed_data,
+        feed_type,
+        caching,
+        retention_policy,
+        writer_options,
+        output_folder,
+    )
+    result["outputs"] = renderers.render_all(job, slug_options["formats"])
+    result["write_seconds"] = time.perf_counter() - start_time
 
-        if caching:
-            process_ET.cache()
+    return result
 
-        xml_output = process_ET.get_xml()
 
-    else:
-        process_STR = FeedProcessorET(entries, feed_data, output_file)
-        process_STR.process_all()
+def write_manifest(output_folder, write_results):
+    """
+    Write the run manifest listing which slugs and outputs actually changed.
+    """
+
+    outputs = [
+        output for result in write_results for output in result["outputs"]
+    ]
+    changed_slugs = sorted(
+        {
+            result["slug"]
+            for result in write_results
+            if any(output["changed"] for output in result["outputs"])
+        }
+    )
 
-        if caching:
-            process_STR.cache()
+    manifest = {
+        "generated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "changed_slugs": changed_slugs,
+        "outputs": outputs,
+    }
 
-        xml_output = process_STR.get_xml()
+    atomic_write(
+        f"rss_feeds/{output_folder}/manifest.json",
+        json.dumps(manifest, indent=2) + "\n",
+    )
 
-    with open(output_file, "w") as f:
-        f.write(xml_output)
+    return changed_slugs
@@ -1,13 +1,20 @@
+from helpers.feed_helpers.file_helper import atomic_open
+from helpers.import_helpers.lazy_import import lazy_import
+import helpers.feed_helpers.retention as retention
+from xml.sax.saxutils import escape, quoteattr
+from email.utils import format_datetime
 from datetime import datetime, timezone
 from abc import ABC, abstractmethod
 import xml.etree.ElementTree as ET
-from dateutil.parser import parse
 import xml.dom.minidom
 import logging
 import html
+import io
 import os
 import re
 
+dateutil_parser = lazy_import("dateutil.parser")
+
 
 class FeedProcessorBase(ABC):
     @abstractmethod
@@ -60,10 +67,16 @@ class FeedProcessorBase(ABC):
 
 
 class FeedProcessorET(FeedProcessorBase):
-    def __init__(self, entries, feed_data, output_file):
+    # Where entries sit in the output file and which child holds their date
+    ENTRY_TAG = "entry"
+    ENTRY_DEPTH = 1
+    DATE_TAG = "updated"
+
+    def __init__(self, entries, feed_data, output_file, retention=None):
         self.entries = entries
         self.feed_data = feed_data
         self.output_file = output_file
+        self.retention = retention
         self.root = ET.Element("feed", xmlns="http://www.w3.org/2005/Atom")
         super().__init__()
 
@@ -107,9 +120,9 @@ class FeedProcessorET(FeedProcessorBase):
             cleaned_title = html.unescape(cleaned_title)
             ET.SubElement(self.entry_element, "title").text = cleaned_title
         else:
-            ET.SubElement(
-                self.entry_element, "title", type="html"
-            ).text = title
+            ET.SubElement(self.entry_element, "title", type="html").text = (
+                title
+            )
 
     # Optional
     def process_published(self):
@@ -262,7 +275,7 @@ class FeedProcessorET(FeedProcessorBase):
         """
 
         tzinfos = {"UT": 0}
-        return parse(time_string, tzinfos=tzinfos)
+        return dateutil_parser.parse(time_string, tzinfos=tzinfos)
 
     def clean_xml(self, element):
         """
@@ -298,42 +311,321 @@ class FeedProcessorET(FeedProcessorBase):
         dom = xml.dom.minidom.parseString(xml_string)
         return dom.toprettyxml(indent="  ", encoding=encoding).decode(encoding)
 
-    def cache(self):
-        new_tree = ET.ElementTree(self.root)
-        new_root = new_tree.getroot()
+    def iter_cached_entries(self):
+        """
+        Yield entries of the existing output file that are within retention.
+        The file is read incrementally and reading stops once the entry budget
+        is used up, so the cost is bounded by the retention and not the history.
+        """
 
-        if os.path.exists(self.output_file):
-            try:
-                with open(self.output_file, "r") as f:
-                    content = f.read()
+        budget = retention.old_entry_budget(len(self.entries), self.retention)
+        if budget == 0 or not os.path.exists(self.output_file):
+            return
 
-                content = content.replace(
-                    ' xmlns="http://www.w3.org/2005/Atom"', ""
-                )
+        cutoff = retention.cutoff_timestamp(self.retention)
+        num_kept = 0
+        open_elements = []
 
-                old_tree = ET.fromstring(content)
+        for event, element in ET.iterparse(
+            self.output_file, events=("start", "end")
+        ):
+            if event == "start":
+                open_elements.append(element)
+                continue
 
-                logging.info("Merging with existing file")
+            open_elements.pop()
+            depth = len(open_elements)
+            if (
+                depth != self.ENTRY_DEPTH
+                or element.tag.rsplit("}", 1)[-1] != self.ENTRY_TAG
+            ):
+                continue
 
-                for entry in old_tree.findall("entry"):
-                    new_root.append(entry)
+            # Output is written with a default namespace, strip it again
+            for child in element.iter():
+                child.tag = child.tag.rsplit("}", 1)[-1]
 
-                self.root = new_root
+            updated = retention.parse_timestamp(
+                element.findtext(self.DATE_TAG)
+            )
+            if not retention.is_expired(updated, cutoff):
+                yield element
+                num_kept += 1
 
-            except ET.ParseError:
-                logging.error(
-                    f"The file {self.output_file} could not be parsed and will be overwritten."
-                )
+            # Drop parsed entries from their parent (<feed>, or <channel> of
+            # RSS), so memory stays per-entry
+            open_elements[-1].clear()
 
-            except Exception as e:
-                logging.error(f"Error: {e}")
+            if budget is not None and num_kept >= budget:
+                return
+
+    def cache(self):
+        if not os.path.exists(self.output_file):
+            return
+
+        logging.info("Merging with existing file")
+
+        try:
+            for entry in self.iter_cached_entries():
+                self.root.append(entry)
+
+        except ET.ParseError:
+            logging.error(
+                f"The file {self.output_file} could not be fully parsed, remaining old entries were dropped."
+            )
+
+        except Exception as e:
+            logging.error(f"Error: {e}")
 
     def get_xml(self):
         return self.prettify_xml()
 
 
+class FeedProcessorStream(FeedProcessorET):
+    """
+    Atom writer that streams entries to the output file one by one.
+    Entries are built with the FeedProcessorET handlers, serialized and
+    dropped, so peak memory is a single entry rather than the whole feed.
+    """
+
+    # Characters that are not allowed anywhere in an XML 1.0 document
+    INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+    def __init__(
+        self, entries, feed_data, output_file, retention=None, indent="  "
+    ):
+        super().__init__(entries, feed_data, output_file, retention)
+        self.indent = indent
+        self.encoding = feed_data.get("encoding") or "utf-8"
+        self.stream = None
+
+    def write(self, caching=False, **write_options):
+        """
+        Write the feed to a temporary file and move it over the output file.
+        """
+
+        with atomic_open(
+            self.output_file,
+            self.encoding,
+            "xmlcharrefreplace",
+            **write_options,
+        ) as self.stream:
+            self.process_all()
+
+            if caching:
+                self.cache()
+
+            self.write_footer()
+
+        write_result = self.stream.result(self.output_file)
+        self.stream = None
+        return write_result
+
+    def process_all(self):
+        """
+        Write the feed header and every new entry to the stream.
+        """
+
+        self.stream.write(
+            f'<?xml version="1.0" encoding="{self.encoding}"?>\n'
+            '<feed xmlns="http://www.w3.org/2005/Atom">'
+        )
+
+        for tag in ["title", "id", "updated"]:
+            element = ET.Element(tag)
+            element.text = self.feed_data[tag]
+            self.write_element(element, 1)
+
+        handlers = {
+            "title": self.process_title,
+            "published": self.process_published,
+            "updated": self.process_updated,
+            "id": self.process_id,
+            "summary": self.process_summary,
+            "enclosures": self.process_enclosures,
+            "tags": self.process_tags,
+            "link": self.process_links,
+            "author": self.process_author,
+        }
+        for entry in self.entries:
+            self.entry_element = ET.Element("entry")
+            self.entry = entry
+
+            for _, handler in handlers.items():
+                handler()
+
+            self.write_element(self.entry_element, 1)
+
+        self.entry_element = None
+
+    def write_footer(self):
+        if self.indent is not None:
+            self.stream.write("\n")
+        self.stream.write("</feed>\n")
+
+    def clean_text(self, text):
+        return self.INVALID_XML_CHARS.sub("", text.strip())
+
+    def write_element(self, element, depth):
+        """
+        Serialize an element (and its children) with optional indentation.
+        """
+
+        padding = "\n" + self.indent * depth if self.indent is not None else ""
+        tag = element.tag.rsplit("}", 1)[-1]
+
+        attributes = "".join(
+            f" {key.rsplit('}', 1)[-1]}={quoteattr(self.clean_text(value))}"
+            for key, value in element.attrib.items()
+            if value is not None
+        )
+        text = self.clean_text(element.text) if element.text else ""
+        children = list(element)
+
+        if not children and not text:
+            self.stream.write(f"{padding}<{tag}{attributes}/>")
+        elif not children:
+            self.stream.write(
+                f"{padding}<{tag}{attributes}>{escape(text)}</{tag}>"
+            )
+        else:
+            self.stream.write(f"{padding}<{tag}{attributes}>{escape(text)}")
+            for child in children:
+                self.write_element(child, depth + 1)
+            self.stream.write(f"{padding}</{tag}>")
+
+    def cache(self):
+        """
+        Stream the entries of the existing output file after the new ones.
+        """
+
+        if not os.path.exists(self.output_file):
+            return
+
+        logging.info("Merging with existing file")
+
+        try:
+            for entry in self.iter_cached_entries():
+                self.write_element(entry, self.ENTRY_DEPTH)
+
+        except ET.ParseError:
+            logging.error(
+                f"The file {self.output_file} could not be fully parsed, remaining old entries were dropped."
+            )
+
+        except Exception as e:
+            logging.error(f"Error: {e}")
+
+    def get_xml(self):
+        """
+        Render the feed to a string, mainly for callers that need it in memory.
+        """
+
+        with io.StringIO() as self.stream:
+            self.process_all()
+            self.write_footer()
+            xml_output = self.stream.getvalue()
+
+        self.stream = None
+        return xml_output
+
+
+class FeedProcessorRSS(FeedProcessorStream):
+    """
+    Streaming RSS 2.0 writer driven by normalized entries (see entry_model).
+    """
+
+    ENTRY_TAG = "item"
+    ENTRY_DEPTH = 2
+    DATE_TAG = "pubDate"
+
+    def process_all(self):
+        """
+        Write the channel header and every new item to the stream.
+        """
+
+        self.stream.write(
+            f'<?xml version="1.0" encoding="{self.encoding}"?>\n'
+            '<rss version="2.0">'
+        )
+        if self.indent is not None:
+            self.stream.write("\n" + self.indent)
+        self.stream.write("<channel>")
+
+        channel = {
+            "title": self.feed_data["title"],
+            "link": self.feed_data["id"],
+            "description": self.feed_data["title"],
+            "lastBuildDate": self.rfc822(self.feed_data["updated"]),
+        }
+        for tag, text in channel.items():
+            element = ET.Element(tag)
+            element.text = text
+            self.write_element(element, 2)
+
+        for entry in self.entries:
+            self.write_element(self.build_item(entry), 2)
+
+    def build_item(self, entry):
+        item = ET.Element("item")
+        ET.SubElement(item, "title").text = entry["title"]
+
+        if entry["url"]:
+            ET.SubElement(item, "link").text = entry["url"]
+
+        if entry["summary"]:
+            ET.SubElement(item, "description").text = entry["summary"]
+
+        # RSS 2.0 only allows an email address in author
+        if entry["author"] and "@" in entry["author"]:
+            ET.SubElement(item, "author").text = entry["author"]
+
+        for tag in entry["tags"]:
+            ET.SubElement(item, "category").text = tag
+
+        for enclosure in entry["enclosures"]:
+            ET.SubElement(
+                item,
+                "enclosure",
+                url=enclosure["url"],
+                type=enclosure["type"] or "application/octet-stream",
+                length=str(enclosure["length"] or 0),
+            )
+
+        is_permalink = "true" if entry["id"] == entry["url"] else "false"
+        guid = ET.SubElement(item, "guid", isPermaLink=is_permalink)
+        guid.text = entry["id"]
+
+        date = entry["published"] or entry["updated"]
+        if date:
+            ET.SubElement(item, "pubDate").text = self.rfc822(date)
+
+        return item
+
+    def rfc822(self, date_str):
+        timestamp = retention.parse_timestamp(date_str)
+        if timestamp is None:
+            return date_str
+        return format_datetime(
+            datetime.fromtimestamp(timestamp, timezone.utc), usegmt=True
+        )
+
+    def write_footer(self):
+        if self.indent is not None:
+            self.stream.write("\n" + self.indent)
+        self.stream.write("</channel>")
+        if self.indent is not None:
+            self.stream.write("\n")
+        self.stream.write("</rss>\n")
+
+
 class FeedProcessorSTR(FeedProcessorBase):
-    def __init__(self, entries, feed_data, feed_type, output_file):
+    # Matches the first date line of a cached entry or item
+    DATE_PATTERN = re.compile(r"<(updated|published|pubDate)>(.*?)</")
+
+    def __init__(
+        self, entries, feed_data, feed_type, output_file, retention=None
+    ):
         self.feed_atom = False
         if feed_type == "rss":
             self.wrapper_tag = "item"
@@ -345,6 +637,7 @@ class FeedProcessorSTR(FeedProcessorBase):
         self.xml_strings = []
         self.encoding = feed_data.get("encoding", "utf-8")
         self.output_file = output_file
+        self.retention = retention
         super().__init__()
 
     def process_all(self):
@@ -477,9 +770,46 @@ class FeedProcessorSTR(FeedProcessorBase):
     def get_xml(self):
         return "\n".join(self.xml_strings) + "\n\n"
 
+    def is_expired_block(self, block, cutoff):
+        for line in block:
+            date_match = self.DATE_PATTERN.search(line)
+            if date_match:
+                timestamp = retention.parse_timestamp(date_match.group(2))
+                return retention.is_expired(timestamp, cutoff)
+        return False
+
     def cache(self):
-        if os.path.exists(self.output_file):
-            with open(self.output_file, "r", encoding=self.encoding) as f:
-                existing_content = f.read()
+        """
+        Append cached entries line by line, stopping once retention is met.
+        """
+
+        budget = retention.old_entry_budget(len(self.entries), self.retention)
+        if budget == 0 or not os.path.exists(self.output_file):
+            return
+
+        cutoff = retention.cutoff_timestamp(self.retention)
+        num_kept = 0
+        block = None
+
+        with open(self.output_file, "r", encoding=self.encoding) as f:
+            for line in f:
+                line = line.rstrip("\n")
+
+                if line in ("<item>", "<entry>"):
+                    block = [line]
+                    continue
+
+                if block is None:
+                    continue
+
+                block.append(line)
+                if line not in ("</item>", "</entry>"):
+                    continue
+
+                if not self.is_expired_block(block, cutoff):
+                    self.xml_strings.extend(block)
+                    num_kept += 1
 
-                self.xml_strings.extend(existing_content.splitlines())
+                block = None
+                if budget is not None and num_kept >= budget:
+                    break
@@ -0,0 +1,242 @@
+import helpers.cache_helpers.cacher as cacher
+from contextlib import contextmanager
+from email.utils import formatdate
+import tempfile
+import hashlib
+import json
+import zlib
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compressed variants written next to an output, by Content-Encoding
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "br": ".br"}
+
+SIDECAR_SUFFIX = ".meta.json"
+
+
+def make_temp_file(output_file):
+    directory = os.path.dirname(output_file) or "."
+    return tempfile.mkstemp(
+        dir=directory,
+        prefix=f".{os.path.basename(output_file)}.",
+        suffix=".tmp",
+    )
+
+
+def move_into_place(temp_file, output_file):
+    # mkstemp creates the file as 0600, outputs are meant to be served
+    os.chmod(temp_file, 0o644)
+    os.replace(temp_file, output_file)
+
+
+class CompressedCopy:
+    """
+    Compressed variant of an output, compressed incrementally while the
+    output itself is being written.
+    """
+
+    def __init__(self, output_file, content_encoding):
+        self.content_encoding = content_encoding
+        self.path = output_file + COMPRESSED_SUFFIXES[content_encoding]
+        fd, self.temp_file = make_temp_file(self.path)
+        self.raw = os.fdopen(fd, "wb")
+        self.size = 0
+
+        if content_encoding == "gzip":
+            # wbits=31 writes a gzip container with a zero mtime, so equal
+            # content always compresses to equal bytes
+            self.compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+            self.flush = self.compressor.flush
+        else:
+            self.compressor = brotli.Compressor()
+            self.flush = self.compressor.finish
+
+    def write(self, data):
+        compressed = (
+            self.compressor.compress(data)
+            if self.content_encoding == "gzip"
+            else self.compressor.process(data)
+        )
+        self.size += len(compressed)
+        self.raw.write(compressed)
+
+    def finish(self):
+        tail = self.flush()
+        self.size += len(tail)
+        self.raw.write(tail)
+        self.raw.close()
+
+    def discard(self):
+        if not self.raw.closed:
+            self.raw.close()
+        if os.path.exists(self.temp_file):
+            os.remove(self.temp_file)
+
+
+class HashingWriter:
+    """
+    Text writer that encodes once and hashes (and optionally compresses)
+    the bytes as they are written.
+    """
+
+    def __init__(
+        self,
+        raw,
+        encoding="utf-8",
+        errors="strict",
+        copies=None,
+        content_type="application/xml",
+    ):
+        self.raw = raw
+        self.encoding = encoding
+        self.errors = errors
+        self.copies = copies or []
+        self.content_type = content_type
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.content_hash = None
+        self.changed = True
+
+    def write(self, text):
+        data = text.encode(self.encoding, self.errors)
+        self.hasher.update(data)
+        self.size += len(data)
+        for copy in self.copies:
+            copy.write(data)
+        return self.raw.write(data)
+
+    def result(self, output_file):
+        return {
+            "path": output_file,
+            "changed": self.changed,
+            "sha256": self.content_hash,
+            "size": self.size,
+            "content_type": f"{self.content_type}; charset={self.encoding}",
+        }
+
+
+def write_sidecar(output_file, writer, content_type):
+    """
+    Strong ETag, length and compressed variants of an output, so a static
+    server can answer conditional and compressed requests without work.
+    """
+
+    sidecar = {
+        "etag": f'"{writer.content_hash}"',
+        "content_length": writer.size,
+        "content_type": f"{content_type}; charset={writer.encoding}",
+        "last_modified": formatdate(usegmt=True),
+        "encodings": {
+            copy.content_encoding: {
+                "path": os.path.basename(copy.path),
+                "etag": f'"{writer.content_hash}-{copy.content_encoding}"',
+                "content_length": copy.size,
+            }
+            for copy in writer.copies
+        },
+    }
+
+    fd, temp_file = make_temp_file(output_file + SIDECAR_SUFFIX)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(sidecar, f, indent=2)
+
+    move_into_place(temp_file, output_file + SIDECAR_SUFFIX)
+
+
+@contextmanager
+def atomic_open(
+    output_file,
+    encoding="utf-8",
+    errors="strict",
+    skip_unchanged=False,
+    compress=False,
+    content_type="application/xml",
+    record_hash=False,
+):
+    """
+    Open a temporary file next to output_file and move it into place on close.
+    Readers see either the old or the new file, never a half-written one.
+    With skip_unchanged the old file is kept untouched (no mtime churn) when
+    the new content hashes the same as the last write of this output path,
+    which only happens within a scheduler or daemon session, other runs
+    write to a new folder.
+    With record_hash (implied by skip_unchanged) the hash of every write is
+    stored, so a later skip_unchanged write compares against what is on
+    disk even when this one was forced.
+    With compress, .gz (and .br when brotli is installed) variants and a
+    .meta.json sidecar are produced in the same pass.
+    """
+
+    fd, temp_file = make_temp_file(output_file)
+    copies = []
+
+    try:
+        if compress:
+            copies.append(CompressedCopy(output_file, "gzip"))
+            if brotli is not None:
+                copies.append(CompressedCopy(output_file, "br"))
+
+        with os.fdopen(fd, "wb") as raw:
+            writer = HashingWriter(raw, encoding, errors, copies, content_type)
+            yield writer
+            raw.flush()
+
+            writer.content_hash = writer.hasher.hexdigest()
+            if (
+                skip_unchanged
+                and os.path.exists(output_file)
+                and (
+                    not compress
+                    or os.path.exists(output_file + SIDECAR_SUFFIX)
+                )
+                and cacher.fetch_output_hash(output_file)
+                == writer.content_hash
+            ):
+                writer.changed = False
+            else:
+                os.fsync(raw.fileno())
+
+        if not writer.changed:
+            os.remove(temp_file)
+            for copy in copies:
+                copy.discard()
+            return
+
+        # Compressed variants first, so they are never older than the output
+        for copy in copies:
+            copy.finish()
+            move_into_place(copy.temp_file, copy.path)
+
+        move_into_place(temp_file, output_file)
+
+        if compress:
+            write_sidecar(output_file, writer, content_type)
+
+        if skip_unchanged or record_hash:
+            cacher.update_output_hash(
+                output_file, writer.content_hash, writer.size
+            )
+
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        for copy in copies:
+            copy.discard()
+        raise
+
+
+def atomic_write(output_file, text, encoding="utf-8", **write_options):
+    """
+    Atomically replace output_file with text, returning the write result.
+    """
+
+    with atomic_open(
+        output_file, encoding, "xmlcharrefreplace", **write_options
+    ) as f:
+        f.write(text)
+
+    return f.result(output_file)
@@ -0,0 +1,344 @@
+from helpers.feed_helpers.feed_writer_class import (
+    FeedProcessorStream,
+    FeedProcessorRSS,
+    FeedProcessorET,
+    FeedProcessorSTR,
+)
+from helpers.feed_helpers.file_helper import atomic_open, atomic_write
+from helpers.feed_helpers.entry_model import normalize_entry
+import helpers.feed_helpers.retention as retention
+from itertools import chain
+import logging
+import json
+import os
+
+RENDERERS = {}
+
+JSON_FEED_VERSION = "https://jsonfeed.org/version/1.1"
+
+
+def register_renderer(name, suffix, content_type):
+    """
+    Register a renderer for an output format, suffix is appended to the slug.
+    """
+
+    def decorator(render):
+        RENDERERS[name] = {
+            "render": render,
+            "suffix": suffix,
+            "content_type": content_type,
+        }
+        return render
+
+    return decorator
+
+
+class RenderJob:
+    """
+    Everything the renderers need for one slug. Normalized entries are
+    built once on first use and shared by every format rendered in the pass.
+    """
+
+    def __init__(
+        self,
+        slug,
+        entries,
+        feed_data,
+        feed_type,
+        caching,
+        retention_policy,
+        writer_options,
+        output_folder,
+    ):
+        self.slug = slug
+        self.entries = entries
+        self.feed_data = feed_data
+        self.feed_type = feed_type
+        self.caching = caching
+        self.retention = retention_policy
+        self.writer_options = writer_options
+        self.output_folder = output_folder
+        self._normalized = None
+
+    @property
+    def normalized(self):
+        if self._normalized is None:
+            self._normalized = [
+                normalize_entry(entry, self.feed_data)
+                for entry in self.entries
+            ]
+        return self._normalized
+
+    def output_file(self, name):
+        suffix = RENDERERS[name]["suffix"]
+        return f"rss_feeds/{self.output_folder}/{self.slug}{suffix}"
+
+    def write_options(self, name):
+        """
+        Keyword arguments for file_helper.atomic_open.
+        """
+
+        return {
+            "skip_unchanged": self.writer_options.get("skip_unchanged", True),
+            "compress": self.writer_options.get("compress", False),
+            "content_type": RENDERERS[name]["content_type"],
+            # --always_write outputs still record their hash, a later run
+            # would otherwise compare against older content
+            "record_hash": True,
+        }
+
+
+def default_formats(entries_only=True):
+    return ["entries"] if entries_only else ["atom"]
+
+
+def resolve_formats(formats, entries_only=True):
+    """
+    Validate requested formats, falling back to the flag based default.
+    """
+
+    resolved = []
+    for name in formats or []:
+        if name not in RENDERERS:
+            logging.error(f"Unknown output format '{name}', skipping it")
+        elif name not in resolved:
+            resolved.append(name)
+
+    if "entries" in resolved and "atom" in resolved:
+        logging.error("Formats entries and atom share a file, using atom")
+        resolved.remove("entries")
+
+    return resolved or default_formats(entries_only)
+
+
+def render_all(job, formats):
+    """
+    Render every format for a slug and return one write result per file.
+    """
+
+    write_results = []
+    for name in formats:
+        try:
+            write_results.append(RENDERERS[name]["render"](job))
+
+        except Exception as e:
+            logging.error(f"Error rendering {name} for {job.slug}: {e}")
+
+    return write_results
+
+
+def cached_lines(output_file, budget, cutoff, date_of):
+    """
+    Yield records of a line based output that are within retention.
+    """
+
+    if budget == 0 or not os.path.exists(output_file):
+        return
+
+    num_kept = 0
+    with open(output_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            record = json.loads(line)
+            timestamp = retention.parse_timestamp(date_of(record))
+            if retention.is_expired(timestamp, cutoff):
+                continue
+
+            yield record
+            num_kept += 1
+            if budget is not None and num_kept >= budget:
+                return
+
+
+@register_renderer("entries", "_feed.xml", "application/xml")
+def render_entries(job):
+    """
+    Entries / items only, without feed level Atom formatting.
+    """
+
+    output_file = job.output_file("entries")
+    processor = FeedProcessorSTR(
+        job.entries, job.feed_data, job.feed_type, output_file, job.retention
+    )
+    processor.process_all()
+
+    if job.caching:
+        processor.cache()
+
+    return atomic_write(
+        output_file,
+        processor.get_xml(),
+        processor.encoding,
+        **job.write_options("entries"),
+    )
+
+
+@register_renderer("atom", "_feed.xml", "application/atom+xml")
+def render_atom(job):
+    """
+    Valid Atom feed, streamed by default or built with ElementTree.
+    """
+
+    output_file = job.output_file("atom")
+
+    if job.writer_options.get("writer_mode", "stream") == "stream":
+        processor = FeedProcessorStream(
+            job.entries, job.feed_data, output_file, job.retention
+        )
+        return processor.write(job.caching, **job.write_options("atom"))
+
+    processor = FeedProcessorET(
+        job.entries, job.feed_data, output_file, job.retention
+    )
+    processor.process_all()
+
+    if job.caching:
+        processor.cache()
+
+    return atomic_write(
+        output_file,
+        processor.get_xml(),
+        job.feed_data.get("encoding", "utf-8"),
+        **job.write_options("atom"),
+    )
+
+
+@register_renderer("rss", "_rss.xml", "application/rss+xml")
+def render_rss(job):
+    """
+    Streaming RSS 2.0 channel.
+    """
+
+    processor = FeedProcessorRSS(
+        job.normalized, job.feed_data, job.output_file("rss"), job.retention
+    )
+    return processor.write(job.caching, **job.write_options("rss"))
+
+
+def jsonfeed_item(entry):
+    """
+    Convert a normalized entry to a JSON Feed 1.1 item.
+    """
+
+    item = {"id": entry["id"], "title": entry["title"]}
+
+    if entry["url"]:
+        item["url"] = entry["url"]
+
+    if entry["summary"] and entry["summary_type"] == "text":
+        item["content_text"] = entry["summary"]
+    elif entry["summary"]:
+        item["content_html"] = entry["summary"]
+
+    if entry["published"]:
+        item["date_published"] = entry["published"]
+    item["date_modified"] = entry["updated"]
+
+    if entry["author"]:
+        item["authors"] = [{"name": entry["author"]}]
+
+    if entry["tags"]:
+        item["tags"] = entry["tags"]
+
+    attachments = []
+    for enclosure in entry["enclosures"]:
+        attachment = {
+            "url": enclosure["url"],
+            "mime_type": enclosure["type"] or "application/octet-stream",
+        }
+        if str(enclosure["length"] or "").isdigit():
+            attachment["size_in_bytes"] = int(enclosure["length"])
+        attachments.append(attachment)
+
+    if attachments:
+        item["attachments"] = attachments
+
+    return item
+
+
+def cached_jsonfeed_items(output_file, budget, cutoff):
+    if budget == 0 or not os.path.exists(output_file):
+        return []
+
+    try:
+        with open(output_file, "r", encoding="utf-8") as f:
+            items = json.load(f).get("items", [])
+
+    except (ValueError, AttributeError):
+        logging.error(
+            f"The file {output_file} could not be parsed and will be overwritten."
+        )
+        return []
+
+    items = [
+        item
+        for item in items
+        if not retention.is_expired(
+            retention.parse_timestamp(item.get("date_modified")), cutoff
+        )
+    ]
+    return items if budget is None else items[:budget]
+
+
+@register_renderer("jsonfeed", "_feed.json", "application/feed+json")
+def render_jsonfeed(job):
+    """
+    JSON Feed 1.1, items are written one by one.
+    """
+
+    output_file = job.output_file("jsonfeed")
+
+    old_items = []
+    if job.caching:
+        budget = retention.old_entry_budget(len(job.entries), job.retention)
+        cutoff = retention.cutoff_timestamp(job.retention)
+        old_items = cached_jsonfeed_items(output_file, budget, cutoff)
+
+    header = {
+        "version": JSON_FEED_VERSION,
+        "title": job.feed_data["title"],
+    }
+    if job.feed_data["id"].startswith(("http://", "https://")):
+        header["home_page_url"] = job.feed_data["id"]
+    if job.feed_data.get("author"):
+        header["authors"] = [{"name": job.feed_data["author"]}]
+
+    with atomic_open(output_file, **job.write_options("jsonfeed")) as f:
+        f.write(json.dumps(header, ensure_ascii=False)[:-1])
+        f.write(', "items": [')
+
+        items = (jsonfeed_item(entry) for entry in job.normalized)
+        for index, item in enumerate(chain(items, old_items)):
+            f.write(",\n" if index else "\n")
+            f.write(json.dumps(item, ensure_ascii=False))
+
+        f.write("\n]}\n")
+
+    return f.result(output_file)
+
+
+@register_renderer("ndjson", "_feed.ndjson", "application/x-ndjson")
+def render_ndjson(job):
+    """
+    One normalized entry per line.
+    """
+
+    output_file = job.output_file("ndjson")
+
+    with atomic_open(output_file, **job.write_options("ndjson")) as f:
+        for entry in job.normalized:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+        if job.caching:
+            budget = retention.old_entry_budget(
+                len(job.entries), job.retention
+            )
+            cutoff = retention.cutoff_timestamp(job.retention)
+            for record in cached_lines(
+                output_file, budget, cutoff, lambda record: record["updated"]
+            ):
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    return f.result(output_file)
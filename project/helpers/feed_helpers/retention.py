@@ -0,0 +1,115 @@
+from helpers.import_helpers.lazy_import import lazy_import
+from datetime import timezone
+import calendar
+import time
+
+dateutil_parser = lazy_import("dateutil.parser")
+
+
+def make_retention(max_entries=None, max_age_days=None):
+    """
+    Build a retention policy, None values mean unbounded.
+    """
+
+    return {
+        "max_entries": int(max_entries) if max_entries else None,
+        "max_age_days": float(max_age_days) if max_age_days else None,
+    }
+
+
+def slug_retention(config, defaults=None):
+    """
+    Retention for a slug, config values take precedence over the defaults.
+    """
+
+    defaults = defaults or {}
+
+    return make_retention(
+        config.get("max_entries") or defaults.get("max_entries"),
+        config.get("max_age_days") or defaults.get("max_age_days"),
+    )
+
+
+def cutoff_timestamp(retention):
+    """
+    Oldest timestamp an entry may have, or None when age is unbounded.
+    """
+
+    if not retention or not retention["max_age_days"]:
+        return None
+    return time.time() - retention["max_age_days"] * 86400
+
+
+def parse_timestamp(date_str):
+    """
+    Convert a date string from an output file into a UTC timestamp.
+    """
+
+    if not date_str:
+        return None
+
+    try:
+        parsed_date = dateutil_parser.parse(date_str, tzinfos={"UT": 0})
+    except (ValueError, OverflowError):
+        return None
+
+    if parsed_date.tzinfo is None:
+        parsed_date = parsed_date.replace(tzinfo=timezone.utc)
+    return parsed_date.timestamp()
+
+
+def entry_timestamp(entry):
+    """
+    Timestamp of a parsed feed entry, preferring the parsed struct_time.
+    """
+
+    for field in ["updated", "published"]:
+        parsed = entry.get(f"{field}_parsed")
+        if parsed:
+            return calendar.timegm(tuple(parsed)[:9])
+
+        timestamp = parse_timestamp(entry.get(field))
+        if timestamp is not None:
+            return timestamp
+
+    return None
+
+
+def is_expired(timestamp, cutoff):
+    """
+    Entries without a usable date are never expired.
+    """
+
+    return cutoff is not None and timestamp is not None and timestamp < cutoff
+
+
+def trim_entries(entries, retention):
+    """
+    Drop new entries that fall outside the retention window.
+    """
+
+    if not retention:
+        return entries
+
+    cutoff = cutoff_timestamp(retention)
+    if cutoff is not None:
+        entries = [
+            entry
+            for entry in entries
+            if not is_expired(entry_timestamp(entry), cutoff)
+        ]
+
+    if retention["max_entries"]:
+        entries = entries[: retention["max_entries"]]
+
+    return entries
+
+
+def old_entry_budget(num_new_entries, retention):
+    """
+    Number of cached entries that may still be kept, None means unbounded.
+    """
+
+    if not retention or not retention["max_entries"]:
+        return None
+    return max(retention["max_entries"] - num_new_entries, 0)
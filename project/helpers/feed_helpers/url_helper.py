@@ -0,0 +1,78 @@
+from urllib.parse import urlsplit, urlunsplit
+
+# Query parameters that only track where a click came from, dropped from
+# feed URLs
+TRACKING_PREFIXES = ("utm_",)
+TRACKING_PARAMS = {
+    "fbclid",
+    "gclid",
+    "dclid",
+    "msclkid",
+    "yclid",
+    "igshid",
+    "mc_cid",
+    "mc_eid",
+    "_hsenc",
+    "_hsmi",
+}
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def normalize_url(url):
+    """
+    URL as it is fetched: lowercase scheme and host, no default port, no
+    fragment and no tracking parameters. Anything else, like the path and
+    the order of the other parameters, is kept as servers may care.
+    """
+
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    if parts.scheme.lower() not in DEFAULT_PORTS or not parts.hostname:
+        return url
+
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname
+    if ":" in netloc:
+        netloc = f"[{netloc}]"
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        netloc += f":{port}"
+    if parts.username or parts.password:
+        credentials = parts.username or ""
+        if parts.password is not None:
+            credentials += f":{parts.password}"
+        netloc = f"{credentials}@{netloc}"
+
+    # Filtered as raw pairs, so the kept ones stay encoded as they were
+    query = "&".join(
+        pair
+        for pair in parts.query.split("&")
+        if pair and not is_tracking_param(pair.partition("=")[0])
+    )
+
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+def url_key(url):
+    """
+    Key near-identical URLs share: the normalized URL without its scheme
+    and trailing slash, so http / https and "/feed" / "/feed/" variants of
+    a feed are fetched once.
+    """
+
+    url = normalize_url(url)
+    scheme, _, rest = url.partition("://")
+    if scheme not in DEFAULT_PORTS:
+        return url
+
+    path, query_mark, query = rest.partition("?")
+    return path.rstrip("/") + query_mark + query
@@ -0,0 +1,349 @@
+from helpers.import_helpers.lazy_import import lazy_import
+import helpers.cache_helpers.cacher as cacher
+import logging
+import asyncio
+import secrets
+import hmac
+import time
+
+aiohttp = lazy_import("aiohttp")
+web = lazy_import("aiohttp.web")
+
+# Lease asked from hubs, a hub may grant a different one
+LEASE_SECONDS = 10 * 24 * 60 * 60
+
+# Leases are renewed this long before they expire, or halfway through
+# shorter leases, and at least two ticks before
+RENEW_SECONDS = 60 * 60
+
+# Subscriptions a hub did not verify, or denied, are tried again after this
+RETRY_SECONDS = 60 * 60
+
+SIGNATURE_ALGORITHMS = {"sha1", "sha256", "sha384", "sha512"}
+
+CALLBACK_PATH = "/websub"
+
+
+class WebSub:
+    """
+    WebSub (PubSubHubbub) subscriptions of the feeds that advertise a hub.
+    Parsing reports hubs to observe(), maintain() runs after every tick to
+    subscribe, renew and unsubscribe. Feeds with a verified, unexpired lease
+    are pushed by their hub and left out of polling, a lapsed lease puts
+    them back. Pushed bodies are handed to on_push(url, body, content_type),
+    one at a time and never during a tick.
+    """
+
+    def __init__(self, callback_url, interval, on_push):
+        self.callback_url = callback_url.rstrip("/")
+        self.interval = interval
+        self.on_push = on_push
+        self.lock = asyncio.Lock()
+        self.discovered = {}
+        self.renewals = {}
+        self.pushes = set()
+        self.subscriptions = {
+            subscription["url"]: subscription
+            for subscription in cacher.fetch_subscriptions()
+        }
+
+    def find(self, token):
+        for subscription in self.subscriptions.values():
+            if subscription["token"] == token:
+                return subscription
+        return None
+
+    def save(self, subscription, **changes):
+        subscription.update(changes, updated=time.time())
+        cacher.update_subscription(subscription)
+
+    def delete(self, subscription):
+        self.subscriptions.pop(subscription["url"], None)
+        cacher.delete_subscription(subscription["url"])
+
+    def is_pushed(self, subscription, now):
+        return (
+            subscription["status"] == "active"
+            and subscription["lease_expires"] > now
+        )
+
+    def observe(self, fetch_results, parse_results):
+        """
+        Remember the hubs of polled feeds, parse results in input order.
+        """
+
+        for fetch_result, parse_result in zip(fetch_results, parse_results):
+            if not parse_result or not parse_result[1]:
+                continue
+
+            url = fetch_result[2]
+            hub = parse_result[1].get("hub")
+            if hub:
+                self.discovered[url] = tuple(hub)
+            else:
+                self.discovered.pop(url, None)
+
+    def polled_config(self, config):
+        """
+        Config without the URLs hubs push, records left without URLs drop.
+        """
+
+        now = time.time()
+        pushed = {
+            url
+            for url, subscription in self.subscriptions.items()
+            if self.is_pushed(subscription, now)
+        }
+        if not pushed:
+            return config
+
+        logging.info(f"Skipping {len(pushed)} URLs pushed by WebSub hubs")
+
+        polled = []
+        for record in config:
+            urls = [url for url in record["urls"] if url not in pushed]
+            if urls:
+                polled.append({**record, "urls": urls})
+        return polled
+
+    async def request(self, session, subscription, mode):
+        """
+        Ask the hub to (un)subscribe, it confirms through the callback.
+        """
+
+        data = {
+            "hub.mode": mode,
+            "hub.topic": subscription["topic"],
+            "hub.callback": f"{self.callback_url}{CALLBACK_PATH}/"
+            f"{subscription['token']}",
+        }
+        if mode == "subscribe":
+            data["hub.secret"] = subscription["secret"]
+            data["hub.lease_seconds"] = str(LEASE_SECONDS)
+
+        try:
+            async with session.post(
+                subscription["hub"], data=data
+            ) as response:
+                if response.status >= 300:
+                    logging.error(
+                        f"Error WebSub {mode} to {subscription['hub']} for "
+                        f"{subscription['url']}: {response.status} "
+                        f"{(await response.text())[:200]}"
+                    )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(
+                f"Error WebSub {mode} to {subscription['hub']} for "
+                f"{subscription['url']}: {e}"
+            )
+
+    async def subscribe(self, session, url, hub, topic):
+        subscription = self.subscriptions.get(url)
+        if subscription is None or (hub, topic) != (
+            subscription["hub"],
+            subscription["topic"],
+        ):
+            # A new callback token, the old hub gets 410 for its pushes
+            subscription = {
+                "url": url,
+                "token": secrets.token_urlsafe(16),
+                "hub": hub,
+                "topic": topic,
+                "secret": secrets.token_hex(32),
+                "status": "pending",
+                "lease_expires": None,
+            }
+            self.subscriptions[url] = subscription
+
+        # Saved before the request, hubs may verify before they answer it.
+        # An active subscription keeps its lease until the renewal is verified
+        if subscription["status"] != "active":
+            self.save(subscription, status="pending")
+        else:
+            self.renewals[url] = time.time()
+
+        logging.info(f"WebSub subscribing to {topic} at {hub}")
+        await self.request(session, subscription, "subscribe")
+
+    async def maintain(self, session, config):
+        """
+        Subscribe newly found hubs, renew expiring leases, retry failed
+        subscriptions and unsubscribe URLs no longer in the config.
+        """
+
+        now = time.time()
+        urls = {url for record in config for url in record["urls"]}
+
+        for url, subscription in list(self.subscriptions.items()):
+            if url in urls:
+                continue
+            if subscription["status"] == "active":
+                self.save(subscription, status="unsubscribing")
+                await self.request(session, subscription, "unsubscribe")
+            elif (
+                subscription["status"] != "unsubscribing"
+                or now - subscription["updated"] >= RETRY_SECONDS
+            ):
+                self.delete(subscription)
+
+        for url, (hub, topic) in self.discovered.items():
+            subscription = self.subscriptions.get(url)
+            if url not in urls:
+                continue
+            if (
+                subscription is None
+                or (hub, topic) != (subscription["hub"], subscription["topic"])
+                or (
+                    subscription["status"] != "active"
+                    and now - subscription["updated"] >= RETRY_SECONDS
+                )
+            ):
+                await self.subscribe(session, url, hub, topic)
+
+        # A renewal keeps the old lease until the hub verifies it, so it is
+        # only asked for again when that takes a while
+        for url, subscription in list(self.subscriptions.items()):
+            if subscription["status"] != "active":
+                continue
+            margin = self.renew_margin(subscription)
+            if (
+                subscription["lease_expires"] - now < margin
+                and now - self.renewals.get(url, 0) >= margin / 4
+            ):
+                await self.subscribe(
+                    session, url, subscription["hub"], subscription["topic"]
+                )
+
+    def renew_margin(self, subscription):
+        # updated is when the hub verified the current lease
+        lease_seconds = subscription["lease_expires"] - subscription["updated"]
+        return max(min(RENEW_SECONDS, lease_seconds / 2), 2 * self.interval)
+
+    def verify(self, subscription, query):
+        """
+        Answer a hub's verification of intent, returning the challenge to
+        echo or None to refuse it.
+        """
+
+        mode = query.get("hub.mode")
+        if query.get("hub.topic") != subscription["topic"]:
+            return None
+
+        if mode == "subscribe" and subscription["status"] in (
+            "pending",
+            "active",
+        ):
+            try:
+                lease_seconds = int(
+                    query.get("hub.lease_seconds", LEASE_SECONDS)
+                )
+            except ValueError:
+                lease_seconds = LEASE_SECONDS
+            self.save(
+                subscription,
+                status="active",
+                lease_expires=time.time() + lease_seconds,
+            )
+            logging.info(
+                f"WebSub subscribed to {subscription['topic']} for "
+                f"{lease_seconds} seconds"
+            )
+            return query.get("hub.challenge", "")
+
+        if mode == "unsubscribe" and subscription["status"] == "unsubscribing":
+            self.delete(subscription)
+            logging.info(f"WebSub unsubscribed from {subscription['topic']}")
+            return query.get("hub.challenge", "")
+
+        return None
+
+    def valid_signature(self, subscription, body, signature):
+        algorithm, _, digest = (signature or "").partition("=")
+        if algorithm not in SIGNATURE_ALGORITHMS:
+            return False
+
+        expected = hmac.new(
+            subscription["secret"].encode("utf-8"), body, algorithm
+        ).hexdigest()
+        return hmac.compare_digest(expected, digest)
+
+    async def handle_push(self, url, body, content_type):
+        async with self.lock:
+            try:
+                await self.on_push(url, body, content_type)
+            except Exception as e:
+                logging.exception(
+                    f"Error processing WebSub push of {url}: {e}"
+                )
+
+    def push(self, subscription, body, content_type):
+        # The hub gets its answer right away, the body is written after
+        task = asyncio.create_task(
+            self.handle_push(subscription["url"], body, content_type)
+        )
+        self.pushes.add(task)
+        task.add_done_callback(self.pushes.discard)
+
+    async def close(self):
+        if self.pushes:
+            await asyncio.gather(*self.pushes)
+
+
+async def start_websub_server(websub, port, host="127.0.0.1"):
+    """
+    Serve the WebSub callbacks, <CALLBACK_PATH>/<token>, on the running
+    event loop.
+    """
+
+    async def verify(request):
+        subscription = websub.find(request.match_info["token"])
+        if subscription is None:
+            raise web.HTTPNotFound()
+
+        if request.query.get("hub.mode") == "denied":
+            websub.save(subscription, status="denied")
+            logging.error(
+                f"WebSub hub denied {subscription['topic']}: "
+                f"{request.query.get('hub.reason', 'no reason given')}"
+            )
+            return web.Response(text="")
+
+        challenge = websub.verify(subscription, request.query)
+        if challenge is None:
+            raise web.HTTPNotFound()
+        return web.Response(text=challenge)
+
+    async def receive(request):
+        subscription = websub.find(request.match_info["token"])
+        if subscription is None:
+            # Tells the hub this subscription is gone
+            raise web.HTTPGone()
+
+        body = await request.read()
+        if not websub.valid_signature(
+            subscription, body, request.headers.get("X-Hub-Signature")
+        ):
+            # Hubs must not learn whether the signature matched
+            logging.warning(
+                f"Ignoring WebSub push of {subscription['url']} with a bad "
+                "signature"
+            )
+            return web.Response(status=202)
+
+        logging.info(f"WebSub push of {subscription['url']}")
+        websub.push(subscription, body, request.headers.get("Content-Type"))
+        return web.Response(status=202)
+
+    app = web.Application()
+    app.router.add_get(CALLBACK_PATH + "/{token}", verify)
+    app.router.add_post(CALLBACK_PATH + "/{token}", receive)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    logging.info(
+        f"Serving WebSub callbacks on http://{host}:{port}{CALLBACK_PATH}/"
+    )
+
+    return runner
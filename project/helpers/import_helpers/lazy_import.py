@@ -0,0 +1,31 @@
+import importlib
+
+
+class LazyModule:
+    """
+    Module that is only imported on first attribute access, so heavy
+    dependencies are paid for by the stages that use them instead of by
+    every CLI invocation and spawned worker.
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def load(self):
+        # import_module holds the import lock, so concurrent first uses
+        # from worker threads still import the module once
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name):
+    return LazyModule(name)
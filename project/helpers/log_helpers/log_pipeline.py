@@ -0,0 +1,229 @@
+from helpers.import_helpers.lazy_import import lazy_import
+from contextvars import ContextVar
+from datetime import datetime
+import contextlib
+import logging
+import atexit
+import queue
+import json
+
+multiprocessing = lazy_import("multiprocessing")
+handlers = lazy_import("logging.handlers")
+
+# Stages records can be tagged with, untagged records belong to "main"
+STAGES = ["main", "fetch", "parse", "write"]
+
+TAGS = ["stage", "slug", "url"]
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+log_tags = ContextVar("log_tags", default={})
+
+pipeline = None
+
+
+@contextlib.contextmanager
+def log_context(stage, slug=None, url=None):
+    """
+    Tag the records logged inside with a stage, slug and URL. Context
+    variables follow asyncio tasks, so concurrent fetches keep their own.
+    """
+
+    token = log_tags.set({"stage": stage, "slug": slug, "url": url})
+    try:
+        yield
+    finally:
+        log_tags.reset(token)
+
+
+def parse_stage_levels(value):
+    """
+    Stage levels from "fetch=WARNING,parse=ERROR".
+    """
+
+    stage_levels = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        stage, _, level = item.partition("=")
+        stage, level = stage.strip(), level.strip().upper()
+        if stage not in STAGES:
+            raise ValueError(f"unknown stage {stage}, use {', '.join(STAGES)}")
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"unknown level {level}")
+        stage_levels[stage] = logging.getLevelName(level)
+    return stage_levels
+
+
+class StageFilter(logging.Filter):
+    """
+    Tags records with the current log context and drops the ones below
+    the level of their stage, before they are queued.
+    """
+
+    def __init__(self, level, stage_levels):
+        super().__init__()
+        self.level = level
+        self.stage_levels = stage_levels
+
+    def filter(self, record):
+        tags = log_tags.get()
+        for tag in TAGS:
+            if getattr(record, tag, None) is None:
+                setattr(record, tag, tags.get(tag))
+
+        level = self.stage_levels.get(record.stage or "main", self.level)
+        return record.levelno >= level
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, tags only when set.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "process": record.processName,
+        }
+        if record.name != "root":
+            entry["logger"] = record.name
+        for tag in TAGS:
+            value = getattr(record, tag, None)
+            if value is not None:
+                entry[tag] = value
+        entry["message"] = record.getMessage()
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    The classic line format, with the tags in brackets.
+    """
+
+    def format(self, record):
+        line = super().format(record)
+        tags = [
+            str(getattr(record, tag))
+            for tag in TAGS
+            if getattr(record, tag, None) is not None
+        ]
+        if not tags:
+            return line
+        head, _, message = line.partition(f"{record.levelname} - ")
+        return f"{head}{record.levelname} - [{' '.join(tags)}] {message}"
+
+
+def skip_blank(record):
+    # Blank lines only separate sections of the text log
+    return record.getMessage() != ""
+
+
+def install_queue_handler(log_queue, level, stage_levels):
+    """
+    Route every record of this process to log_queue.
+    """
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+
+    queue_handler = handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(StageFilter(level, stage_levels))
+    root.addHandler(queue_handler)
+    root.setLevel(min([level, *stage_levels.values()]))
+
+
+class LogPipeline:
+    """
+    Records of every thread are queued by a QueueHandler and written by one
+    background QueueListener, so logging never waits on the file. Process
+    pool workers get a multiprocessing queue, created with the first pool,
+    that a second listener drains into the same file.
+    """
+
+    def __init__(self, log_path, level, stage_levels, log_format):
+        self.level = level
+        self.stage_levels = stage_levels
+        self.handler = logging.FileHandler(log_path, "w", encoding="utf-8")
+        if log_format == "json":
+            self.handler.setFormatter(JsonFormatter())
+            self.handler.addFilter(skip_blank)
+        else:
+            self.handler.setFormatter(TextFormatter(TEXT_FORMAT))
+
+        self.process_queue = None
+        self.listeners = []
+
+        # Nothing but the GIL guards a SimpleQueue put
+        log_queue = queue.SimpleQueue()
+        install_queue_handler(log_queue, level, stage_levels)
+        self.listen(log_queue)
+
+    def listen(self, log_queue):
+        listener = handlers.QueueListener(log_queue, self.handler)
+        listener.start()
+        self.listeners.append(listener)
+
+    def worker_args(self):
+        if self.process_queue is None:
+            self.process_queue = multiprocessing.Queue()
+            self.listen(self.process_queue)
+        return (self.process_queue, self.level, self.stage_levels)
+
+    def stop(self):
+        for listener in self.listeners:
+            listener.stop()
+        self.listeners = []
+        self.handler.close()
+
+
+def setup_logging(
+    log_path, level=logging.INFO, stage_levels=None, log_format="json"
+):
+    """
+    Log every process of the run to log_path through the pipeline.
+    """
+
+    global pipeline
+    if pipeline is None:
+        atexit.register(stop_logging)
+    else:
+        pipeline.stop()
+
+    pipeline = LogPipeline(log_path, level, stage_levels or {}, log_format)
+    return pipeline
+
+
+def stop_logging():
+    """
+    Write out the queued records, at exit or before logging elsewhere.
+    """
+
+    global pipeline
+    if pipeline is not None:
+        pipeline.stop()
+        pipeline = None
+
+
+def worker_args():
+    """
+    Initializer arguments of process pool workers.
+    """
+
+    if pipeline is None:
+        return (None, None, None)
+    return pipeline.worker_args()
+
+
+def init_worker(log_queue, level, stage_levels):
+    """
+    Process pool initializer, a forked worker would otherwise keep the
+    parent's in-process queue that nothing drains.
+    """
+
+    if log_queue is not None:
+        install_queue_handler(log_queue, level, stage_levels)
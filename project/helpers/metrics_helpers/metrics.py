@@ -0,0 +1,297 @@
+from helpers.feed_helpers.file_helper import atomic_write
+import bisect
+import json
+import time
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = tuple(2**power for power in range(10, 25, 2))
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    "rss_fetch_requests_total": (
+        "counter",
+        "Fetches per URL by response status",
+        None,
+    ),
+    "rss_fetch_bytes_total": ("counter", "Bytes downloaded per URL", None),
+    "rss_fetch_duration_seconds": (
+        "histogram",
+        "Fetch latency per URL",
+        DURATION_BUCKETS,
+    ),
+    "rss_fetch_size_bytes": (
+        "histogram",
+        "Response body size per slug",
+        SIZE_BUCKETS,
+    ),
+    "rss_parse_duration_seconds": (
+        "histogram",
+        "Parse and filter time per URL",
+        DURATION_BUCKETS,
+    ),
+    "rss_parse_entries_total": ("counter", "Entries parsed per URL", None),
+    "rss_parse_matched_entries_total": (
+        "counter",
+        "Entries matching the slug keywords per URL",
+        None,
+    ),
+    "rss_parse_errors_total": ("counter", "Failed parses per URL", None),
+    "rss_write_duration_seconds": (
+        "histogram",
+        "Render and write time per slug",
+        DURATION_BUCKETS,
+    ),
+    "rss_write_outputs_total": (
+        "counter",
+        "Outputs written per slug, by whether their content changed",
+        None,
+    ),
+    "rss_stage_duration_seconds": (
+        "histogram",
+        "Duration of each run stage",
+        DURATION_BUCKETS,
+    ),
+    "rss_runs_total": ("counter", "Completed runs", None),
+    "rss_last_run_timestamp_seconds": (
+        "gauge",
+        "Unix time the last run finished",
+        None,
+    ),
+}
+
+
+def label_key(labels):
+    # Values as strings, like they are exported, so series with an int
+    # status (200) and a str one ("timeout") still sort
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+
+    def escape(value):
+        return (
+            str(value)
+            .replace("\\", "\\\\")
+            .replace("\n", "\\n")
+            .replace('"', '\\"')
+        )
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of one run (or, merged, of a daemon's
+    lifetime), plus the raw per-URL and per-slug records of the run.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.histograms = {}
+        self.stages = {}
+        self.fetches = []
+        self.parses = []
+        self.writes = []
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        self.values[(name, label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, label_key(labels))
+        buckets = METRICS[name][2]
+
+        if key not in self.histograms:
+            self.histograms[key] = {
+                "buckets": [0] * len(buckets),
+                "sum": 0,
+                "count": 0,
+            }
+
+        histogram = self.histograms[key]
+        # Buckets are cumulative upper bounds, +Inf is the count
+        for index in range(bisect.bisect_left(buckets, value), len(buckets)):
+            histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def record_fetch(self, slug, url, status, seconds, num_bytes=0):
+        self.fetches.append(
+            {
+                "slug": slug,
+                "url": url,
+                "status": status,
+                "seconds": round(seconds, 6),
+                "bytes": num_bytes,
+            }
+        )
+        self.inc("rss_fetch_requests_total", slug=slug, url=url, status=status)
+        self.inc("rss_fetch_bytes_total", num_bytes, slug=slug, url=url)
+        self.observe("rss_fetch_duration_seconds", seconds, slug=slug, url=url)
+        if num_bytes:
+            self.observe("rss_fetch_size_bytes", num_bytes, slug=slug)
+
+    def record_parse(self, slug, url, seconds, num_entries, num_matched):
+        self.parses.append(
+            {
+                "slug": slug,
+                "url": url,
+                "seconds": round(seconds, 6),
+                "entries": num_entries,
+                "matched": num_matched,
+            }
+        )
+        self.observe("rss_parse_duration_seconds", seconds, slug=slug, url=url)
+        self.inc("rss_parse_entries_total", num_entries, slug=slug, url=url)
+        self.inc(
+            "rss_parse_matched_entries_total", num_matched, slug=slug, url=url
+        )
+
+    def record_parse_error(self, slug, url):
+        self.inc("rss_parse_errors_total", slug=slug, url=url)
+
+    def record_write(self, slug, seconds, outputs):
+        self.writes.append(
+            {
+                "slug": slug,
+                "seconds": round(seconds, 6),
+                "outputs": len(outputs),
+                "changed": sum(1 for output in outputs if output["changed"]),
+                "bytes": sum(output["size"] for output in outputs),
+            }
+        )
+        self.observe("rss_write_duration_seconds", seconds, slug=slug)
+        for output in outputs:
+            self.inc(
+                "rss_write_outputs_total",
+                slug=slug,
+                changed=str(output["changed"]).lower(),
+            )
+
+    def record_stage(self, stage, seconds):
+        self.stages[stage] = round(seconds, 6)
+        self.observe("rss_stage_duration_seconds", seconds, stage=stage)
+
+    def finish_run(self):
+        self.inc("rss_runs_total")
+        self.set("rss_last_run_timestamp_seconds", round(time.time(), 3))
+
+    def merge(self, other):
+        """
+        Add the counters and histograms of another run into this one.
+        """
+
+        for key, value in other.values.items():
+            if METRICS[key[0]][0] == "gauge":
+                self.values[key] = value
+            else:
+                self.values[key] = self.values.get(key, 0) + value
+
+        for key, histogram in other.histograms.items():
+            if key not in self.histograms:
+                self.histograms[key] = {
+                    "buckets": list(histogram["buckets"]),
+                    "sum": histogram["sum"],
+                    "count": histogram["count"],
+                }
+                continue
+
+            merged = self.histograms[key]
+            merged["buckets"] = [
+                a + b for a, b in zip(merged["buckets"], histogram["buckets"])
+            ]
+            merged["sum"] += histogram["sum"]
+            merged["count"] += histogram["count"]
+
+    def report(self):
+        """
+        JSON run report, slowest fetches first.
+        """
+
+        return {
+            "generated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "stages": self.stages,
+            "totals": {
+                "urls": len(self.fetches),
+                "bytes": sum(fetch["bytes"] for fetch in self.fetches),
+                "entries_parsed": sum(
+                    parse["entries"] for parse in self.parses
+                ),
+                "entries_matched": sum(
+                    parse["matched"] for parse in self.parses
+                ),
+                "slugs_written": len(self.writes),
+            },
+            "fetches": sorted(
+                self.fetches, key=lambda fetch: fetch["seconds"], reverse=True
+            ),
+            "parses": sorted(
+                self.parses, key=lambda parse: parse["seconds"], reverse=True
+            ),
+            "writes": sorted(
+                self.writes, key=lambda write: write["seconds"], reverse=True
+            ),
+        }
+
+    def prometheus_text(self):
+        """
+        Prometheus text exposition format (version 0.0.4).
+        """
+
+        lines = []
+        for name, (metric_type, help_text, buckets) in METRICS.items():
+            series = sorted(
+                (key[1], value)
+                for key, value in {
+                    **self.values,
+                    **self.histograms,
+                }.items()
+                if key[0] == name
+            )
+            if not series:
+                continue
+
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+            for labels, value in series:
+                if metric_type != "histogram":
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+                    continue
+
+                for bound, count in zip(buckets, value["buckets"]):
+                    le = format_labels(labels, [("le", f"{bound:g}")])
+                    lines.append(f"{name}_bucket{le} {count}")
+                le = format_labels(labels, [("le", "+Inf")])
+                lines.append(f"{name}_bucket{le} {value['count']}")
+                lines.append(
+                    f"{name}_sum{format_labels(labels)} {value['sum']:.6f}"
+                )
+                lines.append(
+                    f"{name}_count{format_labels(labels)} {value['count']}"
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+def write_reports(output_folder, run_metrics, total_metrics=None):
+    """
+    Write metrics.json (this run) and metrics.prom (all runs of this
+    process) into the output folder.
+    """
+
+    total_metrics = total_metrics or run_metrics
+    atomic_write(
+        f"rss_feeds/{output_folder}/metrics.json",
+        json.dumps(run_metrics.report(), indent=2) + "\n",
+    )
+    atomic_write(
+        f"rss_feeds/{output_folder}/metrics.prom",
+        total_metrics.prometheus_text(),
+    )
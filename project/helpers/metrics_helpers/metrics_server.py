@@ -0,0 +1,38 @@
+from helpers.import_helpers.lazy_import import lazy_import
+import logging
+import json
+
+web = lazy_import("aiohttp.web")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+async def start_metrics_server(state, port, host="127.0.0.1"):
+    """
+    Serve /metrics (Prometheus text, every run of the daemon) and
+    /metrics.json (report of the latest run) on the running event loop.
+    """
+
+    async def prometheus(request):
+        return web.Response(
+            body=state.metrics.prometheus_text().encode("utf-8"),
+            headers={"Content-Type": PROMETHEUS_CONTENT_TYPE},
+        )
+
+    async def report(request):
+        return web.Response(
+            text=json.dumps(state.last_report or {}, indent=2),
+            content_type="application/json",
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", prometheus)
+    app.router.add_get("/metrics.json", report)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    return runner
@@ -0,0 +1,174 @@
+import threading
+import logging
+import sys
+import cProfile
+import pstats
+import glob
+import json
+import time
+import os
+
+# One profiler per worker thread, cProfile can only profile the thread
+# that enabled it
+local = threading.local()
+
+# Process and thread run_profiled profiles, tasks running there are already
+# covered by main.pstats
+main_profiled = None
+
+
+def make_profile_dir():
+    profile_dir = os.path.join(
+        "profiles", f"profile_{time.strftime('%Y-%m-%d_%H-%M-%S')}"
+    )
+    os.makedirs(profile_dir, exist_ok=True)
+    return profile_dir
+
+
+def worker_name(stage):
+    return f"{stage}-{os.getpid()}-{threading.get_ident()}"
+
+
+def profiled_by_main():
+    """
+    Whether the main profiler already sees this thread. A second cProfile
+    on its thread detaches it (3.11) or fails (3.12+, where one profiler
+    covers every thread of the process).
+    """
+
+    if main_profiled is None or main_profiled[0] != os.getpid():
+        return False
+    return main_profiled[1] == threading.get_ident() or sys.version_info >= (
+        3,
+        12,
+    )
+
+
+class ProfiledTask:
+    """
+    Picklable wrapper that runs a stage task under this worker's profiler
+    and records the CPU time of every input, so pool workers (processes or
+    threads) are profiled as well as the main process. Tasks the main
+    profiler already sees, like serial and asyncio ones, are only timed.
+    """
+
+    def __init__(self, func, stage, profile_dir, item_key):
+        self.func = func
+        self.stage = stage
+        self.profile_dir = profile_dir
+        self.item_key = item_key
+
+    def __call__(self, item):
+        # A forked worker inherits the thread locals of the forking thread
+        if getattr(local, "pid", None) != os.getpid():
+            local.pid = os.getpid()
+            local.profiler = None
+            local.costs = []
+        if local.profiler is None and not profiled_by_main():
+            local.profiler = cProfile.Profile()
+
+        start_cpu = time.thread_time()
+        start_wall = time.perf_counter()
+        try:
+            if local.profiler is None:
+                return self.func(item)
+            return local.profiler.runcall(self.func, item)
+        finally:
+            local.costs.append(
+                {
+                    "key": self.item_key(item),
+                    "cpu": time.thread_time() - start_cpu,
+                    "wall": time.perf_counter() - start_wall,
+                }
+            )
+            self.save()
+
+    def save(self):
+        # Pool workers have no exit hook, so the cumulative stats of this
+        # worker are rewritten after every task
+        name = os.path.join(self.profile_dir, worker_name(self.stage))
+        if local.profiler is not None:
+            local.profiler.dump_stats(f"{name}.pstats")
+        with open(f"{name}.costs.json", "w") as f:
+            json.dump(local.costs, f)
+
+
+def wrap(func, stage, profile_dir, item_key):
+    if not profile_dir:
+        return func
+    return ProfiledTask(func, stage, profile_dir, item_key)
+
+
+def merge_stage(profile_dir, stage):
+    """
+    Merge the worker stats of a stage into <stage>.pstats and return the
+    summed cost of every input, most expensive first.
+    """
+
+    worker_stats = sorted(
+        glob.glob(os.path.join(profile_dir, f"{stage}-*.pstats"))
+    )
+    if worker_stats:
+        pstats.Stats(*worker_stats).dump_stats(
+            os.path.join(profile_dir, f"{stage}.pstats")
+        )
+        for path in worker_stats:
+            os.remove(path)
+
+    costs = {}
+    for path in glob.glob(os.path.join(profile_dir, f"{stage}-*.costs.json")):
+        with open(path) as f:
+            for cost in json.load(f):
+                total = costs.setdefault(
+                    cost["key"], {"key": cost["key"], "cpu": 0, "wall": 0}
+                )
+                total["cpu"] += cost["cpu"]
+                total["wall"] += cost["wall"]
+        os.remove(path)
+
+    return sorted(costs.values(), key=lambda cost: cost["cpu"], reverse=True)
+
+
+def cost_table(title, costs, top=15):
+    lines = [title, f"{'rank': <5} {'cpu s': >8} {'wall s': >8}  input"]
+    for rank, cost in enumerate(costs[:top], 1):
+        lines.append(
+            f"{rank: <5} {cost['cpu']: >8.3f} {cost['wall']: >8.3f}  "
+            f"{cost['key']}"
+        )
+    return lines
+
+
+def run_profiled(profile_dir, func, *args, **kwargs):
+    """
+    Run func under cProfile (main.pstats), merge the worker stats into one
+    pstats file per stage and print the most expensive feeds and slugs.
+    """
+
+    global main_profiled
+    main_profiled = (os.getpid(), threading.get_ident())
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+
+    finally:
+        main_profiled = None
+        profiler.dump_stats(os.path.join(profile_dir, "main.pstats"))
+
+        report = {
+            "parse": merge_stage(profile_dir, "parse"),
+            "write": merge_stage(profile_dir, "write"),
+        }
+        with open(os.path.join(profile_dir, "costs.json"), "w") as f:
+            json.dump(report, f, indent=2)
+
+        lines = (
+            cost_table("Most expensive feeds to parse:", report["parse"])
+            + [""]
+            + cost_table("Most expensive slugs to render:", report["write"])
+            + ["", f"Profiles written to {profile_dir}"]
+        )
+        for line in lines:
+            print(line)
+            logging.info(line)
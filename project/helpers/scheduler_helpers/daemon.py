@@ -0,0 +1,89 @@
+import logging
+import asyncio
+import signal
+
+
+class Daemon:
+    """
+    Runs a coroutine at a fixed rate on one asyncio event loop.
+    Ticks are scheduled from the start time, not from the end of the last
+    run, so runs do not drift. A tick that comes due while the previous run
+    is still going is skipped instead of overlapping it.
+    """
+
+    def __init__(self, run_tick, interval, total_time=None, on_reload=None):
+        self.run_tick = run_tick
+        self.interval = interval
+        self.total_time = total_time
+        self.on_reload = on_reload
+        self.stop_event = None
+        self.current_run = None
+        self.num_ticks = 0
+        self.num_skipped = 0
+
+    def stop(self, signame="stop"):
+        logging.info(f"Received {signame}, stopping after the current run")
+        self.stop_event.set()
+
+    def reload(self):
+        logging.info("Received SIGHUP, reloading before the next run")
+        if self.on_reload:
+            self.on_reload()
+
+    def install_signal_handlers(self, loop):
+        loop.add_signal_handler(signal.SIGTERM, self.stop, "SIGTERM")
+        loop.add_signal_handler(signal.SIGINT, self.stop, "SIGINT")
+        if hasattr(signal, "SIGHUP"):
+            loop.add_signal_handler(signal.SIGHUP, self.reload)
+
+    def start_run(self, tick):
+        if self.current_run is not None and not self.current_run.done():
+            self.num_skipped += 1
+            logging.warning(f"Previous run still going, skipping tick {tick}")
+            return
+
+        self.current_run = asyncio.create_task(self.guarded_run(tick))
+
+    async def guarded_run(self, tick):
+        try:
+            await self.run_tick(tick)
+        except Exception as e:
+            logging.exception(f"Error in run {tick}: {e}")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+
+        try:
+            self.install_signal_handlers(loop)
+        except NotImplementedError:
+            logging.warning("Signal handlers are not supported here")
+
+        start_time = loop.time()
+        next_tick = start_time
+
+        while not self.stop_event.is_set():
+            self.start_run(self.num_ticks)
+            self.num_ticks += 1
+
+            # Fixed rate, missed ticks are dropped rather than bunched up
+            next_tick += self.interval
+            while next_tick <= loop.time():
+                next_tick += self.interval
+
+            if self.total_time and next_tick - start_time > self.total_time:
+                break
+
+            try:
+                await asyncio.wait_for(
+                    self.stop_event.wait(), next_tick - loop.time()
+                )
+            except asyncio.TimeoutError:
+                pass
+
+        if self.current_run is not None:
+            await self.current_run
+
+        logging.info(
+            f"Daemon stopped after {self.num_ticks} ticks, {self.num_skipped} skipped"
+        )
@@ -1,20 +1,28 @@
 import subprocess
+import shutil
 import time
 
 
 def scheduler(total_time, interval_time):
     """
     Run the RSS Feed Aggregator at a set interval.
+    Uses caffeinate to keep MacOS awake, elsewhere only the time is tracked.
     """
 
-    p = subprocess.Popen(["caffeinate", "-t", str(total_time)])
+    p = None
+    if shutil.which("caffeinate"):
+        p = subprocess.Popen(["caffeinate", "-t", str(total_time)])
+    end_time = time.time() + total_time
 
     while True:
-        retcode = p.poll()
+        retcode = p.poll() if p else None
 
         if retcode is not None:
             print("Caffeinate process has terminated.")
             return False
 
+        if p is None and time.time() >= end_time:
+            return False
+
         time.sleep(interval_time)
         yield True
@@ -0,0 +1,154 @@
+from helpers.feed_helpers.file_helper import atomic_write
+import logging
+import json
+import time
+import os
+
+SNAPSHOT_FILEPATH = os.path.join("yaml_config", "airtable_snapshot.json")
+
+# Bump when the snapshot layout changes, so older snapshots force a full sync
+SNAPSHOT_VERSION = 1
+
+# Deleted records only show up in a full sync, so one runs at least daily
+FULL_SYNC_SECONDS = 24 * 60 * 60
+
+# Records changed shortly before the last sync are fetched again, covering
+# clock skew between this machine and Airtable
+SYNC_OVERLAP_SECONDS = 60
+
+
+def load_snapshot(filepath=SNAPSHOT_FILEPATH):
+    try:
+        with open(filepath, "r") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.error(
+            f"Error reading Airtable snapshot, doing a full sync: {e}"
+        )
+        return None
+
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def save_snapshot(snapshot, filepath=SNAPSHOT_FILEPATH):
+    os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+    atomic_write(filepath, json.dumps(snapshot, ensure_ascii=False))
+
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(timestamp))
+
+
+def changed_formula(since):
+    """
+    Airtable formula matching the records modified after since.
+    """
+
+    return (
+        "IS_AFTER(LAST_MODIFIED_TIME(), "
+        f"DATETIME_PARSE('{format_time(since)}'))"
+    )
+
+
+def snapshot_source(airtable_data, fields):
+    return {
+        "base": airtable_data["AIRTABLE_BASE_ID"],
+        "table": airtable_data["AIRTABLE_TABLE_NAME"],
+        "fields": fields,
+    }
+
+
+def needs_full_sync(snapshot, source, now):
+    return (
+        snapshot is None
+        or snapshot.get("source") != source
+        or now - snapshot.get("full_synced_at", 0) >= FULL_SYNC_SECONDS
+    )
+
+
+def apply_records(snapshot, records, now):
+    """
+    Upsert fetched records into the snapshot, returning how many changed.
+    """
+
+    num_changed = 0
+    for record in records:
+        old = snapshot["records"].get(record["id"])
+        if old is not None and old["fields"] == record["fields"]:
+            continue
+
+        snapshot["records"][record["id"]] = {
+            "created": record.get("createdTime", ""),
+            "modified": format_time(now),
+            "fields": record["fields"],
+        }
+        num_changed += 1
+
+    return num_changed
+
+
+def sync_table(api, airtable_data, fields, full_sync=False):
+    """
+    Bring the local snapshot of the table up to date and return the fields
+    of every record, in creation order. Only records modified since the
+    last sync are fetched, except for the first and the daily full sync.
+    """
+
+    try:
+        table = api.table(
+            airtable_data["AIRTABLE_BASE_ID"],
+            airtable_data["AIRTABLE_TABLE_NAME"],
+        )
+        source = snapshot_source(airtable_data, fields)
+        snapshot = load_snapshot()
+        now = time.time()
+
+        if full_sync or needs_full_sync(snapshot, source, now):
+            logging.info("Fetching all table data from Airtable")
+            records = table.all(fields=fields)
+
+            # Keep the records still in the table, so unchanged ones keep
+            # their modified time
+            old_records = snapshot["records"] if snapshot else {}
+            fetched_ids = {record["id"] for record in records}
+            snapshot = {
+                "version": SNAPSHOT_VERSION,
+                "source": source,
+                "full_synced_at": now,
+                "records": {
+                    record_id: record
+                    for record_id, record in old_records.items()
+                    if record_id in fetched_ids
+                },
+            }
+            num_deleted = len(old_records) - len(snapshot["records"])
+        else:
+            since = snapshot["synced_at"] - SYNC_OVERLAP_SECONDS
+            logging.info(
+                f"Fetching table data changed since {format_time(since)}"
+            )
+            records = table.all(fields=fields, formula=changed_formula(since))
+            num_deleted = 0
+
+        num_changed = apply_records(snapshot, records, now)
+        snapshot["synced_at"] = now
+        save_snapshot(snapshot)
+
+    except Exception as e:
+        logging.error(f"Error syncing table data from Airtable: {e}")
+        return None
+
+    logging.info(
+        f"Airtable sync: {len(records)} records fetched, {num_changed} "
+        f"changed, {num_deleted} removed, {len(snapshot['records'])} total"
+    )
+
+    ordered = sorted(
+        snapshot["records"].items(),
+        key=lambda item: (item[1]["created"], item[0]),
+    )
+    return [dict(record["fields"]) for _, record in ordered]
@@ -1,8 +1,23 @@
+from helpers.import_helpers.lazy_import import lazy_import
+from collections import Counter, namedtuple
+import helpers.feed_helpers.url_helper as url_helper
+import helpers.log_helpers.log_pipeline as log_pipeline
 import helpers.cache_helpers.cacher as cacher
-import logging.handlers
 import logging
-import aiohttp
 import asyncio
+import time
+import zlib
+
+aiohttp = lazy_import("aiohttp")
+
+# Only these redirects are followed for good, the target of a 302 / 307 may
+# change
+PERMANENT_REDIRECTS = (301, 308)
+
+FetchedResponse = namedtuple(
+    "FetchedResponse",
+    ["status", "data", "etag", "last_modified", "content_type", "redirect"],
+)
 
 
 def reorganize_results(results):
@@ -18,7 +33,7 @@ def reorganize_results(results):
         if not result:
             continue
 
-        (config, result_dict, num_entries_parsed) = result
+        config, result_dict, num_entries_parsed = result
         slug = config["slug"]
 
         if not result_dict:
@@ -28,6 +43,7 @@ def reorganize_results(results):
         if slug not in reorganized_results:
             reorganized_results[slug] = {
                 "slug": slug,
+                "config": config,
                 "aggregated_entries": [],
                 "feed_data": result_dict["feed_data"],
                 "feed_type": result_dict["feed_type"],
@@ -42,9 +58,197 @@ def reorganize_results(results):
     return reorganized_results.values(), total_num_entries
 
 
-async def fetch_url(config, url, caching=False):
+def start_offset(url, jitter):
+    """
+    Stable per-URL delay in [0, jitter) that spreads requests over the
+    start of a tick instead of firing them all at once.
+    """
+
+    return (zlib.crc32(url.encode("utf-8")) % 1000) / 1000 * jitter
+
+
+def permanent_redirect(response):
+    """
+    (final URL, status) of the leading permanent hops of a response's
+    redirect chain, or None. A temporary hop ends the chain.
+    """
+
+    hops = list(response.history)
+    next_urls = [hop.url for hop in hops[1:]] + [response.url]
+
+    target = None
+    for hop, next_url in zip(hops, next_urls):
+        if hop.status not in PERMANENT_REDIRECTS:
+            break
+        target = (str(next_url), hops[0].status)
+    return target
+
+
+async def request_url(session, url, headers):
+    """
+    GET url, following redirects. The body of a 304 or 404 is not read.
+    """
+
+    async with session.get(url, headers=headers) as response:
+        data = None
+        if response.status not in (304, 404):
+            # Keep the raw body, feedparser decodes it once using the
+            # Content-Type header and the XML declaration together
+            data = await response.read()
+
+        return FetchedResponse(
+            response.status,
+            data,
+            response.headers.get("Etag"),
+            response.headers.get("Last-Modified"),
+            response.headers.get("Content-Type"),
+            permanent_redirect(response),
+        )
+
+
+class SharedFetches:
+    """
+    Requests of one run by URL key, so slugs following the same feed, or
+    near-identical URLs of it, share one request. A response is dropped as
+    soon as every URL with its key got it. Requests with other conditional
+    headers (a slug with a cached ETag, another without) are not shared.
+    """
+
+    def __init__(self, yaml_config):
+        self.remaining = Counter(
+            url_helper.url_key(url)
+            for config in yaml_config
+            for url in config["urls"]
+        )
+        self.requests = {}
+
+    async def get(self, session, url, target, headers):
+        key = url_helper.url_key(url)
+        self.remaining[key] -= 1
+        last = self.remaining[key] <= 0
+
+        shared = self.requests.get(key)
+        if shared is None or shared[0] != headers:
+            if last:
+                return await request_url(session, target, headers)
+            shared = (
+                headers,
+                asyncio.ensure_future(request_url(session, target, headers)),
+            )
+            self.requests[key] = shared
+
+        if last:
+            self.requests.pop(key, None)
+        return await asyncio.shield(shared[1])
+
+
+def follow_redirect(url, target, response):
+    """
+    Remember where url permanently redirects to, so the next run requests
+    it directly, and forget a remembered target that is gone.
+    """
+
+    if response.redirect is not None and response.status < 400:
+        new_target, status = response.redirect
+        if new_target not in (url, target):
+            logging.info(
+                f"{url} permanently redirects to {new_target}, requesting "
+                "it directly from now on"
+            )
+            cacher.update_redirect(url, new_target, status)
+
+    elif target != url and response.status in (404, 410):
+        logging.warning(
+            f"Redirect target {target} of {url} answered {response.status}, "
+            "requesting the configured URL again"
+        )
+        cacher.delete_redirects([url])
+
+
+async def get_url(
+    session,
+    config,
+    url,
+    headers,
+    caching,
+    cache_data,
+    metrics=None,
+    shared=None,
+):
     """
-    Fetch URL and return status code and data.
+    Request URL with the shared session and return the fetch result.
+    A URL that permanently redirected before is requested at its target.
+    """
+
+    slug_url = config["slug"] + url
+    target = cacher.fetch_redirect(url) or url
+    start_time = time.perf_counter()
+
+    try:
+        if shared is not None:
+            response = await shared.get(session, url, target, headers)
+        else:
+            response = await request_url(session, target, headers)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        if target != url:
+            cacher.delete_redirects([url])
+        raise
+
+    follow_redirect(url, target, response)
+
+    if caching:
+        cacher.update_cache_etag_last(
+            slug_url, response.etag, response.last_modified
+        )
+
+    if metrics:
+        metrics.record_fetch(
+            config["slug"],
+            url,
+            response.status,
+            time.perf_counter() - start_time,
+            len(response.data or b""),
+        )
+
+    if response.status == 404:
+        logging.error(f"Error Fetching slug: {config['slug']}, URL: {url}")
+        logging.error("Error Resource not found. Received 404.")
+        return None
+
+    return (
+        response.status,
+        config,
+        url,
+        response.data,
+        caching,
+        cache_data,
+        response.content_type,
+    )
+
+
+async def fetch_url(
+    config,
+    url,
+    caching=False,
+    session=None,
+    jitter=0,
+    metrics=None,
+    shared=None,
+):
+    """
+    Fetch URL and return status code and data, logging with the slug and
+    URL as context.
+    """
+
+    with log_pipeline.log_context("fetch", config["slug"], url):
+        return await fetch_feed(
+            config, url, caching, session, jitter, metrics, shared
+        )
+
+
+async def fetch_feed(config, url, caching, session, jitter, metrics, shared):
+    """
+    Fetch URL with its cached conditional headers.
     """
 
     slug_url = config["slug"] + url
@@ -61,54 +265,66 @@ async def fetch_url(config, url, caching=False):
     if last_modified_value:
         headers["If-Modified-Since"] = last_modified_value
 
+    if jitter:
+        await asyncio.sleep(start_offset(url, jitter))
+
+    start_time = time.perf_counter()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                if caching:
-                    etag_value = response.headers.get("Etag")
-                    last_modified_value = response.headers.get("Last-Modified")
-                    cacher.update_cache_etag_last(
-                        slug_url, etag_value, last_modified_value
-                    )
-
-                if response.status == 304:
-                    data = None
-                    return (
-                        response.status,
-                        config,
-                        url,
-                        data,
-                        caching,
-                        cache_data,
-                    )
-                elif response.status == 404:
-                    logging.error(
-                        f"Error Fetching slug: {config['slug']}, URL: {url}"
-                    )
-                    logging.error("Error Resource not found. Received 404.")
-                    return None
-                data = await response.text()
-                return (
-                    response.status,
-                    config,
-                    url,
-                    data,
-                    caching,
-                    cache_data,
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await get_url(
+                    session, config, url, headers, caching, cache_data, metrics
                 )
 
+        return await get_url(
+            session,
+            config,
+            url,
+            headers,
+            caching,
+            cache_data,
+            metrics,
+            shared,
+        )
+
     except aiohttp.ClientError as e:
+        if metrics:
+            metrics.record_fetch(
+                config["slug"], url, "error", time.perf_counter() - start_time
+            )
         logging.error(f"Error Fetching slug: {config['slug']}, URL: {url}")
         logging.error(f"Error {e}")
         return None
 
+    except asyncio.TimeoutError:
+        if metrics:
+            metrics.record_fetch(
+                config["slug"],
+                url,
+                "timeout",
+                time.perf_counter() - start_time,
+            )
+        logging.error(f"Error Fetching slug: {config['slug']}, URL: {url}")
+        logging.error("Error Request timed out")
+        return None
+
 
-async def fetch_all_urls(yaml_config, caching=False):
+async def fetch_all_urls(
+    yaml_config, caching=False, session=None, jitter=0, metrics=None
+):
     """
-    Fetch all URLs with async.
+    Fetch all URLs with async over one shared session.
     """
+
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await fetch_all_urls(
+                yaml_config, caching, session, jitter, metrics
+            )
+
     slug_counts = {}
     tasks = []
+    shared = SharedFetches(yaml_config)
 
     for config in yaml_config:
         slug = config["slug"]
@@ -117,7 +333,11 @@ async def fetch_all_urls(yaml_config, caching=False):
 
         for url in config["urls"]:
             slug_counts[slug]["total"] += 1
-            tasks.append(fetch_url(config, url, caching))
+            tasks.append(
+                fetch_url(
+                    config, url, caching, session, jitter, metrics, shared
+                )
+            )
 
     logging.info("")
     logging.info("Fetching all URLs")
@@ -0,0 +1,313 @@
+from helpers.feed_helpers.file_helper import make_temp_file, move_into_place
+from helpers.feed_helpers.feed_parser_class import FeedProcessor
+import helpers.feed_helpers.url_helper as url_helper
+import hashlib
+import logging
+import pickle
+import yaml
+import os
+
+# The C loader is several times faster, PyYAML falls back to the pure
+# Python one when it was built without libyaml
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Bump when the compiled form changes, so older caches are rebuilt
+COMPILED_VERSION = 4
+
+REQUIRED_FIELDS = ["name", "slug", "urls"]
+KEYWORD_FIELDS = ["match", "exclude"]
+
+# Settings of a slug's outputs, shared by all of its records
+SLUG_FIELDS = ["max_entries", "max_age_days", "formats"]
+
+
+def cache_path(filepath):
+    directory, name = os.path.split(os.path.abspath(filepath))
+    return os.path.join(directory, f".{name}.compiled")
+
+
+def file_hash(filepath):
+    hasher = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def is_string_list(value):
+    return isinstance(value, list) and all(
+        isinstance(item, str) for item in value
+    )
+
+
+def record_error(record):
+    """
+    Reason a record can not be used, or None when it is valid.
+    """
+
+    if not isinstance(record, dict):
+        return "record is not a mapping"
+
+    missing = [key for key in REQUIRED_FIELDS if not record.get(key)]
+    if missing:
+        return f"missing {', '.join(missing)}"
+
+    if not isinstance(record["slug"], str):
+        return "slug is not a string"
+
+    if not is_string_list(record["urls"]):
+        return "urls is not a list of strings"
+
+    for key in KEYWORD_FIELDS:
+        if record.get(key) is not None and not is_string_list(record[key]):
+            return f"{key} is not a list of strings"
+
+    return None
+
+
+def group_key(record):
+    # Records of a slug can only share a config when everything but their
+    # name, URLs and output settings is the same
+    return repr(
+        sorted(
+            (key, value)
+            for key, value in record.items()
+            if key not in ("name", "urls", *SLUG_FIELDS)
+        )
+    )
+
+
+def merge_values(field, values):
+    if field == "formats":
+        merged = []
+        for value in values:
+            for name in value if isinstance(value, list) else [value]:
+                if name not in merged:
+                    merged.append(name)
+        return merged
+    try:
+        return max(values, key=float)
+    except (TypeError, ValueError):
+        return values[0]
+
+
+def merge_slug_fields(compiled, records):
+    """
+    Give every compiled record of a slug the same output settings. When the
+    YAML records of the slug set them differently the most is kept: the
+    largest retention and every format.
+    """
+
+    slug_values = {}
+    for record in records:
+        for field in SLUG_FIELDS:
+            if record.get(field) is not None:
+                slug_values.setdefault((record["slug"], field), []).append(
+                    record[field]
+                )
+
+    merged = {}
+    for (slug, field), values in slug_values.items():
+        merged[(slug, field)] = merge_values(field, values)
+        if any(value != merged[(slug, field)] for value in values):
+            logging.warning(
+                f"Records of {slug} set different {field} "
+                f"({', '.join(map(str, values))}), using "
+                f"{merged[(slug, field)]}"
+            )
+
+    for record in compiled:
+        for field in SLUG_FIELDS:
+            if (record["slug"], field) in merged:
+                record[field] = merged[(record["slug"], field)]
+
+
+def compile_config(yaml_config):
+    """
+    Validate the records, merge records of a slug with the same settings,
+    normalize the URLs, drop URLs they already list, reconcile the output
+    settings of each slug and precompile the keyword matchers.
+    Returns the compiled records and the number of rejected records.
+    """
+
+    if yaml_config is None:
+        yaml_config = []
+    if not isinstance(yaml_config, list):
+        raise yaml.YAMLError("expected a list of records")
+
+    compiled = {}
+    group_urls = {}
+    valid_records = []
+    num_rejected = 0
+
+    for record in yaml_config:
+        error = record_error(record)
+        if error:
+            logging.error(f"Rejected config record ({error}): {record}")
+            num_rejected += 1
+            continue
+        valid_records.append(record)
+
+        # A URL listed twice for a slug would add its entries twice, also
+        # when it is listed as a near-identical variant. Records of the slug
+        # with other settings filter it differently, so they keep theirs
+        group = (record["slug"], group_key(record))
+        seen = group_urls.setdefault(group, {})
+        urls = []
+        for url in record["urls"]:
+            url = url_helper.normalize_url(url)
+            key = url_helper.url_key(url)
+            if key in seen:
+                if seen[key] != url:
+                    logging.info(
+                        f"Dropped {url} of {record['slug']}, same feed as "
+                        f"{seen[key]}"
+                    )
+                continue
+            seen[key] = url
+            urls.append(url)
+        if not urls:
+            continue
+
+        if group in compiled:
+            compiled[group]["urls"].extend(urls)
+            continue
+
+        compiled[group] = {
+            **record,
+            "urls": urls,
+            "match_keywords": FeedProcessor.compile_keywords(
+                record.get("match")
+            ),
+            "exclude_keywords": FeedProcessor.compile_keywords(
+                record.get("exclude")
+            ),
+        }
+
+    records = list(compiled.values())
+    merge_slug_fields(records, valid_records)
+    return records, num_rejected
+
+
+def read_cache(filepath, stat):
+    """
+    Compiled config of filepath when the cache matches its mtime and size,
+    or, after a touch, its content hash.
+    """
+
+    try:
+        with open(cache_path(filepath), "rb") as f:
+            cached = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+
+    if cached.get("version") != COMPILED_VERSION:
+        return None
+
+    if (cached["mtime_ns"], cached["size"]) == (
+        stat.st_mtime_ns,
+        stat.st_size,
+    ):
+        return cached
+
+    if cached["sha256"] == file_hash(filepath):
+        write_cache(filepath, stat, cached["sha256"], cached)
+        return cached
+
+    return None
+
+
+def write_cache(filepath, stat, sha256, compiled):
+    cached = {
+        "version": COMPILED_VERSION,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": sha256,
+        "config": compiled["config"],
+        "num_rejected": compiled["num_rejected"],
+    }
+
+    try:
+        fd, temp_file = make_temp_file(cache_path(filepath))
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(cached, f, pickle.HIGHEST_PROTOCOL)
+        move_into_place(temp_file, cache_path(filepath))
+    except OSError as e:
+        # A read-only config folder only costs the compile on every run
+        logging.warning(f"Could not cache the config of {filepath}: {e}")
+
+
+def load_config(filepath):
+    """
+    Load the compiled config of a YAML file, compiling it only when the
+    file changed since the last load.
+    """
+
+    stat = os.stat(filepath)
+    cached = read_cache(filepath, stat)
+    if cached is not None:
+        logging.info(
+            f"Loaded compiled config of {filepath} "
+            f"({len(cached['config'])} records)"
+        )
+        return cached["config"]
+
+    sha256 = file_hash(filepath)
+    with open(filepath, "rb") as f:
+        config, num_rejected = compile_config(yaml.load(f, Loader=Loader))
+
+    logging.info(
+        f"Compiled config of {filepath} ({len(config)} records, "
+        f"{num_rejected} rejected)"
+    )
+
+    write_cache(
+        filepath,
+        stat,
+        sha256,
+        {"config": config, "num_rejected": num_rejected},
+    )
+
+    return config
+
+
+def slug_records(yaml_config):
+    slugs = {}
+    for record in yaml_config:
+        slugs.setdefault(record["slug"], []).append(record)
+    return slugs
+
+
+def diff_configs(old_config, new_config):
+    """
+    Slugs added, removed, with changed settings (matchers, retention,
+    formats) or with only changed URLs between two compiled configs, plus
+    the (slug, url) pairs whose cached feed state no longer applies.
+    """
+
+    old, new = slug_records(old_config), slug_records(new_config)
+    diff = {"added": [], "removed": [], "rematched": [], "urls": []}
+    stale = []
+
+    for slug in list(old) + [slug for slug in new if slug not in old]:
+        old_pairs = [
+            (slug, url) for r in old.get(slug, []) for url in r["urls"]
+        ]
+
+        if slug not in new:
+            diff["removed"].append(slug)
+            stale.extend(old_pairs)
+        elif slug not in old:
+            diff["added"].append(slug)
+        elif [group_key(r) for r in old[slug]] != [
+            group_key(r) for r in new[slug]
+        ]:
+            # Entries already seen were filtered with the old settings
+            diff["rematched"].append(slug)
+            stale.extend(old_pairs)
+        elif [r["urls"] for r in old[slug]] != [r["urls"] for r in new[slug]]:
+            diff["urls"].append(slug)
+            new_urls = {url for r in new[slug] for url in r["urls"]}
+            stale.extend(pair for pair in old_pairs if pair[1] not in new_urls)
+
+    return diff, stale
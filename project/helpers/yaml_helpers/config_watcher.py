@@ -0,0 +1,114 @@
+import helpers.yaml_helpers.yaml_processor as processor
+import helpers.yaml_helpers.config_loader as config_loader
+import helpers.yaml_helpers.yaml_writer as generator
+import helpers.cache_helpers.cacher as cacher
+import logging
+import time
+import os
+
+# Seconds between Airtable syncs when the config is generated
+AIRTABLE_CHECK_SECONDS = 300
+
+
+class ConfigWatcher:
+    """
+    Config of the scheduler and the daemon. check() runs before every tick
+    and picks up a changed YAML file, or, with generate, a changed Airtable
+    table. Changes are diffed against the running config, so only the feeds
+    of changed slugs lose their cached state, everything else stays warm.
+    """
+
+    def __init__(
+        self, filepath, generate=False, check_seconds=AIRTABLE_CHECK_SECONDS
+    ):
+        self.filepath = filepath
+        self.generate = generate
+        self.check_seconds = check_seconds
+        self.config = None
+        self.file_key = None
+        self.last_generated = None
+        self.generation_time = None
+        self.reload_pending = generate
+
+    def request_reload(self):
+        """
+        Sync Airtable before the next tick, e.g. on SIGHUP.
+        """
+
+        self.reload_pending = self.generate
+
+    def generate_due(self):
+        return self.reload_pending or (
+            self.generate
+            and time.time() - self.last_generated >= self.check_seconds
+        )
+
+    def generate_config(self):
+        start_time = time.time()
+        self.reload_pending = False
+        self.last_generated = start_time
+
+        try:
+            generator.generate_yaml()
+        except SystemExit:
+            # generate_yaml exits when Airtable can not be read, a running
+            # scheduler keeps its current config instead
+            if self.config is None:
+                raise
+            logging.error("Airtable sync failed, keeping the current config")
+
+        self.generation_time = time.time() - start_time
+
+    def check(self):
+        """
+        Reload the config when it changed, returning the diff against the
+        previous config, or None when nothing changed.
+        """
+
+        self.generation_time = None
+        if self.generate_due():
+            self.generate_config()
+
+        try:
+            stat = os.stat(self.filepath)
+        except OSError as e:
+            if self.config is None:
+                raise
+            logging.error(f"Error reading config, keeping the current: {e}")
+            return None
+
+        file_key = (stat.st_mtime_ns, stat.st_size)
+        if file_key == self.file_key:
+            return None
+
+        if self.config is None:
+            self.config = processor.load_yaml_config(self.filepath)
+            self.file_key = file_key
+            return None
+
+        try:
+            new_config = config_loader.load_config(self.filepath)
+        except Exception as e:
+            # A half edited file must not stop a running scheduler
+            logging.error(
+                f"Error loading changed config, keeping the current: {e}"
+            )
+            return None
+
+        self.file_key = file_key
+        diff, stale = config_loader.diff_configs(self.config, new_config)
+        self.config = new_config
+
+        if stale:
+            cacher.delete_cache([slug + url for slug, url in stale])
+
+        logging.info(
+            "Config changed: "
+            + ", ".join(f"{len(slugs)} {kind}" for kind, slugs in diff.items())
+            + f" slugs, {len(stale)} cached feeds reset"
+        )
+        for kind, slugs in diff.items():
+            if slugs:
+                logging.info(f"Config {kind}: {', '.join(slugs)}")
+
+        return diff
@@ -0,0 +1,233 @@
+from helpers.import_helpers.lazy_import import lazy_import
+import helpers.log_helpers.log_pipeline as log_pipeline
+import threading
+import logging
+import queue
+import math
+import os
+
+futures = lazy_import("concurrent.futures")
+multiprocessing = lazy_import("multiprocessing")
+asyncio = lazy_import("asyncio")
+
+BACKENDS = ["auto", "serial", "thread", "process", "asyncio"]
+
+# Below this much feed data, parsing in a process pool costs more in fork
+# and pickle overhead than it saves
+AUTO_PROCESS_MIN_BYTES = 2 * 1024 * 1024
+AUTO_PROCESS_MIN_ITEMS = 4
+
+
+class SerialExecutor:
+    """
+    Runs every item in the calling thread, no startup or pickling cost.
+    """
+
+    name = "serial"
+
+    def __init__(self, workers=None, chunksize=None):
+        self.workers = 1
+        self.chunksize = chunksize
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+    def apply(self, func, item):
+        return func(item)
+
+    def map(self, func, items):
+        return [func(item) for item in items]
+
+    def imap_unordered(self, func, items):
+        for item in items:
+            yield func(item)
+
+    def describe(self):
+        return self.name
+
+
+class ThreadExecutor(SerialExecutor):
+    """
+    Thread pool, suited to the mostly I/O bound write stage.
+    """
+
+    name = "thread"
+
+    def __init__(self, workers=None, chunksize=None):
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.chunksize = chunksize
+        self.pool = futures.ThreadPoolExecutor(max_workers=self.workers)
+
+    def close(self):
+        self.pool.shutdown()
+
+    def apply(self, func, item):
+        return self.pool.submit(func, item).result()
+
+    def map(self, func, items):
+        return list(self.pool.map(func, items))
+
+    def imap_unordered(self, func, items):
+        pending = [self.pool.submit(func, item) for item in items]
+        for future in futures.as_completed(pending):
+            yield future.result()
+
+    def describe(self):
+        return f"{self.name} ({self.workers} workers)"
+
+
+class ProcessExecutor(SerialExecutor):
+    """
+    multiprocessing Pool, suited to parsing large amounts of feed data.
+    """
+
+    name = "process"
+
+    def __init__(self, workers=None, chunksize=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        # Workers log through the parent's background writer
+        self.pool = multiprocessing.Pool(
+            self.workers,
+            initializer=log_pipeline.init_worker,
+            initargs=log_pipeline.worker_args(),
+        )
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def get_chunksize(self, num_items):
+        # Same heuristic as Pool.map when no chunksize is configured
+        return self.chunksize or max(
+            1, math.ceil(num_items / (self.workers * 4))
+        )
+
+    def apply(self, func, item):
+        return self.pool.apply(func, (item,))
+
+    def map(self, func, items):
+        items = list(items)
+        return self.pool.map(func, items, self.get_chunksize(len(items)))
+
+    def imap_unordered(self, func, items):
+        items = list(items)
+        return self.pool.imap_unordered(
+            func, items, self.get_chunksize(len(items))
+        )
+
+    def describe(self):
+        chunksize = self.chunksize or "auto"
+        return f"{self.name} ({self.workers} workers, chunksize {chunksize})"
+
+
+class AsyncioExecutor(SerialExecutor):
+    """
+    Event loop in a background thread that keeps up to `workers` items in
+    flight and hands each result back as soon as it is ready, so the caller
+    consumes results while later items are still being processed.
+    """
+
+    name = "asyncio"
+
+    def __init__(self, workers=None, chunksize=None):
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.chunksize = chunksize
+
+    async def run_items(self, func, items, results):
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def run_item(index, item):
+            async with semaphore:
+                try:
+                    results.put((index, await asyncio.to_thread(func, item)))
+                except Exception as e:
+                    results.put((index, e))
+
+        await asyncio.gather(
+            *(run_item(index, item) for index, item in enumerate(items))
+        )
+
+    def iter_indexed(self, func, items):
+        items = list(items)
+        results = queue.Queue()
+        loop_thread = threading.Thread(
+            target=asyncio.run,
+            args=(self.run_items(func, items, results),),
+            daemon=True,
+        )
+        loop_thread.start()
+
+        for _ in items:
+            index, result = results.get()
+            if isinstance(result, Exception):
+                raise result
+            yield index, result
+
+        loop_thread.join()
+
+    def map(self, func, items):
+        indexed = sorted(self.iter_indexed(func, items), key=lambda x: x[0])
+        return [result for _, result in indexed]
+
+    def imap_unordered(self, func, items):
+        for _, result in self.iter_indexed(func, items):
+            yield result
+
+    def describe(self):
+        return f"{self.name} ({self.workers} in flight)"
+
+
+EXECUTOR_CLASSES = {
+    "serial": SerialExecutor,
+    "thread": ThreadExecutor,
+    "process": ProcessExecutor,
+    "asyncio": AsyncioExecutor,
+}
+
+
+def choose_backend(stage, num_items, total_bytes=0):
+    """
+    Pick a backend for the "auto" mode from the size of the workload.
+    """
+
+    if num_items <= 1:
+        return "serial"
+
+    if stage == "parse":
+        # feedparser is pure Python, threads would only add GIL contention
+        if (
+            num_items >= AUTO_PROCESS_MIN_ITEMS
+            and total_bytes >= AUTO_PROCESS_MIN_BYTES
+        ):
+            return "process"
+        return "serial"
+
+    # Writing is mostly file I/O
+    return "thread"
+
+
+def get_executor(stage, executor_options=None, num_items=0, total_bytes=0):
+    """
+    Build the executor configured for a stage ("parse" or "write").
+    """
+
+    executor_options = executor_options or {}
+    backend = executor_options.get(f"{stage}_executor") or "auto"
+
+    if backend == "auto":
+        backend = choose_backend(stage, num_items, total_bytes)
+
+    executor = EXECUTOR_CLASSES[backend](
+        executor_options.get(f"{stage}_workers"),
+        executor_options.get(f"{stage}_chunksize"),
+    )
+    logging.info(f"Using {executor.describe()} executor for {stage} stage")
+
+    return executor
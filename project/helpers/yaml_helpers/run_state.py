@@ -0,0 +1,76 @@
+from helpers.import_helpers.lazy_import import lazy_import
+import helpers.yaml_helpers.executor_helper as executors
+from helpers.metrics_helpers.metrics import Metrics
+import logging
+
+aiohttp = lazy_import("aiohttp")
+
+
+class RunState:
+    """
+    HTTP session and executor pools used by a run. A one-off run closes
+    them when it finishes, the daemon keeps one RunState warm across ticks.
+    metrics accumulates every run of this process, last_report is the JSON
+    report of the latest run. config is the compiled config of the next
+    run when a ConfigWatcher keeps it, otherwise the run loads the YAML.
+    feed_cache gets every run's write results when the daemon serves feeds,
+    websub the hubs parsing found when the daemon subscribes to them.
+    """
+
+    def __init__(self, executor_options=None, jitter=0):
+        self.executor_options = executor_options or {}
+        self.profile_dir = self.executor_options.get("profile_dir")
+        self.jitter = jitter
+        self.session = None
+        self.executors = {}
+        self.metrics = Metrics()
+        self.last_report = None
+        self.config = None
+        self.feed_cache = None
+        self.websub = None
+
+    def get_session(self):
+        """
+        Shared aiohttp session, must be called from the running event loop.
+        """
+
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    def get_executor(self, stage, num_items=0, total_bytes=0):
+        """
+        Executor for a stage, reusing an already started pool when the
+        same backend is picked again.
+        """
+
+        backend = self.executor_options.get(f"{stage}_executor") or "auto"
+        if backend == "auto":
+            backend = executors.choose_backend(stage, num_items, total_bytes)
+
+        key = (stage, backend)
+        if key not in self.executors:
+            self.executors[key] = executors.get_executor(
+                stage,
+                {**self.executor_options, f"{stage}_executor": backend},
+                num_items,
+                total_bytes,
+            )
+        else:
+            logging.info(
+                f"Using warm {self.executors[key].describe()} executor for {stage} stage"
+            )
+
+        return self.executors[key]
+
+    def close_executors(self):
+        for executor in self.executors.values():
+            executor.close()
+        self.executors = {}
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+        self.close_executors()
@@ -0,0 +1,198 @@
+from helpers.feed_helpers.file_helper import atomic_write
+import argparse
+import bisect
+import hashlib
+import logging
+import json
+import glob
+import os
+import re
+
+# Points per shard on the hash ring, more points spread URLs more evenly
+VIRTUAL_NODES = 128
+
+SHARD_DIR = os.path.join("rss_feeds", "shards")
+
+
+def hash_key(value):
+    return int.from_bytes(
+        hashlib.sha1(value.encode("utf-8")).digest()[:8], "big"
+    )
+
+
+class HashRing:
+    """
+    Consistent hash ring of shards. The points of a shard do not depend on
+    the number of shards, so going from N to N + 1 shards only moves the
+    URLs the new shard takes over (about 1 / (N + 1) of them).
+    """
+
+    def __init__(self, num_shards, virtual_nodes=VIRTUAL_NODES):
+        self.points = sorted(
+            (hash_key(f"shard-{shard}-{node}"), shard)
+            for shard in range(num_shards)
+            for node in range(virtual_nodes)
+        )
+        self.keys = [point for point, _ in self.points]
+
+    def owner(self, url):
+        index = bisect.bisect(self.keys, hash_key(url)) % len(self.keys)
+        return self.points[index][1]
+
+
+def parse_shard(value):
+    """
+    argparse type for "i/N", shards are numbered from 0.
+    """
+
+    match = re.fullmatch(r"(\d+)/(\d+)", value)
+    if not match or not int(match[1]) < int(match[2]):
+        raise argparse.ArgumentTypeError(
+            f"Invalid shard '{value}', expected i/N with 0 <= i < N"
+        )
+    return int(match[1]), int(match[2])
+
+
+def shard_folder(shard_dir, shard):
+    return os.path.join(shard_dir, f"shard_{shard[0]}_of_{shard[1]}")
+
+
+def shard_config(yaml_config, shard):
+    """
+    Keep only the URLs this shard owns, dropping records left without any.
+    Also returns the position of every URL in the full config, so merged
+    slugs keep the entry order of an unsharded run.
+    """
+
+    ring = HashRing(shard[1])
+    sharded_config = []
+    positions = {}
+
+    for config in yaml_config:
+        urls = []
+        for url in config["urls"]:
+            positions.setdefault((config["slug"], url), len(positions))
+            if ring.owner(url) == shard[0]:
+                urls.append(url)
+
+        if urls:
+            sharded_config.append({**config, "urls": urls})
+
+    num_urls = sum(len(config["urls"]) for config in sharded_config)
+    logging.info(
+        f"Shard {shard[0]}/{shard[1]} owns {num_urls} of {len(positions)} URLs"
+    )
+
+    return sharded_config, positions
+
+
+def write_partials(shard_dir, shard, positions, async_results, multi_results):
+    """
+    Write the parse results of this shard as one partial file per slug.
+    Slugs without results still get a file, so the merge can tell a slug
+    with no new entries from a missing shard.
+    """
+
+    folder = shard_folder(shard_dir, shard)
+    os.makedirs(folder, exist_ok=True)
+    for path in glob.glob(os.path.join(folder, "*.partial.json")):
+        os.remove(path)
+
+    partials = {}
+    for (slug, url), position in positions.items():
+        partials.setdefault(slug, {"slug": slug, "shard": shard, "urls": []})
+
+    for fetch_result, parse_result in zip(async_results, multi_results):
+        if not parse_result or not parse_result[1]:
+            continue
+
+        config, result_dict, num_entries_parsed = parse_result
+        slug, url = config["slug"], fetch_result[2]
+        partial = partials[slug]
+        partial["config"] = config
+        partial["urls"].append(
+            {
+                "url": url,
+                "position": positions[(slug, url)],
+                "entries_parsed": num_entries_parsed,
+                "filtered_entries": result_dict["filtered_entries"],
+                "feed_data": result_dict["feed_data"],
+                "feed_type": result_dict["feed_type"],
+            }
+        )
+
+    for slug, partial in partials.items():
+        atomic_write(
+            os.path.join(folder, f"{slug}.partial.json"),
+            json.dumps(partial, ensure_ascii=False),
+        )
+
+    atomic_write(
+        os.path.join(folder, "complete.json"),
+        json.dumps({"shard": shard, "slugs": sorted(partials)}),
+    )
+
+    logging.info(f"Wrote {len(partials)} partial slugs to {folder}")
+
+
+def load_partials(shard_dir):
+    """
+    Combine the partial slugs of every shard into the reorganized results
+    the write stage takes, in the entry order of an unsharded run.
+    """
+
+    shards = []
+    for path in glob.glob(os.path.join(shard_dir, "shard_*", "complete.json")):
+        with open(path) as f:
+            shards.append(tuple(json.load(f)["shard"]))
+
+    if not shards:
+        logging.error(f"No complete shards found in {shard_dir}")
+        return [], 0
+
+    num_shards = shards[0][1]
+    missing = sorted(set(range(num_shards)) - {index for index, _ in shards})
+    if missing or any(count != num_shards for _, count in shards):
+        logging.error(
+            f"Shards of {shard_dir} are incomplete or mixed, missing: "
+            f"{missing}, found: {sorted(shards)}"
+        )
+
+    slugs = {}
+    for index, count in sorted(shards):
+        folder = shard_folder(shard_dir, (index, count))
+        for path in sorted(glob.glob(os.path.join(folder, "*.partial.json"))):
+            with open(path) as f:
+                partial = json.load(f)
+
+            slug = slugs.setdefault(
+                partial["slug"], {"slug": partial["slug"], "urls": []}
+            )
+            slug["urls"].extend(partial["urls"])
+            if "config" in partial:
+                slug["config"] = partial["config"]
+
+    results = []
+    total_num_entries = 0
+    for slug, merged in slugs.items():
+        urls = sorted(merged["urls"], key=lambda url: url["position"])
+        if not urls:
+            results.append({"slug": slug, "aggregated_entries": []})
+            continue
+
+        total_num_entries += sum(url["entries_parsed"] for url in urls)
+        results.append(
+            {
+                "slug": slug,
+                "config": merged["config"],
+                "aggregated_entries": [
+                    entry for url in urls for entry in url["filtered_entries"]
+                ],
+                "feed_data": urls[0]["feed_data"],
+                "feed_type": urls[0]["feed_type"],
+            }
+        )
+
+    logging.info(f"Merged {len(slugs)} slugs from {len(shards)} shards")
+
+    return results, total_num_entries
@@ -0,0 +1,374 @@
+import helpers.yaml_helpers.concurrency_helper as concurrency
+import helpers.yaml_helpers.yaml_processor as processor
+import helpers.metrics_helpers.metrics as metrics_helper
+import helpers.metrics_helpers.profiler as profiler
+import helpers.feed_helpers.feed_writer as writer
+import helpers.feed_helpers.deltas as deltas
+import helpers.feed_helpers.feed_parser_class as parser
+import helpers.cache_helpers.feed_health as feed_health
+import logging
+import asyncio
+import time
+import sys
+import os
+
+DEFAULT_MEMORY_LIMIT_MB = 256
+DEFAULT_QUEUE_SIZE = 32
+
+# Reserved for the first fetch, before any body size is known
+INITIAL_BODY_ESTIMATE = 256 * 1024
+
+
+class MemoryBudget:
+    """
+    Bytes of response bodies held in memory (fetching, queued or being
+    parsed). Fetchers wait while the budget is used up, so a slow parse or
+    write stage throttles fetching instead of buffering every feed.
+    A fetch reserves the average body size seen so far before it starts
+    and settles to the real size once the body is read. Until the first
+    fetch settles only one fetch runs, like a slow start.
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.used = 0
+        self.peak = 0
+        self.num_waits = 0
+        self.total_bytes = 0
+        self.num_bodies = 0
+        self.condition = asyncio.Condition()
+
+    def estimate(self):
+        if not self.num_bodies:
+            return INITIAL_BODY_ESTIMATE
+        return self.total_bytes // self.num_bodies
+
+    async def reserve(self):
+        """
+        Wait for room and reserve the estimated size of one body, always
+        letting a fetch through when nothing else is held.
+        """
+
+        def has_room():
+            return self.used == 0 or (
+                self.num_bodies
+                and self.used + self.estimate() <= self.limit_bytes
+            )
+
+        async with self.condition:
+            if not has_room():
+                self.num_waits += 1
+            await self.condition.wait_for(has_room)
+
+            reserved = self.estimate()
+            self.used += reserved
+            return reserved
+
+    async def settle(self, reserved, num_bytes):
+        async with self.condition:
+            self.used += num_bytes - reserved
+            self.total_bytes += num_bytes
+            self.num_bodies += 1
+            self.peak = max(self.peak, self.used)
+            self.condition.notify_all()
+
+    async def release(self, num_bytes):
+        async with self.condition:
+            self.used -= num_bytes
+            self.condition.notify_all()
+
+
+class SlugTracker:
+    """
+    Collects the parse results of each slug in config order and hands the
+    slug over for writing once all of its URLs are done.
+    """
+
+    def __init__(self, yaml_config):
+        self.remaining = {}
+        self.results = {}
+        self.configs = {}
+
+        for config in yaml_config:
+            slug = config["slug"]
+            self.configs.setdefault(slug, config)
+            self.results.setdefault(slug, {})
+            self.remaining[slug] = self.remaining.get(slug, 0) + len(
+                config["urls"]
+            )
+
+    def done(self, slug, position, parse_result=None):
+        """
+        Mark one URL of a slug done, returning the slug's reorganized
+        result when it was the last one.
+        """
+
+        if parse_result:
+            self.results[slug][position] = parse_result
+
+        self.remaining[slug] -= 1
+        if self.remaining[slug] > 0:
+            return None
+
+        ordered = [
+            result
+            for _, result in sorted(self.results.pop(slug).items())
+            if result
+        ]
+        reorganized, _ = concurrency.reorganize_results(ordered)
+        reorganized = list(reorganized)
+        return reorganized[0] if reorganized else {"slug": slug}
+
+
+async def run_streaming(
+    caching,
+    entries_only,
+    filepath,
+    yaml_generation_time,
+    output_folder,
+    writer_options,
+    state,
+):
+    """
+    Fetch, parse and write every configuration through bounded queues.
+    Each slug is written as soon as its last URL is parsed.
+    """
+
+    logging.info("Processing configurations in streaming mode")
+
+    options = state.executor_options
+    memory_limit = (
+        options.get("memory_limit_mb") or DEFAULT_MEMORY_LIMIT_MB
+    ) * 2**20
+    queue_size = options.get("queue_size") or DEFAULT_QUEUE_SIZE
+
+    yaml_config = processor.run_config(filepath, state)
+    metrics = metrics_helper.Metrics()
+    budget = MemoryBudget(memory_limit)
+    tracker = SlugTracker(yaml_config)
+    session = state.get_session()
+    shared = concurrency.SharedFetches(yaml_config)
+
+    fetch_queue = asyncio.Queue()
+    parse_queue = asyncio.Queue(queue_size)
+    write_queue = asyncio.Queue(queue_size)
+
+    # Queue position keeps the entries of a slug in config order
+    for config in yaml_config:
+        for url in config["urls"]:
+            fetch_queue.put_nowait((fetch_queue.qsize(), config, url))
+
+    num_urls = fetch_queue.qsize()
+    parse_executor = state.get_executor("parse", num_urls)
+    write_executor = state.get_executor("write", len(tracker.configs))
+    process_feed = profiler.wrap(
+        parser.FeedProcessor.process_feed_wrapper,
+        "parse",
+        state.profile_dir,
+        processor.parse_item_key,
+    )
+    output_feed = profiler.wrap(
+        writer.output_feed,
+        "write",
+        state.profile_dir,
+        processor.write_item_key,
+    )
+
+    counts = {"fetched": 0, "cached": 0, "parsed": 0, "found": 0}
+    write_results = []
+
+    async def finish_url(slug, position, parse_result=None):
+        result = tracker.done(slug, position, parse_result)
+        if result is not None:
+            await write_queue.put(result)
+
+    async def fetch_worker():
+        while not fetch_queue.empty():
+            position, config, url = fetch_queue.get_nowait()
+            reserved = await budget.reserve()
+
+            try:
+                result = await concurrency.fetch_url(
+                    config,
+                    url,
+                    caching,
+                    session,
+                    state.jitter,
+                    metrics,
+                    shared,
+                )
+            except Exception as e:
+                logging.error(
+                    f"Error Fetching slug: {config['slug']}, URL: {url}"
+                )
+                logging.error(f"Error {e}")
+                result = None
+
+            if result is None or result[0] == 304:
+                await budget.settle(reserved, 0)
+                if result is not None:
+                    counts["cached"] += 1
+                await finish_url(config["slug"], position)
+            else:
+                counts["fetched"] += 1
+                await budget.settle(reserved, len(result[3]))
+                await parse_queue.put((position, result))
+
+    async def parse_worker():
+        while True:
+            item = await parse_queue.get()
+            if item is None:
+                return
+
+            position, fetch_result = item
+            url = fetch_result[2]
+            try:
+                parse_result = await asyncio.to_thread(
+                    parse_executor.apply, process_feed, fetch_result
+                )
+            except Exception as e:
+                logging.error(f"Error parsing {url}: {e}")
+                parse_result = None
+            finally:
+                await budget.release(len(fetch_result[3]))
+
+            processor.record_parse_metrics(
+                metrics, [fetch_result], [parse_result]
+            )
+            if state.websub is not None:
+                state.websub.observe([fetch_result], [parse_result])
+            if parse_result and parse_result[1]:
+                counts["parsed"] += parse_result[2]
+            await finish_url(fetch_result[1]["slug"], position, parse_result)
+
+    async def write_worker():
+        while True:
+            result = await write_queue.get()
+            if result is None:
+                return
+
+            entries = result.get("aggregated_entries")
+            logging.info(
+                f"Found: {str(len(entries or [])).ljust(3)} entries for {result['slug']}"
+            )
+            if not entries:
+                continue
+
+            counts["found"] += len(entries)
+            writer_args = (
+                [
+                    result["slug"],
+                    entries,
+                    result["feed_data"],
+                    result["feed_type"],
+                    caching,
+                    entries_only,
+                    writer_options,
+                    processor.slug_options(
+                        result["config"], entries_only, writer_options
+                    ),
+                ],
+                output_folder,
+            )
+            try:
+                write_result = await asyncio.to_thread(
+                    write_executor.apply, output_feed, writer_args
+                )
+            except Exception as e:
+                logging.error(f"Error writing {result['slug']}: {e}")
+                continue
+
+            for line in write_result["stdout"]:
+                sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+
+            metrics.record_write(
+                write_result["slug"],
+                write_result["write_seconds"],
+                write_result["outputs"],
+            )
+            write_results.append(write_result)
+
+            # Served feeds update slug by slug as well
+            if state.feed_cache is not None:
+                state.feed_cache.publish([write_result])
+
+    if not os.path.exists("rss_feeds"):
+        os.makedirs("rss_feeds")
+
+    start_time = time.time()
+    fetchers = [
+        asyncio.create_task(fetch_worker())
+        for _ in range(min(queue_size, num_urls) or 1)
+    ]
+    parsers = [
+        asyncio.create_task(parse_worker())
+        for _ in range(parse_executor.workers)
+    ]
+    writers = [
+        asyncio.create_task(write_worker())
+        for _ in range(write_executor.workers)
+    ]
+
+    await asyncio.gather(*fetchers)
+    fetch_end_time = time.time()
+
+    for _ in parsers:
+        await parse_queue.put(None)
+    await asyncio.gather(*parsers)
+
+    for _ in writers:
+        await write_queue.put(None)
+    await asyncio.gather(*writers)
+
+    feed_health.record_run(metrics)
+
+    changed_slugs = writer.write_manifest(output_folder, write_results)
+    if writer_options.get("deltas"):
+        deltas.write_run(output_folder, write_results)
+    end_time = time.time()
+
+    logging.info("")
+    logging.info("Summary:")
+    logging.info("URL Fetching data:")
+    logging.info(f"Number URLs: {num_urls}")
+    logging.info(f"Success:     {counts['fetched']}")
+    logging.info(
+        f"Failed:      {num_urls - counts['fetched'] - counts['cached']}"
+    )
+    logging.info(f"Cached:      {counts['cached']}")
+    logging.info("")
+    logging.info("Feed Parsing data:")
+    logging.info(f"Total entries parsed: {counts['parsed']}")
+    logging.info(f"Total entries found:  {counts['found']}")
+    logging.info("")
+    logging.info("Output writing data:")
+    logging.info(f"Slugs written:   {len(write_results)}")
+    logging.info(f"Slugs changed:   {len(changed_slugs)}")
+    logging.info("")
+    logging.info("Streaming data:")
+    logging.info(f"Memory limit:    {memory_limit / 2**20: .1f} MiB")
+    logging.info(f"Peak in memory:  {budget.peak / 2**20: .1f} MiB")
+    logging.info(f"Fetch throttled: {budget.num_waits} times")
+    logging.info("")
+    logging.info("Time Profile:")
+
+    if yaml_generation_time:
+        logging.info(
+            f"Duration of YAML gen: {yaml_generation_time: .2f} seconds"
+        )
+        metrics.record_stage("yaml", yaml_generation_time)
+    logging.info(
+        f"Duration of fetching: {fetch_end_time - start_time: .2f} seconds"
+    )
+    logging.info(f"Duration of stream:   {end_time - start_time: .2f} seconds")
+    logging.info(f"Parse executor:       {parse_executor.describe()}")
+    logging.info(f"Write executor:       {write_executor.describe()}")
+
+    metrics.record_stage("fetch", fetch_end_time - start_time)
+    metrics.record_stage("stream", end_time - start_time)
+    metrics.finish_run()
+
+    state.metrics.merge(metrics)
+    state.last_report = metrics.report()
+    metrics_helper.write_reports(output_folder, metrics, state.metrics)
@@ -1,25 +1,41 @@
 import helpers.yaml_helpers.concurrency_helper as concurrency
+import helpers.yaml_helpers.config_loader as config_loader
+from helpers.yaml_helpers.run_state import RunState
+import helpers.metrics_helpers.metrics as metrics_helper
+import helpers.metrics_helpers.profiler as profiler
+from helpers.import_helpers.lazy_import import lazy_import
 import helpers.feed_helpers.feed_writer as writer
 import helpers.feed_helpers.feed_parser_class as parser
-from multiprocessing import Pool
+import helpers.feed_helpers.retention as retention
+import helpers.feed_helpers.deltas as deltas
+import helpers.cache_helpers.entry_store as store
+import helpers.cache_helpers.cacher as cacher
+import helpers.cache_helpers.feed_health as feed_health
+import helpers.feed_helpers.renderers as renderers
 import logging
+import asyncio
 import time
 import yaml
+import sys
 import os
 
+stream_processor = lazy_import("helpers.yaml_helpers.stream_processor")
+shard_helper = lazy_import("helpers.yaml_helpers.shard_helper")
+
+DEFAULT_YAML_FILEPATH = "yaml_config/rss_config.yaml"
+
 
 def load_yaml_config(filepath=None):
     """
     Load YAML configuration from a given file path or the default path.
+    The compiled config is cached next to the file, so only changed files
+    are parsed and validated again.
     """
 
-    default_path = "yaml_config/rss_config.yaml"
-
-    filepath = filepath or default_path
+    filepath = filepath or DEFAULT_YAML_FILEPATH
 
     try:
-        with open(filepath, "r") as f:
-            return yaml.safe_load(f)
+        return config_loader.load_config(filepath)
     except FileNotFoundError:
         logging.error(f"Error File '{filepath}' not found.")
     except PermissionError:
@@ -33,37 +49,319 @@ def load_yaml_config(filepath=None):
     exit(1)
 
 
+def run_config(filepath, state):
+    """
+    Compiled config of a run, as kept by a ConfigWatcher or from the file.
+    URLs WebSub hubs push are not polled, with demote_feeds neither are
+    URLs the feed health policy holds back.
+    """
+
+    config = state.config
+    if config is None:
+        config = load_yaml_config(filepath)
+    if state.websub is not None:
+        config = state.websub.polled_config(config)
+    if state.executor_options.get("demote_feeds"):
+        config = feed_health.polled_config(config)
+    return config
+
+
+def slug_options(config, entries_only, writer_options):
+    """
+    Per-slug writer options, YAML record values take precedence over the CLI.
+    """
+
+    return {
+        "retention": retention.slug_retention(config, writer_options),
+        "formats": renderers.resolve_formats(
+            config.get("formats") or writer_options.get("formats"),
+            entries_only,
+        ),
+    }
+
+
+def record_parse_metrics(metrics, async_results, multi_results):
+    """
+    Per-URL parse metrics, executor.map keeps results in input order.
+    """
+
+    for fetch_result, parse_result in zip(async_results, multi_results):
+        slug, url = fetch_result[1]["slug"], fetch_result[2]
+        if not parse_result or not parse_result[1]:
+            metrics.record_parse_error(slug, url)
+            continue
+
+        metrics.record_parse(
+            slug,
+            url,
+            parse_result[1]["parse_seconds"],
+            parse_result[2],
+            len(parse_result[1]["filtered_entries"]),
+        )
+
+
+def build_writer_args(
+    aggregated_results, caching, entries_only, writer_options
+):
+    """
+    Writer arguments of every slug with new entries.
+    """
+
+    writer_args_list = []
+    total_entries_found = 0
+
+    for result in aggregated_results:
+        if result["aggregated_entries"]:
+            logging.info(
+                f'Found: {str(len(result["aggregated_entries"])).ljust(3)} entries for {result["slug"]}'
+            )
+
+            total_entries_found += len(result["aggregated_entries"])
+
+            result_List = [
+                result["slug"],
+                result["aggregated_entries"],
+                result["feed_data"],
+                result["feed_type"],
+                caching,
+                entries_only,
+                writer_options,
+                slug_options(result["config"], entries_only, writer_options),
+            ]
+            writer_args_list.append(result_List)
+
+        else:
+            logging.info(f'Found: 0   entries for {result["slug"]}')
+
+    return writer_args_list, total_entries_found
+
+
+def parse_item_key(fetch_result):
+    return f"{fetch_result[1]['slug']} {fetch_result[2]}"
+
+
+def write_item_key(writer_args):
+    return writer_args[0][0]
+
+
+def write_outputs(writer_args_folder, state):
+    """
+    Write every slug with the write stage executor, streaming NDJSON lines
+    to stdout as soon as each slug is done.
+    """
+
+    write_results = []
+    executor = state.get_executor("write", len(writer_args_folder))
+
+    output_feed = profiler.wrap(
+        writer.output_feed, "write", state.profile_dir, write_item_key
+    )
+
+    for write_result in executor.imap_unordered(
+        output_feed, writer_args_folder
+    ):
+        for line in write_result["stdout"]:
+            sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+        write_results.append(write_result)
+
+    return write_results, executor.describe()
+
+
+def parse_results(async_results, state):
+    """
+    Parse every fetched body with the parse stage executor.
+    """
+
+    executor = state.get_executor(
+        "parse",
+        len(async_results),
+        sum(len(result[3]) for result in async_results),
+    )
+    process_feed = profiler.wrap(
+        parser.FeedProcessor.process_feed_wrapper,
+        "parse",
+        state.profile_dir,
+        parse_item_key,
+    )
+    multi_results = executor.map(process_feed, async_results)
+
+    return multi_results, executor.describe()
+
+
 def process_yaml(
     caching=False,
     entries_only=True,
     filepath=None,
     yaml_generation_time=None,
     output_folder=None,
+    writer_options=None,
+    executor_options=None,
 ):
     """
     Process YAML by fetching, parsing, and writing to XML files.
     """
 
+    return asyncio.run(
+        process_yaml_async(
+            caching,
+            entries_only,
+            filepath,
+            yaml_generation_time,
+            output_folder,
+            writer_options,
+            RunState(executor_options),
+            close_state=True,
+        )
+    )
+
+
+async def process_yaml_async(
+    caching=False,
+    entries_only=True,
+    filepath=None,
+    yaml_generation_time=None,
+    output_folder=None,
+    writer_options=None,
+    state=None,
+    close_state=False,
+):
+    """
+    Process YAML on the running event loop. Parsing and writing run in
+    their executors from a worker thread, so the loop stays responsive.
+    """
+
+    writer_options = writer_options or {}
+    state = state or RunState()
+
+    # Streaming connects the stages with bounded queues instead of running
+    # each stage over every configuration
+    # Shards hand their parse results to the merge, so they never stream
+    run = (
+        stream_processor.run_streaming
+        if state.executor_options.get("stream")
+        and not state.executor_options.get("shard")
+        else run_stages
+    )
+
+    try:
+        return await run(
+            caching,
+            entries_only,
+            filepath,
+            yaml_generation_time,
+            output_folder,
+            writer_options,
+            state,
+        )
+
+    finally:
+        if close_state:
+            await state.close()
+
+
+async def process_push(
+    url,
+    body,
+    content_type,
+    caching,
+    entries_only,
+    output_folder,
+    writer_options,
+    state,
+):
+    """
+    Filter and write a feed body a WebSub hub pushed, the same way as a
+    fetched one, for every slug following the URL.
+    """
+
+    fetch_results = [
+        (
+            200,
+            config,
+            url,
+            body,
+            caching,
+            cacher.fetch_cache(config["slug"] + url) if caching else None,
+            content_type,
+        )
+        for config in state.config or []
+        if url in config["urls"]
+    ]
+    if not fetch_results:
+        logging.info(f"Ignoring push of {url}, it is no longer configured")
+        return
+
+    multi_results, _ = await asyncio.to_thread(
+        parse_results, fetch_results, state
+    )
+    aggregated_results, total_num_entries = concurrency.reorganize_results(
+        multi_results
+    )
+    writer_args_list, total_entries_found = build_writer_args(
+        aggregated_results, caching, entries_only, writer_options
+    )
+
+    logging.info(
+        f"Push of {url}: {total_num_entries} entries parsed, "
+        f"{total_entries_found} found"
+    )
+    if not writer_args_list:
+        return
+
+    write_results, _ = await asyncio.to_thread(
+        write_outputs,
+        [(args, output_folder) for args in writer_args_list],
+        state,
+    )
+    if writer_options.get("deltas"):
+        deltas.write_run(output_folder, write_results)
+    if state.feed_cache is not None:
+        state.feed_cache.publish(write_results)
+
+
+async def run_stages(
+    caching,
+    entries_only,
+    filepath,
+    yaml_generation_time,
+    output_folder,
+    writer_options,
+    state,
+):
+    """
+    Fetch, parse and write every configuration.
+    """
+
     logging.info("Processing configurations with concurrency")
 
-    yaml_config = load_yaml_config(filepath)
+    yaml_config = run_config(filepath, state)
+    metrics = metrics_helper.Metrics()
+
+    shard = state.executor_options.get("shard")
+    if shard:
+        yaml_config, positions = shard_helper.shard_config(yaml_config, shard)
 
     aggregated_results = []
     multi_results = []
     async_start_time = time.time()
-    # (response status, config, url, response data, caching, cache_data)
-    url_data, async_results, all_304_slugs = concurrency.async_run(
-        yaml_config, caching
+    # (response status, config, url, response bytes, caching, cache_data,
+    #  content type)
+    url_data, async_results, all_304_slugs = await concurrency.fetch_all_urls(
+        yaml_config, caching, state.get_session(), state.jitter, metrics
     )
     async_end_time = time.time()
 
     logging.info("Parsing all configurations")
     parser_start_time = time.time()
-    with Pool() as pool:
-        multi_results = pool.map(
-            parser.FeedProcessor.process_feed_wrapper, async_results
-        )
+    multi_results, parse_executor = await asyncio.to_thread(
+        parse_results, async_results, state
+    )
 
+    record_parse_metrics(metrics, async_results, multi_results)
+    if state.websub is not None:
+        state.websub.observe(async_results, multi_results)
+    feed_health.record_run(metrics)
     aggregated_results, total_num_entries = concurrency.reorganize_results(
         multi_results
     )
@@ -72,43 +370,34 @@ def process_yaml(
     logging.info("")
     parser_end_time = time.time()
 
+    if shard:
+        # Another node merges the shards and writes the outputs
+        shard_helper.write_partials(
+            state.executor_options.get("shard_dir") or shard_helper.SHARD_DIR,
+            shard,
+            positions,
+            async_results,
+            multi_results,
+        )
+        logging.info(f"Number URLs: {url_data[0]}")
+        logging.info(f"Total entries parsed: {total_num_entries}")
+        logging.info(
+            f"Duration of fetching: {async_end_time - async_start_time: .2f} seconds"
+        )
+        logging.info(
+            f"Duration of parsing:  {parser_end_time - parser_start_time: .2f} seconds"
+        )
+        return
+
     # Write to XML files
-    writer_args_list = []
-    total_entries_found = 0
     writer_start_time = time.time()
 
     if not os.path.exists("rss_feeds"):
         os.makedirs("rss_feeds")
 
-    for result in aggregated_results:
-        if result["aggregated_entries"]:
-            logging.info(
-                f'Found: {str(len(result["aggregated_entries"])).ljust(3)} entries for {result["slug"]}'
-            )
-
-            total_entries_found += len(result["aggregated_entries"])
-
-            result_List = [
-                result["slug"],
-                result["aggregated_entries"],
-                result["feed_data"],
-                result["feed_type"],
-                caching,
-                entries_only,
-            ]
-            writer_args_list.append(result_List)
-
-        else:
-            logging.info(f'Found: 0   entries for {result["slug"]}')
-
-            result_List = [
-                result["slug"],
-                None,
-                None,
-                None,
-                caching,
-                entries_only,
-            ]
+    writer_args_list, total_entries_found = build_writer_args(
+        aggregated_results, caching, entries_only, writer_options
+    )
 
     for slug in all_304_slugs:
         logging.info(f"Found: 0   entries for {slug}")
@@ -118,12 +407,25 @@ def process_yaml(
 
     writer_args_folder = [(args, output_folder) for args in writer_args_list]
 
-    with Pool() as pool:
-        pool.map(writer.output_feed, writer_args_folder)
+    write_results, write_executor = await asyncio.to_thread(
+        write_outputs, writer_args_folder, state
+    )
+    changed_slugs = writer.write_manifest(output_folder, write_results)
+    if writer_options.get("deltas"):
+        deltas.write_run(output_folder, write_results)
+    if state.feed_cache is not None:
+        state.feed_cache.publish(write_results)
 
     logging.info("Finished writing to XML files")
     writer_end_time = time.time()
 
+    for write_result in write_results:
+        metrics.record_write(
+            write_result["slug"],
+            write_result["write_seconds"],
+            write_result["outputs"],
+        )
+
     logging.info("")
     logging.info("Finished processing all configurations")
     logging.info("")
@@ -141,12 +443,27 @@ def process_yaml(
     logging.info(f"Total entries parsed: {total_num_entries}")
     logging.info(f"Total entries found:  {total_entries_found}")
     logging.info("")
+    logging.info("Output writing data:")
+    logging.info(f"Slugs written:   {len(write_results)}")
+    logging.info(f"Slugs changed:   {len(changed_slugs)}")
+    logging.info("")
     logging.info("Time Profile:")
 
     async_duration = async_end_time - async_start_time
     parser_duration = parser_end_time - parser_start_time
     writer_duration = writer_end_time - writer_start_time
 
+    if yaml_generation_time:
+        metrics.record_stage("yaml", yaml_generation_time)
+    metrics.record_stage("fetch", async_duration)
+    metrics.record_stage("parse", parser_duration)
+    metrics.record_stage("write", writer_duration)
+    metrics.finish_run()
+
+    state.metrics.merge(metrics)
+    state.last_report = metrics.report()
+    metrics_helper.write_reports(output_folder, metrics, state.metrics)
+
     if yaml_generation_time:
         logging.info(
             f"Duration of YAML gen: {yaml_generation_time: .2f} seconds"
@@ -154,3 +471,103 @@ def process_yaml(
     logging.info(f"Duration of fetching: {async_duration: .2f} seconds")
     logging.info(f"Duration of parsing:  {parser_duration: .2f} seconds")
     logging.info(f"Duration of writing:  {writer_duration: .2f} seconds")
+    logging.info(f"Parse executor:       {parse_executor}")
+    logging.info(f"Write executor:       {write_executor}")
+
+
+def render_store(
+    entries_only=True,
+    output_folder=None,
+    writer_options=None,
+    executor_options=None,
+    filepath=None,
+):
+    """
+    Re-render every slug in the entry store without fetching or parsing,
+    with the options of its YAML record like a normal run.
+    """
+
+    writer_options = writer_options or {}
+    slugs = store.fetch_slugs()
+
+    # Records of a slug share their output settings, the first one will do
+    slug_configs = {}
+    if filepath or os.path.exists(DEFAULT_YAML_FILEPATH):
+        for record in load_yaml_config(filepath):
+            slug_configs.setdefault(record["slug"], record)
+    else:
+        logging.warning(
+            f"No {DEFAULT_YAML_FILEPATH}, rendering every slug with the "
+            "command line options"
+        )
+
+    logging.info(f"Rendering {len(slugs)} slugs from the entry store")
+
+    writer_args_folder = [
+        (
+            [
+                slug,
+                None,
+                None,
+                None,
+                False,
+                entries_only,
+                writer_options,
+                # Slugs no longer configured get the command line options
+                slug_options(
+                    slug_configs.get(slug, {}), entries_only, writer_options
+                ),
+            ],
+            output_folder,
+        )
+        for slug in slugs
+    ]
+
+    state = RunState(executor_options)
+    try:
+        write_results, _ = write_outputs(writer_args_folder, state)
+    finally:
+        state.close_executors()
+
+    writer.write_manifest(output_folder, write_results)
+
+    logging.info("Finished rendering from the entry store")
+
+
+def merge_shards(
+    shard_dir,
+    caching=False,
+    entries_only=True,
+    output_folder=None,
+    writer_options=None,
+    executor_options=None,
+):
+    """
+    Write the final outputs from the partial results of every shard.
+    """
+
+    writer_options = writer_options or {}
+    aggregated_results, total_num_entries = shard_helper.load_partials(
+        shard_dir
+    )
+
+    writer_args_list, total_entries_found = build_writer_args(
+        aggregated_results, caching, entries_only, writer_options
+    )
+    writer_args_folder = [(args, output_folder) for args in writer_args_list]
+
+    state = RunState(executor_options)
+    try:
+        write_results, _ = write_outputs(writer_args_folder, state)
+    finally:
+        state.close_executors()
+
+    changed_slugs = writer.write_manifest(output_folder, write_results)
+    if writer_options.get("deltas"):
+        deltas.write_run(output_folder, write_results)
+
+    logging.info("")
+    logging.info(f"Total entries parsed: {total_num_entries}")
+    logging.info(f"Total entries found:  {total_entries_found}")
+    logging.info(f"Slugs written:   {len(write_results)}")
+    logging.info(f"Slugs changed:   {len(changed_slugs)}")
@@ -1,9 +1,15 @@
-from pyairtable import Api
+from helpers.import_helpers.lazy_import import lazy_import
+from helpers.feed_helpers.file_helper import atomic_write
+import helpers.yaml_helpers.airtable_sync as airtable_sync
 import logging
 import yaml
 import json
 import os
 
+pyairtable = lazy_import("pyairtable")
+
+YAML_FILEPATH = "yaml_config/rss_config.yaml"
+
 
 class MyDumper(yaml.Dumper):
     """
@@ -36,28 +42,18 @@ def auth(airtable_data):
 
     try:
         logging.info("Authenticating with Airtable")
-        return Api(airtable_data["AIRTABLE_API_KEY"])
-
-    except Exception as e:
-        logging.error(f"Error authenticating with Airtable: {e}")
-        return None
-
-
-def fetch_table_data(api, airtable_data, fields):
-    """
-    Fetch specified fields from Airtable table.
-    """
 
-    try:
-        logging.info("Fetching table data from Airtable")
-        table = api.table(
-            airtable_data["AIRTABLE_BASE_ID"],
-            airtable_data["AIRTABLE_TABLE_NAME"],
-        )
-        return [record["fields"] for record in table.all(fields=fields)]
+        # A local stand-in (dev_tools/airtable_stand_in.py) can be used
+        # instead of the Airtable API
+        endpoint_url = airtable_data.get("AIRTABLE_ENDPOINT_URL")
+        if endpoint_url:
+            return pyairtable.Api(
+                airtable_data["AIRTABLE_API_KEY"], endpoint_url=endpoint_url
+            )
+        return pyairtable.Api(airtable_data["AIRTABLE_API_KEY"])
 
     except Exception as e:
-        logging.error(f"Error fetching table data from Airtable: {e}")
+        logging.error(f"Error authenticating with Airtable: {e}")
         return None
 
 
@@ -100,9 +96,11 @@ def validate(data):
     return filtered_data
 
 
-def generate_yaml():
+def generate_yaml(full_sync=False):
     """
-    Fetch data from Airtable, process, and save as a YAML file.
+    Sync data from Airtable, process, and save as a YAML file.
+    The file is only rewritten when its content changes, returns whether
+    it did.
     """
 
     # Read JSON file
@@ -114,8 +112,10 @@ def generate_yaml():
     # Specify fields to fetch from Airtable
     TABLE_FIELDS = ["name", "slug", "urls", "match", "exclude"]
 
-    # Fetch data from Airtable
-    table_data = fetch_table_data(api, airtable_data, TABLE_FIELDS)
+    # Fetch the records changed since the last sync from Airtable
+    table_data = airtable_sync.sync_table(
+        api, airtable_data, TABLE_FIELDS, full_sync
+    )
 
     if not table_data:
         logging.info("No data found in Airtable or an error occurred, exiting")
@@ -132,21 +132,33 @@ def generate_yaml():
     # Validate data
     processed_data = validate(processed_data)
 
-    # Save data as YAML file
+    # Save data as YAML file, unless nothing changed, so the cached config
+    # and anything watching the file are left alone
 
     if not os.path.exists("yaml_config"):
         os.makedirs("yaml_config")
 
-    with open("yaml_config/rss_config.yaml", "w") as f:
-        f.write(
-            yaml.dump(
-                processed_data,
-                sort_keys=False,
-                indent=4,
-                allow_unicode=True,
-                Dumper=MyDumper,
-            )
-        )
+    yaml_text = yaml.dump(
+        processed_data,
+        sort_keys=False,
+        indent=4,
+        allow_unicode=True,
+        Dumper=MyDumper,
+    )
+
+    try:
+        with open(YAML_FILEPATH, "r") as f:
+            unchanged = f.read() == yaml_text
+    except FileNotFoundError:
+        unchanged = False
+
+    if unchanged:
+        logging.info("YAML config file unchanged")
+        logging.info("")
+        return False
+
+    atomic_write(YAML_FILEPATH, yaml_text)
 
     logging.info("YAML config file saved")
     logging.info("")
+    return True
@@ -0,0 +1,175 @@
+from helpers.feed_helpers.entry_model import timestamp_to_rfc3339
+import helpers.cache_helpers.search_index as search_index
+import helpers.feed_helpers.retention as retention
+import argparse
+import json
+import time
+import sys
+import os
+
+
+def timestamp_arg(value):
+    timestamp = retention.parse_timestamp(value)
+    if timestamp is None:
+        raise argparse.ArgumentTypeError(f"Invalid date '{value}'")
+    return timestamp
+
+
+def slugs_arg(value):
+    return [slug.strip() for slug in value.split(",") if slug.strip()]
+
+
+def print_hits(hits, page, has_more, duration):
+    for rank, hit in enumerate(hits, 1):
+        print(
+            f"{rank: >3}. [{hit['slug']}] {hit['title']}  "
+            f"({timestamp_to_rfc3339(hit['timestamp'])})"
+        )
+        print(f"     {hit['link'] or hit['entry_id']}")
+        print(f"     {hit['snippet']}")
+
+    more = f", next: --page {page + 1}" if has_more else ""
+    print(f"Page {page}, {len(hits)} hits in {duration * 1000:.1f} ms{more}")
+
+
+def query_command(args):
+    start_time = time.perf_counter()
+    hits, has_more = search_index.search(
+        args.query,
+        args.slugs,
+        args.since,
+        args.until,
+        args.page,
+        args.per_page,
+        args.order,
+    )
+    duration = time.perf_counter() - start_time
+
+    if args.json:
+        json.dump(
+            {"page": args.page, "has_more": has_more, "hits": hits},
+            sys.stdout,
+            ensure_ascii=False,
+            indent=2,
+        )
+        print("")
+    else:
+        print_hits(hits, args.page, has_more, duration)
+
+
+def stats_command(args):
+    stats = search_index.stats()
+    print(f"Entries: {stats['entries']}")
+    print(f"Slugs:   {len(stats['slugs'])}")
+    if stats["entries"]:
+        print(f"Oldest:  {timestamp_to_rfc3339(stats['oldest'])}")
+        print(f"Newest:  {timestamp_to_rfc3339(stats['newest'])}")
+    print(f"Size:    {stats['size'] / 2**20:.1f} MiB")
+    if args.slugs:
+        for slug, count in stats["slugs"].items():
+            print(f"  {slug}: {count}")
+
+
+def compact_command(args):
+    older_than = None
+    if args.older_than_days is not None:
+        older_than = time.time() - args.older_than_days * 24 * 60 * 60
+
+    before = search_index.stats()["size"]
+    num_deleted = search_index.compact(older_than, args.drop_slugs)
+    after = search_index.stats()["size"]
+    print(
+        f"Dropped {num_deleted} entries, index {before / 2**20:.1f} MiB "
+        f"-> {after / 2**20:.1f} MiB"
+    )
+
+
+def cli_main():
+    """
+    Search the entries indexed by aggregator.py --index.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Full-text search over aggregated entries"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    query_parser = commands.add_parser(
+        "query", help="Search the index (FTS5 query syntax)"
+    )
+    query_parser.add_argument("query", type=str)
+    query_parser.add_argument(
+        "--slug",
+        type=slugs_arg,
+        default=None,
+        dest="slugs",
+        help="Comma separated slugs to search in",
+    )
+    query_parser.add_argument(
+        "--since",
+        type=timestamp_arg,
+        default=None,
+        help="Only entries published or updated at or after this date",
+    )
+    query_parser.add_argument(
+        "--until",
+        type=timestamp_arg,
+        default=None,
+        help="Only entries published or updated before this date",
+    )
+    query_parser.add_argument("--page", type=int, default=1)
+    query_parser.add_argument("--per_page", type=int, default=20)
+    query_parser.add_argument(
+        "--order",
+        type=str,
+        choices=["rank", "time"],
+        default="rank",
+        help="Best matches first (default) or newest first",
+    )
+    query_parser.add_argument(
+        "--json", default=False, action="store_true", help="Print JSON"
+    )
+
+    stats_parser = commands.add_parser("stats", help="Index size and counts")
+    stats_parser.add_argument(
+        "--slugs",
+        default=False,
+        action="store_true",
+        help="Also list the entries per slug",
+    )
+
+    compact_parser = commands.add_parser(
+        "compact",
+        help="Drop old entries, merge the index and reclaim space",
+    )
+    compact_parser.add_argument(
+        "--older_than_days",
+        type=float,
+        default=None,
+        help="Drop entries older than this many days",
+    )
+    compact_parser.add_argument(
+        "--drop_slugs",
+        type=slugs_arg,
+        default=None,
+        help="Comma separated slugs to drop from the index",
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(search_index.INDEX_FILEPATH):
+        print("No search index yet, run aggregator.py with --index first")
+        sys.exit(1)
+
+    if args.command == "query":
+        if args.page < 1 or args.per_page < 1:
+            parser.error("--page and --per_page must be at least 1")
+        query_command(args)
+    elif args.command == "stats":
+        stats_command(args)
+    else:
+        compact_command(args)
+
+
+if __name__ == "__main__":
+    cli_main()